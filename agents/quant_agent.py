@@ -11,23 +11,53 @@ class QuantAgent:
             tool = QuantToolkit()
             if not tool.features: tool.train_model()
             
-            result = tool.get_market_ranking()
-            if "error" in result: return f"❌ Lỗi Quant: {result['error']}"
+            ranking = tool.get_full_ranking()
+            ranks = tool.get_ticker_ranks([ticker], ranking=ranking)
+            if "error" in ranks: return f"❌ Lỗi Quant: {ranks['error']}"
             
-            target_info = "Neutral"
-            score = 50.0
-            for item in result.get("top_strong_buy", []):
-                if item['ticker'] == ticker:
-                    target_info = "STRONG BUY"
-                    score = item['confidence']
-                    break
-            
-            return f"""
-            ### 🤖 DỰ BÁO ĐỊNH LƯỢNG
-            - **Mã:** {ticker}
-            - **Xếp hạng:** {target_info}
-            - **Điểm:** {score:.1f}
-            """
+            symbol = ticker.upper().strip()
+            report = QuantToolkit.render_rank_report(symbol, ranks[symbol])
+
+            # Tỷ trọng số từ bộ tối ưu danh mục (thay vì để LLM tự đoán % NAV),
+            # tính trên quỹ thật: NAV + danh mục đang nắm trong PortfolioManager
+            try:
+                from engine.portfolio_manager import PortfolioManager
+                from engine.portfolio_optimizer import PortfolioOptimizer
+                from engine.risk_engine import RiskEngine, RiskConfig
+
+                pm = PortfolioManager()
+                try:
+                    risk_engine = RiskEngine(tool.repo)
+                    data = risk_engine.data()
+                    prices = {} if data is None else {
+                        t: float(data.price[i]) * RiskConfig.PRICE_MULTIPLIER for t, i in data.index.items()}
+                    holdings = pm.get_holdings()
+                    plan = PortfolioOptimizer(tool.repo).optimize(ranking, nav=pm.get_nav(prices), holdings=holdings)
+                    if "error" in plan:
+                        report += f"\n- Tỷ trọng tối ưu: không tính được ({plan['error']})"
+                    else:
+                        pos = next((p for p in plan["positions"] if p["ticker"] == symbol), None)
+                        weight = f"{pos['weight'] * 100:.1f}% NAV ({pos['shares']} CP)" if pos else "0% NAV (không nằm trong danh mục tối ưu)"
+                        order = next((o for o in plan["orders"] if o["ticker"] == symbol), None)
+                        action = f"{order['action']} {order['quantity']} CP" if order else "Giữ nguyên"
+                        report += (f"\n- Quỹ: NAV {plan['nav']:,.0f} VND | Đang nắm {symbol}: {holdings.get(symbol, 0)} CP"
+                                   f"\n- Tỷ trọng tối ưu ({plan['method']}): {weight} | Lệnh {symbol}: {action}"
+                                   f"\n- Danh mục: {plan['weights']} | Vol năm: {plan['volatility_annual']:.1%}")
+
+                        # Rủi ro danh mục đang nắm và sau khi đặt các lệnh của kế hoạch (kiểm tra hạn mức)
+                        check = risk_engine.check_plan(pm, plan)
+                        if "error" in check:
+                            report += "\n" + RiskEngine.render(check)
+                        else:
+                            verdict = "ĐẠT hạn mức" if check["approved"] else \
+                                f"VƯỢT hạn mức {[b['limit'] for b in check['breaches']]}"
+                            report += ("\n- Rủi ro danh mục hiện tại:\n" + RiskEngine.render(check["current"]) +
+                                       f"\n- Rủi ro sau kế hoạch ({verdict}):\n" + RiskEngine.render(check["proposed"]))
+                finally:
+                    pm.conn.close()
+            except Exception as e:
+                report += f"\n- Tỷ trọng tối ưu: không tính được ({e})"
+            return report
 
         # Quant train model rất nặng -> đẩy vào Thread
         quant_report = await asyncio.to_thread(_run_quant)
@@ -7,23 +7,36 @@ class TechnicalAgent:
         print(f"📈 [Technical Agent] Đang soi chart {ticker}...", file=sys.stderr)
         
         # Lazy import: tránh block startup bằng heavy deps (pandas, numpy...)
-        def _get_report():
+        def _get_snapshot():
             from tools.market_tool import MarketToolkit
-            return MarketToolkit.get_technical_report(ticker)
+            # Snapshot cache theo (mã, ngày bar): dùng chung với scanner/chart, không tính lại chỉ báo
+            snap = MarketToolkit.get_indicator_snapshot(ticker)
+            return snap, (MarketToolkit.technical_sections(snap) if snap else None)
         
-        tech_data = await asyncio.to_thread(_get_report)
+        snap, sections = await asyncio.to_thread(_get_snapshot)
+        if snap is None:
+            return f"⚠️ Không có dữ liệu giá cho {ticker}, bỏ qua phân tích kỹ thuật."
+        tech_data = "".join(sections)
+        _, zones, flow = sections
+        levels = (f"SMA50 {snap.sma50:,.0f} | SMA200 {snap.sma200:,.0f} | "
+                  f"Bollinger {snap.bb_lower:,.0f} - {snap.bb_upper:,.0f} | Kijun {snap.kijun:,.0f}")
+        # Chỉ nhắc tới mục 4/5 khi báo cáo thực sự có các mục đó (chưa có dữ liệu vùng giá / khối ngoại -> bỏ qua)
+        flow_hint = " và dòng tiền khối ngoại (mục 5)" if flow else ""
+        level_hint = ("dùng đúng các mức giá ở mục 4, không tự đặt mức khác" if zones else
+                      "chỉ dùng các mốc giá tham chiếu SMA/Bollinger/Kijun ở trên, không tự đặt mức khác")
         
         system_prompt = "Bạn là Trader chuyên nghiệp theo trường phái Price Action & Indicator Confluence."
         user_prompt = f"""
         Phân tích kỹ thuật mã {ticker} dựa trên dữ liệu:
         {tech_data}
+        Các mốc giá tham chiếu: {levels}
         
         YÊU CẦU:
         1. **Cấu trúc thị trường:** Giá đang ở Phase nào (Tích lũy, Tăng trưởng, Phân phối, Đè giá)?
-        2. **Sự hợp lưu (Confluence):** Các chỉ báo (RSI, MACD, Ichimoku, Volume) có đồng thuận không hay mâu thuẫn?
-        3. **Setup Giao dịch:**
+        2. **Sự hợp lưu (Confluence):** Các chỉ báo (RSI, MACD, Ichimoku, Volume){flow_hint} có đồng thuận không hay mâu thuẫn?
+        3. **Setup Giao dịch:** ({level_hint})
            - Entry an toàn (Vùng hỗ trợ/Pullback).
-           - Stoploss (Bắt buộc).
+           - Stoploss (Bắt buộc, tham chiếu gợi ý cắt lỗ theo ATR).
            - Take Profit (Kháng cự).
         """
         
@@ -0,0 +1,87 @@
+import os
+import sys
+import asyncio
+import importlib.util
+
+# =============================================================================
+# REGISTRY CLIENT HTTP DÙNG CHUNG CẢ PROCESS (agent qua core/llm.py + RAG engine)
+# Mỗi (endpoint, API key, event loop) chỉ 1 AsyncOpenAI với 1 pool kết nối httpx giới hạn,
+# giữ keep-alive -> không tạo pool / bắt tay TLS mới cho từng lần gọi LLM.
+# =============================================================================
+
+class ClientConfig:
+    MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))            # Tổng kết nối đồng thời / endpoint
+    MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))    # Kết nối rảnh giữ lại để tái sử dụng
+    KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))        # Giây
+    TIMEOUT = float(os.getenv("LLM_TIMEOUT", 300))
+    CONNECT_TIMEOUT = 10.0
+    MAX_RETRIES = 2
+    # HTTP/2 cần gói "h2" (tùy chọn); không có -> HTTP/1.1 keep-alive
+    HTTP2 = os.getenv("LLM_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+_clients = {}
+_closing = set()    # Task đóng bù client mồ côi (giữ tham chiếu để không bị GC giữa chừng)
+
+def _normalize(base_url: str) -> str:
+    """'http://host/v1/' và 'http://host' -> cùng 1 endpoint 'http://host/v1'."""
+    url = (base_url or "").rstrip("/")
+    return url if url.endswith("/v1") else f"{url}/v1"
+
+def _prune():
+    """
+    Tách khỏi registry các client của event loop đã đóng mà caller quên await close_clients()
+    (asyncio.run / loop riêng của từng worker). Trả về list client để đóng bù.
+    """
+    stale = [_clients.pop(k)[1] for k in [k for k, (loop, _) in _clients.items() if loop.is_closed()]]
+    if stale:
+        print(f"⚠️ [LLM] {len(stale)} client của event loop đã đóng chưa được close_clients() -> đóng bù", file=sys.stderr)
+    return stale
+
+async def _discard(clients):
+    """
+    Đóng bù (best-effort) client mồ côi. Kết nối keep-alive còn mở gắn với loop cũ nên có thể
+    không đóng được ("Event loop is closed") -> socket bị rò cho tới khi process thoát, chỉ log lại.
+    """
+    for client in clients:
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"⚠️ [LLM] Không đóng được client của loop cũ ({e}); socket rò tới khi thoát process. "
+                  f"Mọi asyncio.run phải await close_clients() trước khi kết thúc.", file=sys.stderr)
+
+def get_openai_client(base_url: str, api_key: str):
+    """
+    AsyncOpenAI dùng chung cho endpoint trong event loop hiện tại (phải gọi bên trong coroutine).
+    Client httpx gắn với event loop tạo ra nó nên registry khóa thêm theo loop.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    key = (_normalize(base_url), api_key, id(loop))
+    entry = _clients.get(key)
+    if entry is None or entry[0] is not loop:
+        stale = _prune()
+        if stale:
+            task = loop.create_task(_discard(stale))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+        c = ClientConfig
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=c.MAX_CONNECTIONS,
+                                max_keepalive_connections=c.MAX_KEEPALIVE,
+                                keepalive_expiry=c.KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(c.TIMEOUT, connect=c.CONNECT_TIMEOUT),
+            http2=c.HTTP2,
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=key[0], http_client=http_client, max_retries=c.MAX_RETRIES)
+        entry = _clients[key] = (loop, client)
+    return entry[1]
+
+async def close_clients():
+    """Đóng các client của event loop hiện tại (gọi trước khi loop kết thúc)."""
+    loop = asyncio.get_running_loop()
+    for key in [k for k, (l, _) in _clients.items() if l is loop]:
+        _, client = _clients.pop(key)
+        await client.close()
+    await _discard(_prune())
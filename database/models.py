@@ -57,6 +57,17 @@ class AgentLog(Base):
     reason = Column(Text) # Lý do cốt lõi
     full_report_path = Column(String(255)) # Đường dẫn file báo cáo chi tiết (nếu cần)
 
+# --- 5. BẢNG GIÁM SÁT MODEL QUANT (Drift / IC theo ngày) ---
+class QuantMetric(Base):
+    __tablename__ = 'quant_metrics'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    date = Column(DateTime, index=True)          # Phiên của snapshot được đánh giá
+    model = Column(String(50), index=True)       # Mã phiên bản model (hash file model)
+    metric = Column(String(50), index=True)      # psi / ks / rolling_ic / retrain_flag ...
+    feature = Column(String(100))                # Tên feature (NULL = chỉ số tổng hợp)
+    value = Column(Float)
+    created_at = Column(DateTime, default=datetime.now)
+
 def init_db():
     """Hàm khởi tạo bảng"""
     Base.metadata.create_all(bind=engine)
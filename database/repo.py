@@ -1,5 +1,7 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from .models import MarketDataDaily, MarketDataIntraday, AgentLog, SessionLocal
+from .models import Symbol, MarketDataDaily, MarketDataIntraday, AgentLog, QuantMetric, SessionLocal, engine
+from . import versions
 from datetime import datetime
 import pandas as pd
 import numpy as np
@@ -50,6 +52,7 @@ class DataRepository:
         if new_records:
             self.db.add_all(new_records)
             self.db.commit()
+            versions.bump([ticker]) # Báo cache giá (PriceCache) nạp lại mã này
             
         return count
 
@@ -70,6 +73,39 @@ class DataRepository:
             print(f"⚠️ Lỗi lưu log: {e}")
             self.db.rollback()
 
+    def save_quant_metrics(self, records: list) -> int:
+        """
+        Ghi các chỉ số giám sát model (list dict: date, model, metric, feature, value).
+        Ghi đè bản ghi cũ cùng (date, model) để chạy lại 1 ngày không bị trùng.
+        """
+        if not records: return 0
+        try:
+            QuantMetric.__table__.create(bind=engine, checkfirst=True)
+            for date, model in {(r['date'], r['model']) for r in records}:
+                self.db.query(QuantMetric).filter(QuantMetric.date == date, QuantMetric.model == model).delete()
+            self.db.bulk_insert_mappings(QuantMetric, records)
+            self.db.commit()
+            return len(records)
+        except Exception as e:
+            print(f"⚠️ Lỗi lưu quant metrics: {e}")
+            self.db.rollback()
+            return 0
+
+    def get_quant_metrics(self, metric: str = None, feature: str = None, days: int = 90) -> pd.DataFrame:
+        """Lịch sử chỉ số giám sát (mới nhất sau cùng). feature=None: mọi feature."""
+        try:
+            QuantMetric.__table__.create(bind=engine, checkfirst=True)
+            q = self.db.query(QuantMetric.date, QuantMetric.model, QuantMetric.metric,
+                              QuantMetric.feature, QuantMetric.value)
+            if metric: q = q.filter(QuantMetric.metric == metric)
+            if feature: q = q.filter(QuantMetric.feature == feature)
+            cutoff = datetime.now() - pd.Timedelta(days=days)
+            rows = q.filter(QuantMetric.date >= cutoff).order_by(QuantMetric.date.asc()).all()
+            return pd.DataFrame(rows, columns=['date', 'model', 'metric', 'feature', 'value'])
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc quant metrics: {e}")
+            return pd.DataFrame()
+
     def get_price_history(self, ticker: str, days: int = 3650) -> pd.DataFrame:
         """
         Lấy dữ liệu lịch sử chuẩn hóa cho Quant Tool.
@@ -112,4 +148,72 @@ class DataRepository:
             
         except Exception as e:
             print(f"⚠️ Lỗi đọc DB {ticker}: {e}")
-            return pd.DataFrame()
\ No newline at end of file
+            return pd.DataFrame()
+
+    def get_data_fingerprint(self, tickers: list) -> list:
+        """
+        Dấu vân tay dữ liệu giá (rẻ, 1 query GROUP BY): (ticker, số dòng, ngày đầu, ngày cuối).
+        Dùng làm khóa phiên bản cho cache dataset: có bar mới -> fingerprint đổi.
+        """
+        try:
+            rows = self.db.query(
+                MarketDataDaily.ticker,
+                func.count(MarketDataDaily.id),
+                func.min(MarketDataDaily.date),
+                func.max(MarketDataDaily.date)
+            ).filter(
+                MarketDataDaily.ticker.in_(list(tickers))
+            ).group_by(MarketDataDaily.ticker).order_by(MarketDataDaily.ticker).all()
+            return [(t, int(n), str(d0), str(d1)) for t, n, d0, d1 in rows]
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc fingerprint DB: {e}")
+            return []
+
+    def get_tickers(self) -> list:
+        """Danh sách mã có dữ liệu giá ngày trong DB (sắp xếp A-Z)."""
+        try:
+            rows = self.db.query(MarketDataDaily.ticker).distinct().order_by(MarketDataDaily.ticker).all()
+            return [t for (t,) in rows]
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc danh sách mã DB: {e}")
+            return []
+
+    def get_industry_map(self, tickers: list) -> dict:
+        """Ngành của từng mã theo bảng symbols: {ticker: industry}. Mã chưa có ngành không có trong dict."""
+        try:
+            rows = self.db.query(Symbol.ticker, Symbol.industry).filter(
+                Symbol.ticker.in_(list(tickers)), Symbol.industry.isnot(None)
+            ).all()
+            return {t: ind for t, ind in rows if ind}
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc ngành DB: {e}")
+            return {}
+
+    def get_price_panel(self, tickers: list, days: int = 3650, fields=("close",), start=None) -> dict:
+        """
+        Lấy giá nhiều mã trong 1 query, trả về dạng panel: {field: DataFrame (date x ticker)}.
+        Phiên mã không giao dịch (chưa niêm yết / tạm ngừng) để NaN.
+        start: chỉ đọc từ ngày này (lọc ngay trong SQL, tránh quét toàn bộ lịch sử).
+        """
+        try:
+            cols = [getattr(MarketDataDaily, f) for f in fields]
+            query = self.db.query(MarketDataDaily.date, MarketDataDaily.ticker, *cols).filter(
+                MarketDataDaily.ticker.in_(list(tickers))
+            )
+            if start is not None:
+                query = query.filter(MarketDataDaily.date >= pd.Timestamp(start).to_pydatetime())
+            rows = query.order_by(MarketDataDaily.date.asc()).all()
+            if not rows:
+                return {}
+
+            df = pd.DataFrame(rows, columns=['date', 'ticker', *fields])
+            df['date'] = pd.to_datetime(df['date'])
+            panel = {}
+            for f in fields:
+                wide = df.pivot_table(index='date', columns='ticker', values=f, aggfunc='last')
+                wide = wide.reindex(columns=[t for t in tickers if t in wide.columns])
+                panel[f] = wide.tail(days) if days > 0 else wide
+            return panel
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc panel giá DB: {e}")
+            return {}
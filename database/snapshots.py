@@ -0,0 +1,41 @@
+# database/snapshots.py
+"""
+Tiện ích dùng chung cho các store tính sẵn hằng đêm (vùng giá, dòng tiền khối ngoại...):
+- JsonSnapshot: tra file JSON trong bộ nhớ, chỉ đọc lại khi file đổi (1 lần os.stat / lần tra).
+- session_window_start: ngày lịch bắt đầu đủ chứa N phiên gần nhất để lọc ngay trong SQL.
+"""
+import os
+import json
+import threading
+import pandas as pd
+
+# ~1.6 ngày lịch / phiên (cuối tuần) + đệm cho kỳ nghỉ lễ dài (Tết)
+CALENDAR_PER_SESSION = 1.6
+HOLIDAY_BUFFER_DAYS = 30
+
+class JsonSnapshot:
+    """File JSON ghi atomic (tmp + replace) bởi process khác; đọc lại chỉ khi (đường dẫn, mtime, size) đổi."""
+    def __init__(self):
+        self._data = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def load(self, path) -> dict:
+        """Nội dung file ({} nếu chưa có file)."""
+        try:
+            st = os.stat(path)
+            stamp = (path, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return {}
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    with open(path, "r", encoding="utf-8") as f:
+                        self._data = json.load(f)
+                    self._stamp = stamp
+        return self._data
+
+def session_window_start(sessions: int) -> pd.Timestamp:
+    """Ngày lịch bắt đầu chứa đủ `sessions` phiên gần nhất (dư cho cuối tuần/lễ)."""
+    days = int(sessions * CALENDAR_PER_SESSION) + HOLIDAY_BUFFER_DAYS
+    return pd.Timestamp.now().normalize() - pd.Timedelta(days=days)
@@ -0,0 +1,55 @@
+# database/versions.py
+"""
+Phiên bản dữ liệu giá theo mã (sự kiện "có bar mới").
+DataRepository.save_daily_data gọi bump() sau khi ghi bar mới; các cache đọc current()
+để biết mã nào cần nạp lại. Lưu ra file JSON nhỏ nên crawler (process riêng) và
+server/agent (process khác) dùng chung được; kiểm tra chỉ tốn 1 lần os.stat.
+"""
+import os
+import json
+import time
+import threading
+
+VERSION_PATH = os.path.join("data", "price_versions.json")
+
+_LOCK = threading.Lock()
+_STATE = {"stamp": None, "versions": {}}
+
+def _read():
+    try:
+        with open(VERSION_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _stamp():
+    try:
+        st = os.stat(VERSION_PATH)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def bump(tickers):
+    """Đánh dấu các mã vừa có bar mới (tăng version). Ghi atomic (tmp + replace)."""
+    tickers = [t.upper() for t in tickers]
+    if not tickers:
+        return
+    with _LOCK:
+        versions = _read()
+        stamp = time.time_ns()
+        for t in tickers:
+            versions[t] = max(stamp, versions.get(t, 0) + 1)
+        os.makedirs(os.path.dirname(VERSION_PATH) or ".", exist_ok=True)
+        tmp = f"{VERSION_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(versions, f)
+        os.replace(tmp, VERSION_PATH)
+        _STATE.update(stamp=_stamp(), versions=versions)
+
+def current():
+    """{ticker: version} hiện tại (đọc lại file chỉ khi file đổi)."""
+    stamp = _stamp()
+    if stamp != _STATE["stamp"]:
+        with _LOCK:
+            _STATE.update(stamp=stamp, versions=_read())
+    return _STATE["versions"]
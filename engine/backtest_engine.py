@@ -0,0 +1,264 @@
+# engine/backtest_engine.py
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class BacktestConfig:
+    INITIAL_CAPITAL = 500_000_000   # VND (bằng vốn MAIN_FUND của PortfolioManager)
+    PRICE_MULTIPLIER = 1000         # Giá trong DB (vnstock) tính theo nghìn đồng
+    LOT_SIZE = 100                  # Lô chẵn HOSE
+
+    REBALANCE_EVERY = 5             # Số phiên giữa 2 lần tái cơ cấu
+    EXECUTION_LAG = 1               # Tín hiệu cuối phiên t -> khớp ATC phiên t+1
+    TOP_K = 5
+    WEIGHTING = "equal"             # "equal" | "rank" (tỷ trọng tuyến tính theo hạng)
+    MAX_WEIGHT = 0.25               # Phần vượt trần tỷ trọng để lại tiền mặt
+
+    # Phí & thuế
+    BUY_FEE = 0.0015
+    SELL_FEE = 0.0015
+    SELL_TAX = 0.001                # Thuế TNCN 0.1% trên giá trị bán
+
+    # T+2.5: mua phiên t, cổ phiếu về chiều t+2 -> bán được từ ATC phiên t+2
+    SETTLEMENT_DAYS = 2
+    SETTLE_CASH = False             # True: tiền bán cũng chờ T+2 (không ứng trước tiền bán)
+
+    # Biên độ giá: phiên đóng cửa ở giá trần không mua được, ở giá sàn không bán được
+    PRICE_BAND = 0.07               # HOSE ±7%
+    BAND_TOLERANCE = 0.002          # Trần/sàn thực tế bị làm tròn theo bước giá
+
+    TRADING_DAYS = 252
+
+# =============================================================================
+# 2. ENGINE
+# =============================================================================
+
+class BacktestEngine:
+    """
+    Backtest danh mục Top-K theo điểm xếp hạng trên panel (phiên x mã).
+    Mỗi phiên chỉ là vài phép toán numpy trên vector các mã nên 10 năm x toàn bộ
+    universe chạy trong khoảng 1 giây, đủ nhanh để quét tham số.
+    """
+    def __init__(self, **overrides):
+        self.cfg = {k: v for k, v in vars(BacktestConfig).items() if k.isupper()}
+        unknown = set(overrides) - set(self.cfg)
+        if unknown:
+            raise ValueError(f"Tham số backtest không hợp lệ: {sorted(unknown)}")
+        self.cfg.update(overrides)
+
+    @staticmethod
+    def scores_panel(dates, tickers, scores):
+        """Đổi điểm dạng dài (mỗi dòng 1 cặp phiên-mã) sang panel phiên x mã."""
+        df = pd.DataFrame({"date": pd.to_datetime(np.asarray(dates)),
+                           "ticker": np.asarray(tickers), "score": np.asarray(scores, dtype=np.float64)})
+        return df.pivot_table(index="date", columns="ticker", values="score", aggfunc="last")
+
+    def target_weights(self, scores):
+        """Tỷ trọng mục tiêu cho 1 phiên từ vector điểm (NaN = không được chọn)."""
+        cfg = self.cfg
+        w = np.zeros(len(scores))
+        valid = np.flatnonzero(np.isfinite(scores))
+        k = min(cfg["TOP_K"], len(valid))
+        if k == 0:
+            return w
+        top = valid[np.argsort(-scores[valid], kind="stable")[:k]]
+        if cfg["WEIGHTING"] == "rank":
+            raw = np.arange(k, 0, -1, dtype=np.float64)
+            w[top] = raw / raw.sum()
+        else:
+            w[top] = 1.0 / k
+        return np.minimum(w, cfg["MAX_WEIGHT"])
+
+    def run(self, scores, close):
+        """
+        scores: DataFrame (phiên x mã) điểm dự báo tính với dữ liệu đến cuối phiên.
+        close:  DataFrame (phiên x mã) giá đóng cửa (đơn vị như DB).
+        Trả về dict: equity, returns, drawdown, turnover (Series), trades (DataFrame), stats.
+        """
+        cfg = self.cfg
+        start_time = time.perf_counter()
+
+        close = close.sort_index()
+        scores = scores.reindex(index=close.index, columns=close.columns)
+        dates = close.index
+        n_days, n = close.shape
+        if n_days == 0 or n == 0:
+            return {"error": "Panel giá rỗng"}
+
+        mult, lot = cfg["PRICE_MULTIPLIER"], cfg["LOT_SIZE"]
+        px = close.values.astype(np.float64)
+        mark = close.ffill().values.astype(np.float64)            # Giá định giá (giữ giá cuối khi tạm ngừng)
+        ref = np.vstack([np.full(n, np.nan), mark[:-1]])          # Giá tham chiếu = đóng cửa phiên trước
+        with np.errstate(invalid="ignore", divide="ignore"):
+            chg = px / ref - 1.0
+        band = cfg["PRICE_BAND"] - cfg["BAND_TOLERANCE"]
+        at_ceiling = chg >= band
+        at_floor = chg <= -band
+        S = scores.values.astype(np.float64)
+
+        # Phiên khớp lệnh: phiên tín hiệu (mỗi REBALANCE_EVERY phiên kể từ phiên đầu có điểm) + độ trễ
+        has_signal = np.flatnonzero(np.isfinite(S).any(axis=1))
+        execute = np.zeros(n_days, dtype=bool)
+        if len(has_signal):
+            signal_days = np.arange(has_signal[0], n_days, cfg["REBALANCE_EVERY"])
+            exec_days = signal_days + cfg["EXECUTION_LAG"]
+            execute[exec_days[exec_days < n_days]] = True
+
+        settle = max(int(cfg["SETTLEMENT_DAYS"]), 1)
+        shares = np.zeros(n, dtype=np.int64)
+        locked_shares = np.zeros((settle, n), dtype=np.int64)    # Vòng đệm: cổ phiếu mua trong `settle` phiên gần nhất
+        pending_cash = np.zeros(settle)                           # Vòng đệm: tiền bán chưa về (khi SETTLE_CASH)
+        cash = float(cfg["INITIAL_CAPITAL"])
+        buy_cost = 1.0 + cfg["BUY_FEE"]
+        sell_keep = 1.0 - cfg["SELL_FEE"] - cfg["SELL_TAX"]
+
+        equity = np.empty(n_days)
+        turnover = np.zeros(n_days)
+        exposure = np.zeros(n_days)
+        fees_paid, blocked_buys, blocked_sells = 0.0, 0, 0
+        trades = []
+
+        for i in range(n_days):
+            slot = i % settle
+            locked_shares[slot] = 0                               # Hàng mua phiên i-settle đã về
+            cash += pending_cash[slot]
+            pending_cash[slot] = 0.0
+
+            value = np.where(shares > 0, shares * mark[i], 0.0) * mult
+            eq = cash + pending_cash.sum() + value.sum()
+
+            if execute[i] and eq > 0:
+                p = px[i]
+                tradable = np.isfinite(p) & (p > 0)
+                w = self.target_weights(S[i - cfg["EXECUTION_LAG"]])
+                lot_value = np.where(tradable, p * mult * lot, np.inf)
+                # Chừa phần phí mua để lệnh mua không vượt quá tiền mặt
+                target = np.where(tradable, np.floor(w * eq / buy_cost / lot_value) * lot, shares).astype(np.int64)
+                delta = target - shares
+
+                # 1. Bán trước: chỉ bán hàng đã về, không bán được khi giá sàn
+                want_sell = np.maximum(-delta, 0)
+                sell = np.minimum(want_sell, shares - locked_shares.sum(axis=0))
+                floor_hit = at_floor[i] & (want_sell > 0)
+                sell[floor_hit | ~tradable] = 0
+                blocked_sells += int(np.count_nonzero(want_sell > sell))  # Kẹt sàn hoặc hàng chưa về
+                sell_value = np.where(sell > 0, sell * p, 0.0) * mult
+                proceeds = sell_value.sum() * sell_keep
+                if cfg["SETTLE_CASH"]:
+                    pending_cash[slot] += proceeds
+                else:
+                    cash += proceeds
+
+                # 2. Mua: không khớp khi giá trần; thiếu tiền thì thu nhỏ đều theo lô
+                want_buy = np.maximum(delta, 0)
+                buy = want_buy.copy()
+                ceiling_hit = at_ceiling[i] & (want_buy > 0)
+                buy[ceiling_hit | ~tradable] = 0
+                blocked_buys += int(np.count_nonzero(ceiling_hit))
+                buy_value = np.where(buy > 0, buy * p, 0.0) * mult
+                need = buy_value.sum() * buy_cost
+                if need > cash > 0:
+                    buy = (np.floor(buy * (cash / need) / lot) * lot).astype(np.int64)
+                    buy_value = np.where(buy > 0, buy * p, 0.0) * mult
+                elif cash <= 0:
+                    buy[:] = 0
+                    buy_value[:] = 0.0
+                cash -= buy_value.sum() * buy_cost
+
+                shares += buy - sell
+                locked_shares[slot] = buy
+                traded = sell_value.sum() + buy_value.sum()
+                fees_paid += sell_value.sum() * (1.0 - sell_keep) + buy_value.sum() * (buy_cost - 1.0)
+                turnover[i] = traded / eq
+
+                # Ghi lệnh dạng mảng (phiên, mã, số lượng có dấu); dựng DataFrame 1 lần ở cuối
+                filled = np.flatnonzero(sell | buy)
+                if len(filled):
+                    trades.append(np.column_stack([np.full(len(filled), i), filled,
+                                                   buy[filled] - sell[filled]]))
+
+            value = np.where(shares > 0, shares * mark[i], 0.0) * mult
+            equity[i] = cash + pending_cash.sum() + value.sum()
+            exposure[i] = value.sum() / equity[i] if equity[i] > 0 else 0.0
+
+        equity = pd.Series(equity, index=dates, name="equity")
+        returns = equity.pct_change().fillna(0.0).rename("returns")
+        drawdown = (equity / equity.cummax() - 1.0).rename("drawdown")
+        turnover = pd.Series(turnover, index=dates, name="turnover")
+        trades = self._trades_frame(trades, dates, close.columns, px)
+
+        # Benchmark: danh mục đều tỷ trọng toàn universe, tái cân bằng hằng ngày, không phí
+        valid_chg = np.isfinite(chg)
+        bench_ret = np.where(valid_chg, chg, 0.0).sum(axis=1) / np.maximum(valid_chg.sum(axis=1), 1)
+        benchmark = pd.Series(np.cumprod(1.0 + bench_ret), index=dates, name="benchmark")
+
+        stats = self.summary(equity, returns, drawdown, turnover, benchmark)
+        stats.update(
+            total_fees=round(float(fees_paid), 0),
+            n_rebalances=int(execute.sum()),
+            n_trades=len(trades),
+            blocked_buys=blocked_buys,
+            blocked_sells=blocked_sells,
+            avg_exposure=round(float(exposure.mean()), 4),
+            elapsed_seconds=round(time.perf_counter() - start_time, 3),
+        )
+        return {
+            "equity": equity, "returns": returns, "drawdown": drawdown,
+            "turnover": turnover, "benchmark": benchmark, "trades": trades, "stats": stats,
+        }
+
+    @staticmethod
+    def _trades_frame(chunks, dates, tickers, px):
+        cols = ["date", "ticker", "side", "quantity", "price"]
+        if not chunks:
+            return pd.DataFrame(columns=cols)
+        day, col, qty = np.concatenate(chunks).T
+        # Mã vừa bán vừa mua trong cùng phiên không xảy ra (delta chỉ 1 chiều) -> dấu xác định chiều lệnh
+        return pd.DataFrame({
+            "date": dates[day], "ticker": np.asarray(tickers)[col],
+            "side": np.where(qty > 0, "BUY", "SELL"), "quantity": np.abs(qty),
+            "price": px[day, col],
+        }, columns=cols)
+
+    def summary(self, equity, returns, drawdown, turnover, benchmark):
+        days = self.cfg["TRADING_DAYS"]
+        n = max(len(equity) - 1, 1)
+        total = equity.iloc[-1] / equity.iloc[0] - 1.0
+        vol = returns.std() * np.sqrt(days)
+        return {
+            "start": str(equity.index[0].date()),
+            "end": str(equity.index[-1].date()),
+            "total_return": round(float(total), 4),
+            "cagr": round(float((1.0 + total) ** (days / n) - 1.0), 4),
+            "ann_volatility": round(float(vol), 4),
+            "sharpe": round(float(returns.mean() * days / (vol + 1e-12)), 3),
+            "max_drawdown": round(float(drawdown.min()), 4),
+            "ann_turnover": round(float(turnover.sum() * days / n), 2),
+            "benchmark_return": round(float(benchmark.iloc[-1] / benchmark.iloc[0] - 1.0), 4),
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig, QuantToolkit
+
+    qt = QuantToolkit()
+    matrix = qt.load_training_matrix()
+    if matrix is None or qt.backend is None:
+        print("❌ Cần dữ liệu trong DB và model đã train (tools/quant_tool.py).")
+        sys.exit(1)
+
+    X = np.asarray(matrix.X)[:, [matrix.features.index(f) for f in qt.features]]
+    scores = BacktestEngine.scores_panel(matrix.dates, matrix.tickers, qt.backend.predict(X))
+    close = qt.repo.get_price_panel(QuantConfig.TICKERS, days=0)["close"]
+
+    result = BacktestEngine().run(scores, close)
+    print("⚠️ Lưu ý: điểm tính bằng model hiện tại trên toàn lịch sử (gồm cả giai đoạn train).")
+    for k, v in result["stats"].items():
+        print(f"   {k}: {v}")
@@ -0,0 +1,261 @@
+# engine/backtest_sweep.py
+import os
+import json
+import time
+import shutil
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from engine.backtest_engine import BacktestConfig, BacktestEngine
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from engine.backtest_engine import BacktestConfig, BacktestEngine
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class SweepConfig:
+    RESULTS_DIR = os.path.join("data", "backtests")
+    PANEL_DIR = os.path.join("data", "backtests", "panels")
+    MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+    FLUSH_EVERY = 50            # Ghi ra Parquet sau mỗi N kết quả
+
+    # Lưới mặc định: 5 x 4 x 2 x 3 x 2 = 240 cấu hình / model
+    GRID = {
+        "TOP_K": [3, 5, 7, 10, 15],
+        "REBALANCE_EVERY": [1, 3, 5, 10],
+        "WEIGHTING": ["equal", "rank"],
+        "BUY_FEE": [0.001, 0.0015, 0.0025],
+        "SETTLE_CASH": [False, True],
+    }
+
+def expand_grid(grid, models=("current",)):
+    """Tích Descartes của lưới tham số x các phiên bản model -> list cấu hình."""
+    keys = list(grid)
+    configs = []
+    for model in models:
+        for values in itertools.product(*(grid[k] for k in keys)):
+            cfg = {"MODEL": model}
+            for k, v in zip(keys, values):
+                default = getattr(BacktestConfig, k)
+                # Ép kiểu theo giá trị mặc định để cột Parquet có kiểu thống nhất (VD: 0 -> 0.0)
+                cfg[k] = type(default)(v) if isinstance(default, (bool, int, float)) else v
+            configs.append(cfg)
+    return configs
+
+# =============================================================================
+# 2. PANEL (memmap, dùng chung giữa các process)
+# =============================================================================
+
+class BacktestPanel:
+    """
+    Panel phiên x mã cho backtest: giá đóng cửa + điểm của từng phiên bản model.
+    Lưu dạng .npy; process con chỉ nhận đường dẫn và memmap lại (không copy dữ liệu).
+    """
+    def __init__(self, close, scores, dates, tickers, meta=None, path=None):
+        self.close = close
+        self.scores = scores            # {model_name: ndarray (phiên x mã)}
+        self.dates = dates
+        self.tickers = list(tickers)
+        self.meta = meta or {}
+        self.path = path
+
+    def close_frame(self):
+        return pd.DataFrame(self.close, index=pd.DatetimeIndex(self.dates), columns=self.tickers, copy=False)
+
+    def scores_frame(self, model):
+        return pd.DataFrame(self.scores[model], index=pd.DatetimeIndex(self.dates), columns=self.tickers, copy=False)
+
+    @classmethod
+    def from_frames(cls, close, scores, meta=None):
+        """close: DataFrame phiên x mã; scores: {model_name: DataFrame phiên x mã (hoặc dạng tương thích)}."""
+        close = close.sort_index()
+        aligned = {name: np.ascontiguousarray(s.reindex(index=close.index, columns=close.columns).values,
+                                              dtype=np.float64)
+                   for name, s in scores.items()}
+        return cls(np.ascontiguousarray(close.values, dtype=np.float64), aligned,
+                   close.index.values.astype("datetime64[ns]"), close.columns, meta)
+
+    def save(self, path):
+        tmp = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "close.npy"), self.close)
+        np.save(os.path.join(tmp, "dates.npy"), self.dates)
+        for name, arr in self.scores.items():
+            np.save(os.path.join(tmp, f"scores_{name}.npy"), arr)
+        meta = dict(self.meta, tickers=self.tickers, models=list(self.scores),
+                    created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        scores = {name: np.load(os.path.join(path, f"scores_{name}.npy"), mmap_mode="r")
+                  for name in meta["models"]}
+        return cls(np.load(os.path.join(path, "close.npy"), mmap_mode="r"), scores,
+                   np.load(os.path.join(path, "dates.npy")), meta["tickers"], meta, path)
+
+    def __getstate__(self):
+        if self.path:
+            return {"path": self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {"path"}:
+            state = BacktestPanel.load(state["path"]).__dict__
+        self.__dict__.update(state)
+
+def build_panel(repo, matrix, model_paths, start=None):
+    """
+    Dựng (hoặc lấy từ cache) panel backtest từ TrainingMatrix + các file model XGBoost.
+    model_paths: {tên phiên bản: đường dẫn model}. start: chỉ giữ các phiên >= start.
+    """
+    import xgboost as xgb
+    from tools.quant_tool import QuantConfig
+
+    digests = {}
+    for name, path in model_paths.items():
+        with open(path, "rb") as f:
+            digests[name] = hashlib.sha1(f.read()).hexdigest()[:12]
+    payload = {"matrix": matrix.meta.get("key"), "models": digests, "start": str(start)}
+    key = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(SweepConfig.PANEL_DIR, key)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        print(f"⚡ [Sweep] Panel cache HIT {key}")
+        return BacktestPanel.load(path)
+
+    close = repo.get_price_panel(QuantConfig.TICKERS, days=0).get("close")
+    if close is None or close.empty:
+        return None
+    if start is not None:
+        close = close.loc[close.index >= pd.Timestamp(start)]
+
+    X_all = np.asarray(matrix.X)
+    scores = {}
+    for name, model_path in model_paths.items():
+        booster = xgb.Booster(model_file=model_path)
+        features = booster.feature_names or matrix.features
+        X = np.ascontiguousarray(X_all[:, [matrix.features.index(f) for f in features]])
+        best = booster.attr("best_iteration")
+        pred = booster.inplace_predict(X, iteration_range=(0, int(best) + 1) if best is not None else (0, 0),
+                                       validate_features=False)
+        scores[name] = BacktestEngine.scores_panel(matrix.dates, matrix.tickers, pred)
+
+    panel = BacktestPanel.from_frames(close, scores, meta={"key": key, **payload})
+    os.makedirs(SweepConfig.PANEL_DIR, exist_ok=True)
+    panel.save(path)
+    return BacktestPanel.load(path)
+
+# =============================================================================
+# 3. WORKER
+# =============================================================================
+
+_SHARED = {}
+
+def _init_worker(panel):
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = "1"
+    # DataFrame bọc trực tiếp memmap, dựng 1 lần cho mỗi process
+    _SHARED.update(close=panel.close_frame(),
+                   scores={name: panel.scores_frame(name) for name in panel.scores})
+
+def _run_config(config_id, cfg):
+    params = {k: v for k, v in cfg.items() if k != "MODEL"}
+    result = BacktestEngine(**params).run(_SHARED["scores"][cfg["MODEL"]], _SHARED["close"])
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return dict(config_id=config_id, **cfg, **result["stats"])
+
+# =============================================================================
+# 4. RUNNER
+# =============================================================================
+
+class BacktestSweep:
+    def __init__(self, max_workers=SweepConfig.MAX_WORKERS, flush_every=SweepConfig.FLUSH_EVERY,
+                 results_dir=SweepConfig.RESULTS_DIR):
+        self.max_workers = max_workers
+        self.flush_every = flush_every
+        self.results_dir = results_dir
+
+    def run(self, panel, configs, output_path=None):
+        """
+        Chạy toàn bộ cấu hình trên process pool, ghi dần kết quả ra bảng Parquet.
+        Trả về DataFrame kết quả (đọc lại từ file) sắp xếp theo Sharpe.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if panel.path is None:
+            raise ValueError("Panel cần được lưu (save) trước để chia sẻ memmap giữa các process.")
+        os.makedirs(self.results_dir, exist_ok=True)
+        output_path = output_path or os.path.join(
+            self.results_dir, f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet")
+
+        print(f"🧪 [Sweep] {len(configs)} cấu hình, {self.max_workers} worker -> {output_path}")
+        start = time.time()
+        writer, buffer, done, failed = None, [], 0, 0
+
+        def flush():
+            nonlocal writer
+            if not buffer:
+                return
+            if writer is None:
+                table = pa.Table.from_pylist(buffer)
+                writer = pq.ParquetWriter(output_path, table.schema)
+            else:
+                table = pa.Table.from_pylist(buffer, schema=writer.schema)
+            writer.write_table(table)
+            buffer.clear()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                     initargs=(panel,)) as pool:
+                futures = [pool.submit(_run_config, i, cfg) for i, cfg in enumerate(configs)]
+                for fut in as_completed(futures):
+                    try:
+                        buffer.append(fut.result())
+                        done += 1
+                    except Exception as e:
+                        failed += 1
+                        print(f"⚠️ [Sweep] Cấu hình lỗi: {e}")
+                    if len(buffer) >= self.flush_every:
+                        flush()
+                        print(f"   ... {done}/{len(configs)} ({time.time() - start:.1f}s)")
+                flush()
+        finally:
+            if writer is not None:
+                writer.close()
+
+        elapsed = time.time() - start
+        print(f"✅ [Sweep] Xong {done} cấu hình ({failed} lỗi) trong {elapsed:.1f}s")
+        if done == 0:
+            return pd.DataFrame()
+        return pd.read_parquet(output_path).sort_values("sharpe", ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from tools.quant_tool import QuantConfig, QuantToolkit
+
+    qt = QuantToolkit()
+    matrix = qt.load_training_matrix()
+    if matrix is None or not os.path.exists(QuantConfig.MODEL_PATH):
+        print("❌ Cần dữ liệu trong DB và model đã train (tools/quant_tool.py).")
+    else:
+        panel = build_panel(qt.repo, matrix, {"current": QuantConfig.MODEL_PATH})
+        results = BacktestSweep().run(panel, expand_grid(SweepConfig.GRID, models=list(panel.scores)))
+        print(results.head(10).to_string())
@@ -49,17 +49,64 @@ class PortfolioManager:
         stocks = cursor.fetchall()
         return {"cash": cash, "inventory": stocks}
 
-    def execute_trade(self, action, ticker, price, quantity, date_str):
+    def execute_trade(self, action, ticker, price, quantity, date_str, fee=0):
         cursor = self.conn.cursor()
         if action == "BUY":
-            cost = price * quantity
+            cost = price * quantity + fee
             cursor.execute("UPDATE balance SET cash = cash - ? WHERE fund_id = 'MAIN_FUND'", (cost,))
             cursor.execute("INSERT INTO inventory (ticker, quantity, buy_price, buy_date, status) VALUES (?,?,?,?,'PENDING')",
                            (ticker, quantity, price, date_str))
         elif action == "SELL":
             # Logic bán hàng AVAILABLE
-            revenue = price * quantity
+            revenue = price * quantity - fee
             cursor.execute("UPDATE balance SET cash = cash + ? WHERE fund_id = 'MAIN_FUND'", (revenue,))
-            # Xóa bớt số lượng trong kho (Ưu tiên lô cũ nhất)
-            cursor.execute("DELETE FROM inventory WHERE ticker = ? AND status = 'AVAILABLE' LIMIT 1", (ticker,))
-        self.conn.commit()
\ No newline at end of file
+            # Trừ dần số lượng trong kho (Ưu tiên lô cũ nhất)
+            cursor.execute("SELECT id, quantity FROM inventory WHERE ticker = ? AND status = 'AVAILABLE' "
+                           "ORDER BY buy_date, id", (ticker,))
+            remaining = quantity
+            for row_id, qty in cursor.fetchall():
+                if remaining <= 0: break
+                if qty <= remaining:
+                    cursor.execute("DELETE FROM inventory WHERE id = ?", (row_id,))
+                else:
+                    cursor.execute("UPDATE inventory SET quantity = ? WHERE id = ?", (qty - remaining, row_id))
+                remaining -= qty
+        self.conn.commit()
+
+    def get_holdings(self, status=None):
+        """Số cổ phiếu đang nắm theo mã: {ticker: quantity}. status='AVAILABLE' -> chỉ phần đã về (bán được)."""
+        cursor = self.conn.cursor()
+        if status:
+            cursor.execute("SELECT ticker, SUM(quantity) FROM inventory WHERE status = ? GROUP BY ticker", (status,))
+        else:
+            cursor.execute("SELECT ticker, SUM(quantity) FROM inventory GROUP BY ticker")
+        return {t: int(q) for t, q in cursor.fetchall() if q}
+
+    def get_nav(self, prices):
+        """NAV = tiền mặt + giá trị cổ phiếu theo `prices` {ticker: giá VND}."""
+        status = self.get_fund_status()
+        return status["cash"] + sum(q * prices.get(t, 0) for t, q in self.get_holdings().items())
+
+    def apply_plan(self, plan, date_str):
+        """
+        Thực hiện danh sách lệnh từ PortfolioOptimizer (engine/portfolio_optimizer.py):
+        bán trước (chỉ phần AVAILABLE theo T+2), mua sau trong giới hạn tiền mặt (đã tính phí của lệnh).
+        Trả về list lệnh đã khớp.
+        """
+        self.update_settlement(date_str)
+        available = self.get_holdings("AVAILABLE")
+        filled = []
+        for order in plan.get("orders", []):
+            qty = order["quantity"]
+            fee_rate = order.get("fee", 0) / (order["price"] * qty) if qty else 0.0
+            if order["action"] == "SELL":
+                qty = min(qty, available.get(order["ticker"], 0))
+            else:
+                cash = self.get_fund_status()["cash"]
+                lot = plan.get("lot_size", 100)
+                qty = min(qty, int(cash // (order["price"] * (1 + fee_rate) * lot)) * lot)
+            if qty <= 0: continue
+            fee = round(order["price"] * qty * fee_rate)
+            self.execute_trade(order["action"], order["ticker"], order["price"], qty, date_str, fee)
+            filled.append(dict(order, quantity=qty, fee=fee))
+        return filled
\ No newline at end of file
@@ -0,0 +1,363 @@
+# engine/portfolio_optimizer.py
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    from engine.backtest_engine import BacktestConfig
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from engine.backtest_engine import BacktestConfig
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class OptimizerConfig:
+    METHOD = "mean_variance"        # "mean_variance" | "risk_parity"
+    NAV = BacktestConfig.INITIAL_CAPITAL
+    PRICE_MULTIPLIER = BacktestConfig.PRICE_MULTIPLIER
+    LOT_SIZE = BacktestConfig.LOT_SIZE
+    BUY_FEE = BacktestConfig.BUY_FEE
+    SELL_FEE = BacktestConfig.SELL_FEE
+    SELL_TAX = BacktestConfig.SELL_TAX
+
+    # Covariance
+    LOOKBACK_DAYS = 250             # ~1 năm lợi nhuận ngày
+    MIN_HISTORY = 60                # Mã ít phiên hơn -> loại khỏi danh mục
+    CACHE_DIR = os.path.join("data", "portfolio")
+
+    # Alpha từ điểm xếp hạng (Grinold): alpha_i = IC * sigma_i * z_i
+    ALPHA_IC = 0.05
+    RISK_AVERSION = 5.0
+    N_CANDIDATES = 10               # Risk parity: chỉ phân bổ cho N mã điểm cao nhất
+
+    # Ràng buộc
+    MAX_WEIGHT = BacktestConfig.MAX_WEIGHT
+    SECTOR_CAP = 0.40               # Tổng tỷ trọng 1 ngành (VD ngân hàng chiếm 14/30 mã VN30)
+    MAX_GROSS = 1.0                 # Tổng tỷ trọng cổ phiếu (phần còn lại giữ tiền mặt)
+    ADV_DAYS = 20                   # Thanh khoản: giá trị giao dịch bình quân N phiên
+    MAX_ADV_PARTICIPATION = 0.10    # Mỗi phiên chỉ khớp tối đa 10% thanh khoản...
+    LIQUIDATION_DAYS = 3            # ...và phải thoát hết vị thế trong N phiên
+    MIN_WEIGHT = 0.01               # Tỷ trọng nhỏ hơn -> bỏ (không đáng 1 lệnh)
+
+# =============================================================================
+# 2. COVARIANCE (Ledoit-Wolf, cache lợi nhuận tăng dần)
+# =============================================================================
+
+class CovarianceCache:
+    """
+    Giữ cửa sổ lợi nhuận ngày (phiên x mã) trên đĩa. Mỗi lần gọi chỉ đọc các phiên mới
+    từ DB (get_price_panel(start=...)), nối vào cửa sổ rồi ước lượng lại Ledoit-Wolf (vài ms).
+    """
+    def __init__(self, repo, lookback=OptimizerConfig.LOOKBACK_DAYS, cache_dir=OptimizerConfig.CACHE_DIR):
+        self.repo = repo
+        self.lookback = lookback
+        self.cache_dir = cache_dir
+        self._memo = {}
+
+    def _path(self, tickers):
+        import hashlib
+        key = hashlib.sha1(",".join(sorted(tickers)).encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"prices_{key}.parquet")
+
+    def _load_prices(self, tickers, fields=("close", "volume")):
+        path = self._path(tickers)
+        cached = pd.read_parquet(path) if os.path.exists(path) else None
+
+        # Cần lookback + ADV + 1 phiên; lấy dư để bù ngày nghỉ
+        need = self.lookback + OptimizerConfig.ADV_DAYS + 1
+        if cached is not None and len(cached):
+            last = cached.index.get_level_values("date").max()
+            fresh = self.repo.get_price_panel(tickers, days=0, fields=fields, start=last)
+        else:
+            fresh = self.repo.get_price_panel(tickers, days=need, fields=fields)
+        if not fresh:
+            return cached
+
+        new = pd.concat({f: fresh[f].stack() for f in fields}, axis=1)
+        new.index.names = ["date", "ticker"]
+        merged = new if cached is None else pd.concat([cached, new])
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+        dates = merged.index.get_level_values("date").unique().sort_values()[-need:]
+        merged = merged[merged.index.get_level_values("date") >= dates[0]]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        merged.to_parquet(path)
+        return merged
+
+    def estimate(self, tickers):
+        """
+        Trả về dict: tickers (đủ lịch sử), cov (ma trận hiệp phương sai ngày, shrinkage),
+        vol (độ lệch chuẩn ngày), adv (giá trị giao dịch TB, VND), price (giá đóng cửa cuối), shrinkage.
+        """
+        from sklearn.covariance import LedoitWolf
+
+        tickers = list(tickers)
+        long = self._load_prices(tickers)
+        if long is None or long.empty:
+            return None
+        last = long.index.get_level_values("date").max()
+        memo_key = (tuple(sorted(tickers)), last)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+
+        close = long["close"].unstack("ticker").reindex(columns=tickers)
+        volume = long["volume"].unstack("ticker").reindex(columns=tickers)
+        rets = close.pct_change(fill_method=None).iloc[1:].tail(self.lookback)
+        keep = [t for t in tickers if rets[t].notna().sum() >= min(OptimizerConfig.MIN_HISTORY, len(rets))]
+        R = rets[keep].to_numpy(dtype=np.float64)
+        # Phiên thiếu (tạm ngừng giao dịch) -> lợi nhuận 0 thay vì bỏ cả phiên của mọi mã
+        R = np.where(np.isfinite(R), R, 0.0)
+
+        lw = LedoitWolf().fit(R)
+        value = (close[keep] * volume[keep]).tail(OptimizerConfig.ADV_DAYS) * OptimizerConfig.PRICE_MULTIPLIER
+        est = {
+            "as_of": last,
+            "tickers": keep,
+            "cov": lw.covariance_,
+            "vol": np.sqrt(np.diag(lw.covariance_)),
+            "shrinkage": float(lw.shrinkage_),
+            "adv": value.mean().to_numpy(dtype=np.float64),
+            "price": close[keep].ffill().iloc[-1].to_numpy(dtype=np.float64),
+            "n_obs": int(len(R)),
+        }
+        self._memo = {memo_key: est}
+        return est
+
+# =============================================================================
+# 3. SOLVERS
+# =============================================================================
+
+def _constraints(n, sector_index, sector_cap, max_gross):
+    cons = [{"type": "ineq", "fun": lambda w: max_gross - w.sum(), "jac": lambda w: -np.ones(n)}]
+    for members in sector_index:
+        mask = np.zeros(n)
+        mask[members] = 1.0
+        cons.append({"type": "ineq", "fun": lambda w, m=mask: sector_cap - m @ w, "jac": lambda w, m=mask: -m})
+    return cons
+
+def solve_mean_variance(mu, cov, upper, sector_index=(), sector_cap=1.0, max_gross=1.0,
+                        risk_aversion=OptimizerConfig.RISK_AVERSION):
+    """max mu'w - (lambda/2) w'Σw  s.t. 0 <= w <= upper, tổng ngành <= cap, tổng <= max_gross (SLSQP)."""
+    from scipy.optimize import minimize
+
+    n = len(mu)
+    x0 = np.minimum(upper, max_gross / n)
+    res = minimize(
+        lambda w: -(mu @ w) + 0.5 * risk_aversion * (w @ cov @ w), x0,
+        jac=lambda w: -mu + risk_aversion * (cov @ w),
+        bounds=list(zip(np.zeros(n), upper)),
+        constraints=_constraints(n, sector_index, sector_cap, max_gross),
+        method="SLSQP", options={"maxiter": 200, "ftol": 1e-12},
+    )
+    return np.clip(res.x, 0, upper), res
+
+def solve_risk_parity(cov, upper, sector_index=(), sector_cap=1.0, max_gross=1.0, budgets=None):
+    """
+    Risk parity: nghiệm không ràng buộc theo Spinu (min ½y'Σy - Σ b ln y, Newton), sau đó
+    nếu vi phạm trần tỷ trọng / ngành thì tinh chỉnh bằng SLSQP trên độ lệch đóng góp rủi ro.
+    """
+    from scipy.optimize import minimize
+
+    n = len(cov)
+    b = np.full(n, 1.0 / n) if budgets is None else np.asarray(budgets) / np.sum(budgets)
+    y = 1.0 / np.sqrt(np.diag(cov))
+    for _ in range(50):
+        grad = cov @ y - b / y
+        hess = cov + np.diag(b / (y * y))
+        step = np.linalg.solve(hess, grad)
+        # Lùi bước để y luôn dương
+        t = 1.0
+        while np.any(y - t * step <= 0):
+            t *= 0.5
+        y = y - t * step
+        if np.abs(grad).max() < 1e-12:
+            break
+    w = y / y.sum() * max_gross
+
+    feasible = np.all(w <= upper + 1e-9) and all(w[m].sum() <= sector_cap + 1e-9 for m in sector_index)
+    if feasible:
+        return w, None
+
+    def objective(w):
+        rc = w * (cov @ w)
+        return np.sum((rc - b * (w @ cov @ w)) ** 2) * 1e6
+
+    res = minimize(objective, np.minimum(w, upper), bounds=list(zip(np.zeros(n), upper)),
+                   constraints=_constraints(n, sector_index, sector_cap, max_gross) +
+                   [{"type": "ineq", "fun": lambda w: w.sum() - 0.5 * max_gross}],
+                   method="SLSQP", options={"maxiter": 300, "ftol": 1e-14})
+    return np.clip(res.x, 0, upper), res
+
+def round_to_lots(weights, price, nav, lot_size, price_multiplier, upper=None):
+    """
+    Đổi tỷ trọng -> số cổ phiếu (bội số lô). Làm tròn xuống, sau đó dùng tiền dư mua thêm từng lô
+    cho mã thiếu hụt nhiều nhất (không vượt trần `upper`).
+    """
+    lot_value = price * price_multiplier * lot_size
+    lots = np.floor(weights * nav / lot_value)
+    cap = np.floor((upper if upper is not None else np.ones_like(weights)) * nav / lot_value)
+    cash = nav - lots @ lot_value
+    while True:
+        gap = weights * nav - lots * lot_value
+        gap[(lot_value > cash) | (lots >= cap) | (weights <= 0)] = -np.inf
+        i = int(np.argmax(gap))
+        if not np.isfinite(gap[i]) or gap[i] < 0.5 * lot_value[i]:
+            break
+        lots[i] += 1
+        cash -= lot_value[i]
+    return (lots * lot_size).astype(np.int64), cash
+
+# =============================================================================
+# 4. OPTIMIZER
+# =============================================================================
+
+class PortfolioOptimizer:
+    """
+    Dựng danh mục số từ bảng xếp hạng toàn universe (QuantToolkit.get_full_ranking()).
+    Kết quả (tỷ trọng, số cổ phiếu theo lô 100, lệnh cần đặt) dùng trực tiếp cho PortfolioManager.
+    """
+    def __init__(self, repo=None, **overrides):
+        self.cfg = {k: v for k, v in vars(OptimizerConfig).items() if k.isupper()}
+        unknown = set(overrides) - set(self.cfg)
+        if unknown:
+            raise ValueError(f"Tham số optimizer không hợp lệ: {sorted(unknown)}")
+        self.cfg.update(overrides)
+        if repo is None:
+            from database.repo import DataRepository
+            repo = DataRepository()
+        self.repo = repo
+        self.cov_cache = CovarianceCache(repo, self.cfg["LOOKBACK_DAYS"], self.cfg["CACHE_DIR"])
+
+    @staticmethod
+    def _scores(ranking):
+        """ranking: dict columnar của get_full_ranking() hoặc DataFrame có cột ticker + score/Rank_Score."""
+        if isinstance(ranking, dict):
+            cols = ranking["columns"]
+            return pd.Series(cols["score"], index=cols["ticker"], dtype=np.float64)
+        col = "score" if "score" in ranking.columns else "Rank_Score"
+        return pd.Series(ranking[col].to_numpy(dtype=np.float64), index=ranking["ticker"])
+
+    def optimize(self, ranking, nav=None, method=None, holdings=None):
+        """
+        Trả về kế hoạch danh mục: weights, shares, orders (so với holdings {ticker: số CP}), thống kê rủi ro.
+        """
+        cfg = self.cfg
+        nav = cfg["NAV"] if nav is None else float(nav)
+        method = method or cfg["METHOD"]
+        start = time.perf_counter()
+
+        if isinstance(ranking, dict) and "error" in ranking:
+            return ranking
+        if nav <= 0:
+            return {"error": f"NAV quỹ không hợp lệ ({nav:,.0f} VND): không có vốn để phân bổ."}
+        scores = self._scores(ranking).dropna()
+        est = self.cov_cache.estimate(list(scores.index))
+        if est is None or not est["tickers"]:
+            return {"error": "Không đủ dữ liệu giá để ước lượng hiệp phương sai."}
+
+        tickers = est["tickers"]
+        s = scores.reindex(tickers).to_numpy()
+        z = (s - s.mean()) / (s.std() + 1e-9)
+        mu = cfg["ALPHA_IC"] * est["vol"] * z
+        cov = est["cov"]
+
+        # Trần tỷ trọng = min(MAX_WEIGHT, thanh khoản thoát được trong LIQUIDATION_DAYS phiên)
+        liquidity_cap = cfg["MAX_ADV_PARTICIPATION"] * cfg["LIQUIDATION_DAYS"] * np.nan_to_num(est["adv"]) / nav
+        upper = np.minimum(cfg["MAX_WEIGHT"], liquidity_cap)
+
+        from tools.quant_groups import GroupConfig, industry_map
+        industries = industry_map(self.repo, tickers)
+        sectors = pd.Series([industries.get(t, GroupConfig.DEFAULT_INDUSTRY) for t in tickers])
+        sector_index = [np.flatnonzero(sectors.values == sec) for sec in sectors.unique()
+                        if sec != GroupConfig.DEFAULT_INDUSTRY]
+
+        if method == "risk_parity":
+            idx = np.argsort(-z, kind="stable")[:cfg["N_CANDIDATES"]]
+            idx = idx[upper[idx] > 0]
+            sub_sectors = [np.flatnonzero(np.isin(idx, m)) for m in sector_index]
+            w_sub, _ = solve_risk_parity(cov[np.ix_(idx, idx)], upper[idx], [m for m in sub_sectors if len(m)],
+                                         cfg["SECTOR_CAP"], cfg["MAX_GROSS"])
+            w = np.zeros(len(tickers))
+            w[idx] = w_sub
+        elif method == "mean_variance":
+            w, _ = solve_mean_variance(mu, cov, upper, sector_index, cfg["SECTOR_CAP"], cfg["MAX_GROSS"],
+                                       cfg["RISK_AVERSION"])
+        else:
+            return {"error": f"METHOD không hợp lệ: {method}"}
+
+        w[w < cfg["MIN_WEIGHT"]] = 0.0
+        shares, cash = round_to_lots(w, est["price"], nav, cfg["LOT_SIZE"], cfg["PRICE_MULTIPLIER"], upper)
+        value = shares * est["price"] * cfg["PRICE_MULTIPLIER"]
+        w_final = value / nav
+
+        port_var = float(w_final @ cov @ w_final)
+        rc = w_final * (cov @ w_final) / (port_var + 1e-18)
+        held = np.flatnonzero(shares > 0)
+        order = held[np.argsort(-w_final[held])]
+        positions = [{
+            "ticker": tickers[i],
+            "weight": round(float(w_final[i]), 4),
+            "target_weight": round(float(w[i]), 4),
+            "shares": int(shares[i]),
+            "price": float(est["price"][i]),
+            "value": round(float(value[i])),
+            "sector": sectors.iloc[i],
+            "risk_contribution": round(float(rc[i]), 4),
+            "alpha": round(float(mu[i]), 6),
+        } for i in order]
+
+        sector_weights = pd.Series(w_final, index=sectors.values).groupby(level=0).sum()
+        plan = {
+            "status": "success",
+            "as_of": pd.Timestamp(est["as_of"]).strftime("%Y-%m-%d"),
+            "method": method,
+            "nav": nav,
+            "lot_size": cfg["LOT_SIZE"],
+            "cash": round(float(cash)),
+            "cash_weight": round(float(cash / nav), 4),
+            "positions": positions,
+            "weights": {p["ticker"]: p["weight"] for p in positions},
+            "sector_weights": {k: round(float(v), 4) for k, v in sector_weights.items() if v > 0},
+            "expected_return_daily": round(float(mu @ w_final), 6),
+            "volatility_annual": round(float(np.sqrt(port_var * BacktestConfig.TRADING_DAYS)), 4),
+            "shrinkage": round(est["shrinkage"], 4),
+            "n_obs": est["n_obs"],
+        }
+        plan["orders"] = self.orders(plan, holdings or {}, dict(zip(tickers, est["price"])))
+        plan["fees"] = round(sum(o["fee"] for o in plan["orders"]))
+        plan["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return plan
+
+    def orders(self, plan, holdings, prices=None):
+        """
+        Lệnh cần đặt để đi từ holdings {ticker: số CP} tới danh mục mục tiêu (bán trước, mua sau).
+        Giá lệnh tính bằng VND (đã nhân PRICE_MULTIPLIER) như PortfolioManager.execute_trade yêu cầu;
+        `fee` = phí giao dịch (+ thuế bán) ước tính của cả lệnh, VND.
+        """
+        target = {p["ticker"]: p["shares"] for p in plan["positions"]}
+        prices = dict(prices or {}, **{p["ticker"]: p["price"] for p in plan["positions"]})
+        sells, buys = [], []
+        for t in sorted(set(target) | set(holdings)):
+            delta = target.get(t, 0) - int(holdings.get(t, 0))
+            if delta == 0 or t not in prices:
+                continue
+            order = {"action": "SELL" if delta < 0 else "BUY", "ticker": t, "quantity": abs(int(delta)),
+                     "price": float(prices[t]) * self.cfg["PRICE_MULTIPLIER"]}
+            rate = self.cfg["SELL_FEE"] + self.cfg["SELL_TAX"] if delta < 0 else self.cfg["BUY_FEE"]
+            order["fee"] = round(order["price"] * order["quantity"] * rate)
+            (sells if delta < 0 else buys).append(order)
+        return sells + buys
+
+    def save_plan(self, plan, path=None):
+        path = path or os.path.join(self.cfg["CACHE_DIR"], f"plan_{plan['as_of']}_{plan['method']}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(plan, saved_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")), f,
+                      ensure_ascii=False, indent=2)
+        return path
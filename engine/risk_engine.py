@@ -0,0 +1,383 @@
+# engine/risk_engine.py
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+try:
+    from engine.backtest_engine import BacktestConfig
+    from engine.portfolio_optimizer import OptimizerConfig
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from engine.backtest_engine import BacktestConfig
+    from engine.portfolio_optimizer import OptimizerConfig
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class RiskConfig:
+    PRICE_MULTIPLIER = BacktestConfig.PRICE_MULTIPLIER
+    LOOKBACK_DAYS = 500             # ~2 năm lợi nhuận ngày cho VaR lịch sử / beta
+    CONFIDENCE = (0.95, 0.99)
+    CACHE_DIR = os.path.join("data", "risk")
+    CACHE_TTL = 300                 # Giây giữa 2 lần kiểm tra DB có phiên mới
+
+    ADV_DAYS = OptimizerConfig.ADV_DAYS
+    MAX_ADV_PARTICIPATION = OptimizerConfig.MAX_ADV_PARTICIPATION
+
+    # Kịch bản lịch sử: phát lại lợi nhuận tích lũy từng mã trong giai đoạn (mã chưa niêm yết -> beta x VN30)
+    STRESS_WINDOWS = {
+        "2022_selloff": ("2022-04-04", "2022-11-16"),   # VN-Index -40% từ đỉnh
+        "2020_covid": ("2020-01-20", "2020-03-24"),
+        "2018_correction": ("2018-04-09", "2018-07-05"),
+    }
+    # Cú sốc thị trường (lợi nhuận VN30 equal-weight) truyền qua beta từng mã
+    MARKET_SHOCKS = (-0.05, -0.10, -0.20)
+    WORST_WINDOW_DAYS = 20          # Thêm kịch bản: 20 phiên tệ nhất của VN30 trong lịch sử
+
+    # Hạn mức kiểm tra trước giao dịch (theo % NAV)
+    LIMITS = {
+        "var_95": 0.03,             # VaR lịch sử 1 ngày 95%
+        "max_weight": OptimizerConfig.MAX_WEIGHT,
+        "max_sector": OptimizerConfig.SECTOR_CAP,
+        "max_days_to_exit": 5.0,
+        "stress_loss": 0.35,        # Lỗ tối đa chấp nhận trong kịch bản xấu nhất
+    }
+
+# =============================================================================
+# 2. MARKET DATA (dựng 1 lần / phiên, cache đĩa + bộ nhớ)
+# =============================================================================
+
+class RiskData:
+    """Mọi ma trận cần cho tính rủi ro của 1 phiên (phiên x mã, mã x kịch bản ...)."""
+    ARRAYS = ("returns", "cov", "mean", "beta", "adv", "price", "scenarios")
+
+    def __init__(self, as_of, tickers, sectors, scenario_names, **arrays):
+        self.as_of = as_of
+        self.tickers = list(tickers)
+        self.index = {t: i for i, t in enumerate(self.tickers)}
+        self.sectors = np.asarray(sectors)
+        self.scenario_names = list(scenario_names)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, repo, tickers):
+        from tools.quant_groups import GroupConfig, industry_map
+
+        panel = repo.get_price_panel(tickers, days=0, fields=("close", "volume"))
+        close = panel.get("close")
+        if close is None or close.empty:
+            return None
+        close = close.reindex(columns=tickers)
+        volume = panel["volume"].reindex(columns=tickers)
+
+        rets_all = close.pct_change(fill_method=None).iloc[1:]
+        market_all = rets_all.mean(axis=1)                      # VN30 equal-weight (như benchmark backtest)
+        rets = rets_all.tail(RiskConfig.LOOKBACK_DAYS)
+        market = market_all.loc[rets.index]
+        R = np.nan_to_num(rets.to_numpy(dtype=np.float64))
+
+        m = market.to_numpy(dtype=np.float64)
+        m_c = m - m.mean()
+        beta = (R - R.mean(axis=0)).T @ m_c / (m_c @ m_c + 1e-18)
+
+        # --- Kịch bản stress (kịch bản x mã) ---
+        names, rows = [], []
+        for name, (start, end) in RiskConfig.STRESS_WINDOWS.items():
+            window = close.loc[pd.Timestamp(start):pd.Timestamp(end)]
+            if len(window) < 2:
+                continue
+            per_ticker = (window.ffill().iloc[-1] / window.bfill().iloc[0] - 1.0).to_numpy(dtype=np.float64)
+            mkt = float(np.prod(1.0 + market_all.loc[window.index[1:]].fillna(0).values) - 1.0)
+            rows.append(np.where(np.isfinite(per_ticker), per_ticker, beta * mkt))
+            names.append(name)
+        for shock in RiskConfig.MARKET_SHOCKS:
+            rows.append(beta * shock)
+            names.append(f"vn30_{int(shock * 100)}pct")
+        n = RiskConfig.WORST_WINDOW_DAYS
+        if len(market_all) > n:
+            cum = np.log1p(market_all.fillna(0)).rolling(n).sum()
+            worst = int(np.nanargmin(cum.values))
+            end = worst + 1                                     # lợi nhuận phiên i <-> giá phiên i + 1
+            window = close.iloc[end - n:end + 1]
+            per_ticker = (window.ffill().iloc[-1] / window.bfill().iloc[0] - 1.0).to_numpy(dtype=np.float64)
+            rows.append(np.where(np.isfinite(per_ticker), per_ticker, beta * float(np.expm1(cum.iloc[worst]))))
+            names.append(f"worst_{n}d_{close.index[end].strftime('%Y-%m-%d')}")
+
+        value = (close * volume).tail(RiskConfig.ADV_DAYS) * RiskConfig.PRICE_MULTIPLIER
+        industries = industry_map(repo, tickers)
+        return cls(
+            as_of=close.index[-1].strftime("%Y-%m-%d"),
+            tickers=tickers,
+            sectors=[industries.get(t, GroupConfig.DEFAULT_INDUSTRY) for t in tickers],
+            scenario_names=names,
+            returns=R,
+            cov=np.cov(R, rowvar=False),
+            mean=R.mean(axis=0),
+            beta=beta,
+            adv=np.nan_to_num(value.mean().to_numpy(dtype=np.float64)),
+            price=close.ffill().iloc[-1].to_numpy(dtype=np.float64),
+            scenarios=np.vstack(rows) if rows else np.zeros((0, len(tickers))),
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **{k: getattr(self, k) for k in self.ARRAYS})
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"as_of": self.as_of, "tickers": self.tickers, "sectors": self.sectors.tolist(),
+                       "scenario_names": self.scenario_names}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in cls.ARRAYS}
+        return cls(meta["as_of"], meta["tickers"], meta["sectors"], meta["scenario_names"], **arrays)
+
+# =============================================================================
+# 3. ENGINE
+# =============================================================================
+
+class RiskEngine:
+    """
+    Đo rủi ro danh mục từ kho giá: VaR/CVaR (lịch sử + tham số), beta với VN30, tỷ trọng ngành,
+    số phiên cần để thoát vị thế và lỗ trong các kịch bản stress.
+    Dữ liệu thị trường dựng 1 lần mỗi phiên; mỗi lần đo chỉ là vài phép nhân ma trận,
+    nhiều danh mục (hiện tại + đề xuất) được tính cùng lúc -> kiểm tra trước giao dịch < 10 ms.
+    """
+    def __init__(self, repo=None, tickers=None, limits=None):
+        if repo is None:
+            from database.repo import DataRepository
+            repo = DataRepository()
+        if tickers is None:
+            from tools.quant_tool import QuantConfig
+            tickers = QuantConfig.TICKERS
+        self.repo = repo
+        self.tickers = list(tickers)
+        self.limits = dict(RiskConfig.LIMITS, **(limits or {}))
+        self._data = None
+        self._checked_at = 0.0
+
+    def _cache_key(self):
+        """Khóa file cache: universe (đúng thứ tự) + tham số dựng dữ liệu -> universe khác không dùng nhầm file."""
+        payload = {"tickers": self.tickers, "lookback": RiskConfig.LOOKBACK_DAYS,
+                   "stress": RiskConfig.STRESS_WINDOWS, "shocks": RiskConfig.MARKET_SHOCKS,
+                   "worst": RiskConfig.WORST_WINDOW_DAYS, "adv": RiskConfig.ADV_DAYS}
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _purge_cache(as_of):
+        """Xóa file dữ liệu rủi ro của các phiên trước `as_of` (thư mục cache không phình mỗi ngày 1 file)."""
+        for name in os.listdir(RiskConfig.CACHE_DIR):
+            if name.startswith("risk_") and name[5:15] < as_of:
+                try:
+                    os.remove(os.path.join(RiskConfig.CACHE_DIR, name))
+                except OSError:
+                    pass
+
+    # --- Data ---
+    def data(self, refresh=False):
+        """RiskData của phiên mới nhất (cache bộ nhớ CACHE_TTL giây, cache đĩa theo ngày)."""
+        if self._data is not None and not refresh and time.time() - self._checked_at < RiskConfig.CACHE_TTL:
+            return self._data
+
+        fingerprint = self.repo.get_data_fingerprint(self.tickers)
+        last = max((d1 for _, _, _, d1 in fingerprint), default=None)
+        if last is None:
+            return None
+        as_of = pd.Timestamp(last).strftime("%Y-%m-%d")
+        self._checked_at = time.time()
+        if self._data is not None and self._data.as_of == as_of and not refresh:
+            return self._data
+
+        path = os.path.join(RiskConfig.CACHE_DIR, f"risk_{as_of}_{self._cache_key()}.npz")
+        self._data = RiskData.load(path) if os.path.exists(path) and not refresh else None
+        if self._data is not None and self._data.tickers != self.tickers:
+            print(f"⚠️ [Risk] File cache {path} dựng cho universe khác -> dựng lại")
+            self._data = None
+        if self._data is None:
+            self._data = RiskData.build(self.repo, self.tickers)
+            if self._data is not None:
+                self._data.save(path)
+                self._purge_cache(as_of)
+                print(f"🧮 [Risk] Dựng dữ liệu rủi ro phiên {as_of} ({len(self._data.scenario_names)} kịch bản stress)")
+        return self._data
+
+    # --- Portfolio vectors ---
+    def position_values(self, holdings, data=None):
+        """holdings {ticker: số CP} -> vector giá trị VND theo thứ tự data.tickers."""
+        data = data or self.data()
+        v = np.zeros(len(data.tickers))
+        for t, q in holdings.items():
+            i = data.index.get(t)
+            if i is not None and q:
+                v[i] = q * data.price[i] * RiskConfig.PRICE_MULTIPLIER
+        return v
+
+    @staticmethod
+    def apply_orders(holdings, orders):
+        """Danh mục sau khi khớp các lệnh (list {action, ticker, quantity})."""
+        after = dict(holdings)
+        for o in orders:
+            sign = 1 if o["action"] == "BUY" else -1
+            after[o["ticker"]] = after.get(o["ticker"], 0) + sign * int(o["quantity"])
+        return {t: q for t, q in after.items() if q}
+
+    # --- Metrics (P danh mục cùng lúc) ---
+    def measure(self, values, navs, data=None):
+        """
+        values: (P x mã) giá trị VND từng vị thế; navs: (P,) NAV tương ứng.
+        Trả về dict chỉ số, mỗi chỉ số là mảng (P,) tính theo % NAV.
+        """
+        data = data or self.data()
+        V = np.atleast_2d(values)
+        nav = np.asarray(navs, dtype=np.float64).reshape(-1)
+        W = V / nav[:, None]
+
+        out = {"gross": W.sum(axis=1), "max_weight": W.max(axis=1, initial=0.0)}
+        pnl = data.returns @ W.T                                         # phiên x P
+        port_mean = W @ data.mean
+        port_std = np.sqrt(np.einsum("pi,ij,pj->p", W, data.cov, W))
+        for c in RiskConfig.CONFIDENCE:
+            tag = int(round(c * 100))
+            q = np.quantile(pnl, 1 - c, axis=0)
+            tail = pnl <= q
+            out[f"var_{tag}"] = 0.0 - q
+            out[f"cvar_{tag}"] = -(np.where(tail, pnl, 0).sum(axis=0) / np.maximum(tail.sum(axis=0), 1))
+            z = norm.ppf(c)
+            out[f"var_{tag}_param"] = z * port_std - port_mean
+            out[f"cvar_{tag}_param"] = port_std * norm.pdf(z) / (1 - c) - port_mean
+        out["volatility_annual"] = port_std * np.sqrt(BacktestConfig.TRADING_DAYS)
+        out["beta"] = W @ data.beta
+
+        # Thanh khoản: số phiên để bán hết khi chỉ chiếm MAX_ADV_PARTICIPATION thanh khoản mỗi phiên
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days = np.where(V > 0, V / (RiskConfig.MAX_ADV_PARTICIPATION * data.adv), 0.0)
+        out["days_to_exit"] = np.nan_to_num(days, nan=np.inf, posinf=np.inf).max(axis=1, initial=0.0)
+
+        # Stress: (kịch bản x mã) @ (mã x P) -> lỗ từng kịch bản
+        out["stress"] = -(data.scenarios @ W.T)                          # kịch bản x P (dương = lỗ)
+
+        sectors = np.unique(data.sectors)
+        onehot = (data.sectors[None, :] == sectors[:, None]).astype(np.float64)   # ngành x mã
+        out["sector"] = onehot @ W.T                                     # ngành x P
+        out["_sectors"] = sectors
+        out["_days_by_ticker"] = days
+        return out
+
+    def _report(self, m, p, data, values, nav):
+        held = np.flatnonzero(values > 0)
+        report = {k: round(float(m[k][p]), 5) for k in m if not k.startswith("_") and m[k].ndim == 1}
+        report["nav"] = round(float(nav))
+        report["stress"] = {name: round(float(m["stress"][i, p]), 5) for i, name in enumerate(data.scenario_names)}
+        report["worst_stress"] = max(report["stress"].values(), default=0.0)
+        report["sector"] = {str(s): round(float(m["sector"][i, p]), 4)
+                            for i, s in enumerate(m["_sectors"]) if m["sector"][i, p] > 0}
+        report["positions"] = {data.tickers[i]: {
+            "weight": round(float(values[i] / nav), 4),
+            "beta": round(float(data.beta[i]), 3),
+            "days_to_exit": round(float(m["_days_by_ticker"][p, i]), 2),
+        } for i in held}
+        return report
+
+    def _breaches(self, report):
+        from tools.quant_groups import GroupConfig
+
+        lim = self.limits
+        # Nhóm "GENERAL" là phần còn lại của universe, không phải 1 ngành -> không áp trần ngành
+        sectors = [w for s, w in report["sector"].items() if s != GroupConfig.DEFAULT_INDUSTRY]
+        checks = [
+            ("var_95", report["var_95"]), ("max_weight", report["max_weight"]),
+            ("max_sector", max(sectors, default=0.0)),
+            ("max_days_to_exit", report["days_to_exit"]), ("stress_loss", report["worst_stress"]),
+        ]
+        return [{"limit": k, "value": round(v, 4), "max": lim[k]} for k, v in checks if k in lim and v > lim[k]]
+
+    # --- Public API ---
+    def portfolio_risk(self, holdings, cash=0.0):
+        """Báo cáo rủi ro cho danh mục {ticker: số CP} + tiền mặt (VND)."""
+        data = self.data()
+        if data is None:
+            return {"error": "DB chưa có dữ liệu giá."}
+        start = time.perf_counter()
+        v = self.position_values(holdings, data)
+        nav = v.sum() + cash
+        if nav <= 0:
+            return {"error": "NAV bằng 0."}
+        report = self._report(self.measure(v[None, :], [nav], data), 0, data, v, nav)
+        report.update(as_of=data.as_of, breaches=self._breaches(report),
+                      elapsed_ms=round((time.perf_counter() - start) * 1000, 3))
+        return report
+
+    def check_trade(self, holdings, cash, orders):
+        """
+        Kiểm tra trước giao dịch: đo danh mục hiện tại và danh mục sau lệnh trong 1 lượt tính.
+        Lệnh bị từ chối nếu danh mục mới vượt hạn mức mà danh mục cũ chưa vượt (hoặc làm vi phạm nặng hơn).
+        """
+        data = self.data()
+        if data is None:
+            return {"error": "DB chưa có dữ liệu giá."}
+        start = time.perf_counter()
+        after = self.apply_orders(holdings, orders)
+        v0 = self.position_values(holdings, data)
+        v1 = self.position_values(after, data)
+        mult = RiskConfig.PRICE_MULTIPLIER
+        cash_after = cash + sum((1 if o["action"] == "SELL" else -1) * o["quantity"] *
+                                o.get("price", data.price[data.index[o["ticker"]]] * mult) - o.get("fee", 0)
+                                for o in orders if o["ticker"] in data.index)
+        navs = [v0.sum() + cash, v1.sum() + cash_after]
+        m = self.measure(np.vstack([v0, v1]), navs, data)
+        current = self._report(m, 0, data, v0, navs[0])
+        proposed = self._report(m, 1, data, v1, navs[1])
+
+        before = {b["limit"]: b["value"] for b in self._breaches(current)}
+        breaches = [b for b in self._breaches(proposed) if b["value"] > before.get(b["limit"], -np.inf) + 1e-9]
+        if cash_after < -1e-6:
+            breaches.append({"limit": "cash", "value": round(cash_after), "max": 0})
+        return {
+            "as_of": data.as_of,
+            "approved": not breaches,
+            "breaches": breaches,
+            "current": current,
+            "proposed": proposed,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def fund_risk(self, portfolio_manager):
+        """Rủi ro của danh mục đang nắm trong PortfolioManager."""
+        return self.portfolio_risk(portfolio_manager.get_holdings(), portfolio_manager.get_fund_status()["cash"])
+
+    def check_plan(self, portfolio_manager, plan):
+        """Kiểm tra các lệnh của PortfolioOptimizer trên danh mục hiện tại của PortfolioManager."""
+        return self.check_trade(portfolio_manager.get_holdings(), portfolio_manager.get_fund_status()["cash"],
+                                plan.get("orders", []))
+
+    @staticmethod
+    def render(report):
+        """Tóm tắt ngắn (Markdown) để đưa vào prompt của Risk Manager."""
+        if "error" in report:
+            return f"- Rủi ro: {report['error']}"
+        lines = [
+            f"- VaR 1 ngày 95%/99% (lịch sử): {report['var_95']:.2%} / {report['var_99']:.2%} NAV"
+            f" | CVaR 95%: {report['cvar_95']:.2%}",
+            f"- Beta VN30: {report['beta']:.2f} | Vol năm: {report['volatility_annual']:.1%}"
+            f" | Số phiên thoát hàng: {report['days_to_exit']:.1f}",
+            f"- Stress xấu nhất: -{report['worst_stress']:.1%} NAV | Ngành: {report['sector']}",
+        ]
+        if report.get("breaches"):
+            lines.append(f"- ⚠️ Vượt hạn mức: {[b['limit'] for b in report['breaches']]}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from engine.portfolio_manager import PortfolioManager
+
+    report = RiskEngine().fund_risk(PortfolioManager())
+    print(json.dumps(report, ensure_ascii=False, indent=2))
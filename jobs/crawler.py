@@ -11,6 +11,7 @@ sys.path.append(os.getcwd())
 # Import nội bộ
 from database.models import init_db
 from database.repo import DataRepository
+from jobs.rate_limit import SOURCE_LIMITER
 
 try:
     from vnstock import Vnstock
@@ -80,6 +81,7 @@ class MarketCrawler:
             
             # --- NGUỒN 1: VCI (Ưu tiên) ---
             try:
+                SOURCE_LIMITER.acquire()
                 stock = Vnstock().stock(symbol=ticker, source='VCI')
                 df = stock.quote.history(start=start_date, end=end_date, interval='1D')
             except Exception:
@@ -88,6 +90,7 @@ class MarketCrawler:
             # --- NGUỒN 2: TCBS (Fallback nếu VCI lỗi) ---
             if df is None or df.empty:
                 # print(f"⚠️ {ticker}: VCI thiếu dữ liệu, thử TCBS...")
+                SOURCE_LIMITER.acquire()
                 stock = Vnstock().stock(symbol=ticker, source='TCBS')
                 df = stock.quote.history(start=start_date, end=end_date, interval='1D')
             
@@ -142,9 +145,7 @@ class MarketCrawler:
                 total_new_records += count
             else:
                 print("❌ Không tải được dữ liệu.")
-            
-            # Sleep 1.5s để tránh bị chặn IP (Rate Limit)
-            time.sleep(1.5)
+            # Rate limit nằm trong _fetch_from_api (SOURCE_LIMITER dùng chung với lazy-load)
 
         print("-" * 60)
         print(f"✅ HOÀN TẤT CẬP NHẬT. Tổng cộng thêm: {total_new_records} bản ghi.")
@@ -156,4 +157,35 @@ if __name__ == "__main__":
     
     # 2. Chạy Crawler
     crawler = MarketCrawler()
-    crawler.run_daily_update()
\ No newline at end of file
+    crawler.run_daily_update()
+
+    # 3. Giám sát drift model Quant trên snapshot mới (không chặn crawler nếu lỗi)
+    try:
+        from tools.quant_monitor import DriftMonitor
+        DriftMonitor().update()
+    except Exception as e:
+        print(f"⚠️ Lỗi giám sát drift: {e}")
+
+    # 4. Tính sẵn vùng hỗ trợ/kháng cự + mẫu hình cho cả universe (agent tra cứu O(1))
+    try:
+        from tools.technical_levels import LevelEngine
+        LevelEngine().build()
+    except Exception as e:
+        print(f"⚠️ Lỗi tính vùng giá: {e}")
+
+    # 5. Cập nhật dòng tiền khối ngoại (tăng dần: chỉ đọc phiên mới, mã không có bar mới -> bỏ qua)
+    try:
+        from tools.foreign_flow import FlowEngine
+        FlowEngine().update()
+    except Exception as e:
+        print(f"⚠️ Lỗi cập nhật dòng tiền khối ngoại: {e}")
+
+    # 6. Vẽ sẵn biểu đồ cả watchlist cho bar mới (process pool, ảnh cache theo bar)
+    try:
+        from tools.chart_tool import ChartToolkit
+        charts = ChartToolkit.render_watchlist(crawler.watchlist)
+        ok = sum(1 for p in charts.values() if not p.startswith("Lỗi"))
+        print(f"🖼️ Biểu đồ: {ok}/{len(charts)} mã sẵn sàng.")
+        ChartToolkit.shutdown()
+    except Exception as e:
+        print(f"⚠️ Lỗi vẽ biểu đồ watchlist: {e}")
\ No newline at end of file
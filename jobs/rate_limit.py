@@ -0,0 +1,38 @@
+# jobs/rate_limit.py
+"""
+Bộ giới hạn tốc độ gọi nguồn dữ liệu (Vnstock VCI/TCBS) dùng chung trong process.
+Crawler hằng ngày và lazy-load của MarketToolkit đều đi qua SOURCE_LIMITER nên
+tổng số request ra ngoài luôn cách nhau >= MIN_INTERVAL (tránh bị chặn IP),
+thay cho các time.sleep rải rác sau mỗi lần tải.
+"""
+import time
+import asyncio
+import threading
+
+class SourceRateLimiter:
+    """Giãn cách các lần gọi API tối thiểu `min_interval` giây (an toàn đa luồng, có bản async)."""
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def _reserve(self) -> float:
+        """Giữ chỗ lượt gọi kế tiếp, trả về số giây phải chờ (không ngủ khi đang giữ lock)."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+            return slot - now
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# Khoảng cách 1.5s giữa 2 request (giữ nhịp cũ của crawler)
+SOURCE_LIMITER = SourceRateLimiter(min_interval=1.5)
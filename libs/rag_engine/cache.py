@@ -0,0 +1,111 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .config import settings
+
+class LLMCache:
+    """
+    Cache response LLM theo nội dung (model, messages, temperature, max_tokens), lưu SQLite.
+    Giới hạn số entry (xóa entry ít dùng nhất), TTL tùy chọn. Dùng chung được giữa nhiều process (WAL).
+    Thời điểm truy cập của cache hit được gom trong bộ nhớ và ghi theo lô (không commit mỗi lần hit).
+    """
+    EVICT_EVERY = 64
+    TOUCH_BATCH = 64
+
+    def __init__(self, path, max_entries=20000, ttl=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched = {}      # key -> accessed chưa ghi xuống DB
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "temperature": temperature,
+                              "max_tokens": max_tokens}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT response, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched(db)
+                db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            self._touched.pop(key, None)
+            db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)", (key, model, response, now, now))
+            self._flush_touched(db)
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 1:
+                self._evict(db, now)
+            db.commit()
+
+    def _flush_touched(self, db):
+        if self._touched:
+            db.executemany("UPDATE llm_cache SET accessed = ? WHERE key = ?",
+                           [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self):
+        """Ghi các lần truy cập còn gom trong bộ nhớ (gọi lúc thoát process)."""
+        with self._lock:
+            if self._touched and self._conn is not None:
+                self._flush_touched(self._conn)
+                self._conn.commit()
+
+    def _evict(self, db, now):
+        if self.ttl:
+            db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+        db.execute("""DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM llm_cache")
+            db.commit()
+            self._touched.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"entries": size, "hits": self.hits, "misses": self.misses}
+
+def cacheable(temperature) -> bool:
+    """Chỉ cache khi output tất định (temperature <= ngưỡng, mặc định 0)."""
+    return settings.LLM_CACHE_ENABLED and temperature <= settings.LLM_CACHE_MAX_TEMPERATURE
+
+llm_cache = LLMCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL)
+atexit.register(llm_cache.flush)
@@ -3,6 +3,7 @@ import asyncio
 from .ingest import run_ingest
 from .retrieval import query_func
 from .evaluate import run_eval
+from .llm import close_clients
 
 @click.group()
 def cli():
@@ -21,8 +22,11 @@ def index_cmd(dir, pattern):
 def ask_cmd(question, mode):
     """Query documents."""
     async def _run():
-        _, ans = await query_func(None, question, mode)
-        return ans
+        try:
+            _, ans = await query_func(None, question, mode)
+            return ans
+        finally:
+            await close_clients()
     print(f"\nANSWER: {asyncio.run(_run())}")
 
 @cli.command(name='eval')
@@ -17,6 +17,13 @@ class Config:
     
     BASE_WORKDIR = os.getenv("WORKDIR", "./rag_storage")
     MAX_RPM = int(os.getenv("MAX_REQUESTS_PER_MINUTE", 50))
+
+    # LLM response cache (SQLite). Only deterministic calls (temperature <= LLM_CACHE_MAX_TEMPERATURE) are cached
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BASE_WORKDIR, "llm_cache.sqlite"))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 20000))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL_SECONDS", 0))     # 0 = never expires
+    LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0.0))
     
     CHUNK_SIZE = 4096 
     CHUNK_OVERLAP = 300
@@ -13,6 +13,7 @@ from langchain_openai import ChatOpenAI
 from langchain_huggingface import HuggingFaceEmbeddings
 from .config import settings
 from .retrieval import query_func
+from .llm import close_clients
 
 def clean_to_atomic_answer(text):
     if not isinstance(text, str): return ""
@@ -39,6 +40,7 @@ def run_isolated_query(question):
         print(e)
         return {"raw_contexts": str(e), "refined": "Lỗi hệ thống."}
     finally:
+        loop.run_until_complete(close_clients())
         loop.close()
 
 def truncate_context(text: str, max_chars: int = 20000):
@@ -2,6 +2,7 @@ import os
 import asyncio
 from pathlib import Path
 from .core import get_rag_engine
+from .llm import close_clients
 
 def parse_filename(filename):
     # CTG-Q3-2025.ocr_text.txt -> Ticker, Year, Quarter
@@ -37,5 +38,11 @@ async def _ingest_async(input_path: str, pattern: str):
         await rag.ainsert(enhanced_content)
         print(f"✅ Đã lưu vào kho: {ticker}/{year}/{quarter}")
 
+async def _ingest_and_close(input_path: str, pattern: str):
+    try:
+        await _ingest_async(input_path, pattern)
+    finally:
+        await close_clients()
+
 def run_ingest(input_path: str, pattern: str):
-    asyncio.run(_ingest_async(input_path, pattern))
\ No newline at end of file
+    asyncio.run(_ingest_and_close(input_path, pattern))
\ No newline at end of file
@@ -1,6 +1,14 @@
 import asyncio
-from openai import AsyncOpenAI
+import os
+import sys
 from .config import settings
+from .cache import llm_cache, cacheable
+
+try:
+    from core.clients import get_openai_client, close_clients
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from core.clients import get_openai_client, close_clients
 
 class RateLimiter:
     def __init__(self, max_calls, period=60.0):
@@ -22,7 +30,8 @@ class RateLimiter:
 limiter = RateLimiter(settings.MAX_RPM)
 
 async def openai_complete_if_cache(prompt, system_prompt=None, history_messages=[], **kwargs) -> str:
-    client = AsyncOpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
+    # Client dùng chung cả process (1 pool kết nối / endpoint), không tạo mới mỗi lần gọi
+    client = get_openai_client(settings.BASE_URL, settings.API_KEY)
     model_name = kwargs.get("model") or kwargs.get("model_name") or settings.LLM_MODEL
     
     messages = []
@@ -31,16 +40,29 @@ async def openai_complete_if_cache(prompt, system_prompt=None, history_messages=
     if history_messages:
         messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
+    temperature = kwargs.get("temperature", 0.1)
+    max_tokens = kwargs.get("max_tokens", 4096)
+
+    key = None
+    if cacheable(temperature):
+        key = llm_cache.make_key(model_name, messages, temperature, max_tokens)
+        # SQLite (chờ lock, commit) chạy trong thread, không chặn event loop
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            return cached
 
     await limiter.acquire()
     try:
         response = await client.chat.completions.create(
             model=model_name,
             messages=messages,
-            temperature=kwargs.get("temperature", 0.1),
-            max_tokens=kwargs.get("max_tokens", 4096) 
+            temperature=temperature,
+            max_tokens=max_tokens
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        if key and content:
+            await asyncio.to_thread(llm_cache.put, key, model_name, content)
+        return content
     except Exception as e:
         print(f"[LLM ERROR] {e}")
         return ""
\ No newline at end of file
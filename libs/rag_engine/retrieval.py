@@ -233,7 +233,7 @@ async def generate_search_queries(question: str, ticker: str, year: str, quarter
     """
 
     try:
-        res = await openai_complete_if_cache(prompt, model=settings.GPT_MODEL, temperature=0.1, max_tokens=1024)
+        res = await openai_complete_if_cache(prompt, model=settings.GPT_MODEL, temperature=0.0, max_tokens=1024)
         
         lines = [l.strip() for l in res.splitlines() if l.strip()]
         clean_queries = []
@@ -337,7 +337,7 @@ async def refine_answer(question, raw_context):
     response = await openai_complete_if_cache(
         prompt, 
         model_name=settings.REASONER_MODEL, 
-        temperature=0.1,
+        temperature=0.0,
         max_tokens=8192 
     )
     
@@ -14,6 +14,7 @@ from agents.technical_agent import TechnicalAgent
 from agents.quant_agent import QuantAgent
 from core.mcp_client import FinancialMCPClient
 from core.llm import call_llm
+from core.clients import close_clients
 from database.repo import DataRepository
 
 # --- CẤU HÌNH ---
@@ -64,7 +65,7 @@ async def run_risk_manager(ticker, debate, quant):
     MÃ: {ticker} | DEBATE: {debate} | QUANT: {quant}
     QUYẾT ĐỊNH CUỐI CÙNG:
     1. HÀNH ĐỘNG: [MUA/BÁN/QUAN SÁT]
-    2. TỶ TRỌNG: % NAV
+    2. TỶ TRỌNG: % NAV (không vượt "Tỷ trọng tối ưu" trong QUANT)
     3. LÝ DO CỐT LÕI
     4. VÙNG GIÁ
     """
@@ -153,4 +154,10 @@ async def main():
 if __name__ == "__main__":
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
\ No newline at end of file
+
+    async def _run():
+        try:
+            await main()
+        finally:
+            await close_clients()     # Đóng pool kết nối LLM dùng chung trước khi loop kết thúc
+    asyncio.run(_run())
\ No newline at end of file
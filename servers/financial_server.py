@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 import asyncio
 import contextlib
 
@@ -28,6 +29,7 @@ try:
     from tools.search_tool import SearchToolkit
     from tools.market_tool import MarketToolkit
     from tools.quant_tool import QuantToolkit
+    from tools.technical_scanner import TechnicalScanner, SCREENS, screen, to_records
     from agents.financial_analysis import DynamicFinancialAgent
 except ImportError as e:
     debug_log(f"CRITICAL ERROR: {e}")
@@ -53,9 +55,39 @@ async def get_technical_report(ticker: str) -> str:
     # Pandas chạy nặng -> đẩy vào Thread
     return await asyncio.to_thread(MarketToolkit.get_technical_report, ticker)
 
+@mcp.tool()
+async def scan_technical(tickers: str = "", screens: str = "", sort_by: str = "rsi", limit: int = 30) -> str:
+    """
+    Quét kỹ thuật nhiều mã trong 1 lượt (SMA50/200, Ichimoku, RSI, StochRSI, MACD, Bollinger, hỗ trợ/kháng cự).
+    tickers: "BID,HPG,FPT" (để trống = mọi mã có dữ liệu).
+    screens: bộ lọc AND, VD "oversold,above_sma200" (oversold, overbought, above_sma200, below_sma200,
+             above_sma50, uptrend, golden_cross, death_cross, stoch_low, stoch_high, macd_bull, macd_bear,
+             ichimoku_bull, ichimoku_bear, bb_breakout, bb_breakdown, vol_spike, near_support, near_resistance).
+    sort_by: cột sắp xếp tăng dần (rsi, change_pct, vol_ratio, ...). Trả về JSON.
+    """
+    debug_log(f"📡 Server: Technical scan [{tickers or 'ALL'}] screens=[{screens}]...")
+
+    def _run_scan():
+        symbols = [t for t in tickers.split(",") if t.strip()]
+        table = TechnicalScanner().scan(symbols or None)
+        if table.empty:
+            return json.dumps({"error": "Không có dữ liệu giá."}, ensure_ascii=False)
+        names = [n.strip() for n in screens.split(",") if n.strip()]
+        try:
+            table = screen(table, names)
+        except ValueError as e:
+            return json.dumps({"error": str(e), "available": sorted(SCREENS)}, ensure_ascii=False)
+        if sort_by in table.columns:
+            table = table.sort_values(sort_by)
+        return json.dumps({
+            "screens": names, "count": len(table), "rows": to_records(table.head(max(limit, 0)))
+        }, ensure_ascii=False)
+
+    return await asyncio.to_thread(_run_scan)
+
 @mcp.tool()
 async def get_price_history(ticker: str, days: int = 30) -> str:
-    df = await asyncio.to_thread(MarketToolkit.get_price_data, ticker, days)
+    df = await MarketToolkit.get_price_data_async(ticker, days)
     if df.empty: return "No Data"
     return df.tail(days).to_csv(index=False)
 
@@ -67,28 +99,37 @@ async def run_quant_prediction(ticker: str) -> str:
         tool = QuantToolkit()
         if not tool.features: tool.train_model()
         
-        result = tool.get_market_ranking()
-        if "error" in result: return f"❌ Lỗi Quant: {result['error']}"
-        
-        target_info = "Neutral"
-        score = 50.0
-        # Logic filter cho ticker...
-        for item in result.get("top_strong_buy", []):
-            if item['ticker'] == ticker:
-                target_info = "STRONG BUY"
-                score = item['confidence']
-                break
+        ranks = tool.get_ticker_ranks([ticker])
+        if "error" in ranks: return f"❌ Lỗi Quant: {ranks['error']}"
         
-        return f"""
-        ### 🤖 DỰ BÁO ĐỊNH LƯỢNG
-        - **Mã:** {ticker}
-        - **Xếp hạng:** {target_info}
-        - **Điểm:** {score:.1f}
-        """
+        symbol = ticker.upper().strip()
+        return QuantToolkit.render_rank_report(symbol, ranks[symbol])
 
     # Quant train model rất nặng -> đẩy vào Thread
     return await asyncio.to_thread(_run_quant)
 
+@mcp.tool()
+async def get_quant_ranking(tickers: str = "") -> str:
+    """
+    Xếp hạng định lượng cho nhiều mã cùng lúc (VD: "BID,HPG,FPT").
+    Để trống -> trả về toàn bộ bảng xếp hạng dạng cột (JSON).
+    """
+    debug_log(f"📡 Server: Quant Ranking batch [{tickers or 'ALL'}]...")
+
+    def _run_batch():
+        tool = QuantToolkit()
+        if not tool.features: tool.train_model()
+
+        ranking = tool.get_full_ranking()
+        if "error" in ranking: return json.dumps(ranking, ensure_ascii=False)
+
+        symbols = [t for t in tickers.split(",") if t.strip()]
+        if not symbols:
+            return json.dumps(ranking, ensure_ascii=False)
+        return json.dumps(tool.get_ticker_ranks(symbols, ranking=ranking), ensure_ascii=False)
+
+    return await asyncio.to_thread(_run_batch)
+
 @mcp.tool()
 async def analyze_financial_report(ticker: str, year: str, quarter: str) -> str:
     debug_log(f"📡 Server: Phân tích BCTC {ticker}...")
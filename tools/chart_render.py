@@ -0,0 +1,61 @@
+# tools/chart_render.py
+"""
+Code chạy trong worker process vẽ biểu đồ (ChartToolkit).
+Module cố ý nhẹ (chỉ matplotlib/mplfinance/pandas): worker không import DB, vnstock hay agent.
+matplotlib không thread-safe -> mỗi worker là 1 process riêng, vẽ tuần tự.
+"""
+import os
+
+_SHARED = {}
+
+STYLES = {
+    "default": dict(marketcolors=dict(up='green', down='red', edge='inherit', wick='inherit', volume='in'),
+                    gridstyle=':', y_on_right=True),
+    "dark": dict(base_mpf_style='nightclouds',
+                 marketcolors=dict(up='#26a69a', down='#ef5350', edge='inherit', wick='inherit', volume='in'),
+                 gridstyle=':', y_on_right=True),
+}
+
+def _init_worker():
+    """Import sẵn matplotlib (backend Agg) + mplfinance 1 lần cho mỗi worker."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import mplfinance as mpf
+    _SHARED.update(mpf=mpf, plt=plt, styles={})
+
+def _style(name):
+    styles = _SHARED["styles"]
+    if name not in styles:
+        mpf = _SHARED["mpf"]
+        spec = dict(STYLES[name])
+        mc = mpf.make_marketcolors(**spec.pop("marketcolors"))
+        styles[name] = mpf.make_mpf_style(marketcolors=mc, **spec)
+    return styles[name]
+
+def render_candle(job) -> str:
+    """
+    Vẽ 1 biểu đồ nến ra PNG. job: dict(ohlcv (DataFrame index date), ma (list Series), title, style, path, dpi).
+    Ghi file tạm rồi os.replace -> process khác không bao giờ đọc phải ảnh dở dang.
+    """
+    if "mpf" not in _SHARED:
+        _init_worker()
+    mpf, plt = _SHARED["mpf"], _SHARED["plt"]
+    path = job["path"]
+    # Tên tạm bắt đầu bằng "." -> không khớp glob dọn ảnh cũ của ChartToolkit; đuôi .png để mplfinance chọn định dạng
+    tmp = os.path.join(os.path.dirname(path), f".tmp_{os.getpid()}_{os.path.basename(path)}")
+    mpf.plot(
+        job["ohlcv"],
+        type='candle',
+        addplot=[mpf.make_addplot(m, width=1.0) for m in job["ma"]],
+        volume=True,
+        title=job["title"],
+        style=_style(job["style"]),
+        savefig=dict(fname=tmp, dpi=job["dpi"], bbox_inches='tight'),
+        tight_layout=True,
+        figratio=(12, 6),
+        figscale=1.0
+    )
+    plt.close("all")
+    os.replace(tmp, path)
+    return path
@@ -1,49 +1,246 @@
 import os
-import mplfinance as mpf
+import glob
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from .market_tool import MarketToolkit
+from .indicators import sma, rsi, macd, bollinger
+from .technical_scanner import ScannerConfig
+from .price_cache import PriceCache, SingleFlight
+from .chart_render import STYLES, _init_worker, render_candle
 
-class ChartToolkit:
+class ChartConfig:
     # Lưu vào thư mục static để sau này Streamlit hiển thị
     CHART_DIR = "static/charts"
-    
-    @staticmethod
-    def generate_candle_chart(symbol: str) -> str:
-        """Vẽ biểu đồ nến và trả về đường dẫn file ảnh."""
-        if not os.path.exists(ChartToolkit.CHART_DIR):
-            os.makedirs(ChartToolkit.CHART_DIR)
-            
-        # Gọi hàm mới get_price_data
-        df = MarketToolkit.get_price_data(symbol, days=180)
-        
-        if df.empty: 
-            return "Lỗi: Không có dữ liệu để vẽ biểu đồ."
-        
+    WINDOW = 180                # Số phiên vẽ (6 tháng)
+    STYLE = "default"           # Xem tools/chart_render.STYLES
+    DPI = 100
+    MAX_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+    RENDER_TIMEOUT = 120        # Giây chờ 1 biểu đồ
+    RENDER_VERSION = 1          # Tăng khi đổi cách vẽ -> toàn bộ cache ảnh cũ tự hết hiệu lực
+
+    # --- Payload JSON cho chart phía client (dashboard) ---
+    PAYLOAD_WINDOW = 250        # Số phiên mặc định
+    PAYLOAD_MAX_POINTS = 500    # Cửa sổ dài hơn -> giảm mẫu LTTB về số điểm này
+    PAYLOAD_WARMUP = 200        # Phiên dư để SMA200 có giá trị từ điểm đầu
+    PAYLOAD_CACHE_BYTES = 32 * 1024 * 1024
+
+def lttb_indices(y, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn n_out chỉ số giữ hình dạng chuỗi y (luôn giữ điểm đầu/cuối).
+    n_out >= len(y) -> giữ nguyên.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    edges = (np.arange(n_out - 1) * every).astype(np.int64) + 1     # Biên các bucket giữa [1, n-1)
+    edges[-1] = n - 1
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Điểm C = trung bình bucket kế tiếp (bucket cuối -> điểm cuối)
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        cx, cy = (nlo + nhi - 1) / 2, y[nlo:nhi].mean()
+        xs = np.arange(lo, hi)
+        area = np.abs((a - cx) * (y[lo:hi] - y[a]) - (a - xs) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+def _column(values, decimals):
+    """Mảng số -> list JSON (NaN -> None)."""
+    return [None if v != v else v for v in np.round(np.asarray(values, dtype=float), decimals).tolist()]
+
+class ChartToolkit:
+    CHART_DIR = ChartConfig.CHART_DIR
+    _pool = None
+    _pool_lock = threading.Lock()
+    _renders = SingleFlight()   # Cùng 1 ảnh đang vẽ -> các caller khác chờ chung
+    # OHLCV + chỉ báo đã tính theo mã (hết hạn khi có bar mới như cache giá)
+    _series = PriceCache(max_bytes=ChartConfig.PAYLOAD_CACHE_BYTES)
+
+    @staticmethod
+    def _get_pool() -> ProcessPoolExecutor:
+        # spawn: worker sạch (không kế thừa thread/lock của server), import sẵn matplotlib qua initializer
+        with ChartToolkit._pool_lock:
+            if ChartToolkit._pool is None:
+                ChartToolkit._pool = ProcessPoolExecutor(
+                    max_workers=ChartConfig.MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+            return ChartToolkit._pool
+
+    @staticmethod
+    def shutdown():
+        with ChartToolkit._pool_lock:
+            if ChartToolkit._pool is not None:
+                ChartToolkit._pool.shutdown(wait=True)
+                ChartToolkit._pool = None
+
+    @staticmethod
+    def chart_path(symbol: str, last_date, style: str, window: int) -> str:
+        """Đường dẫn cache theo nội dung: (mã, ngày bar cuối, style, cửa sổ, phiên bản cách vẽ)."""
+        key = f"{symbol}|{pd.Timestamp(last_date):%Y-%m-%d}|{style}|{window}|{ChartConfig.RENDER_VERSION}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(ChartToolkit.CHART_DIR, f"{symbol}_{style}_{window}_{digest}.png")
+
+    @staticmethod
+    def _prepare(symbol: str, window: int, style: str):
+        """(đường dẫn cache, job cho worker hoặc None nếu ảnh đã có). Lỗi dữ liệu -> ValueError."""
+        if style not in STYLES:
+            raise ValueError(f"Style không hợp lệ: {style}. Hợp lệ: {sorted(STYLES)}")
+        # Cùng cửa sổ với báo cáo kỹ thuật (hit cache giá)
+        df = MarketToolkit.get_price_data(symbol, days=max(ScannerConfig.LOOKBACK, window + 50))
+        if df.empty:
+            raise ValueError("Không có dữ liệu để vẽ biểu đồ.")
+
+        path = ChartToolkit.chart_path(symbol, df['date'].iloc[-1], style, window)
+        if os.path.exists(path):
+            return path, None
+
+        # Định dạng lại index cho mplfinance
+        bars = df.set_index('date')
+        # MA từ thư viện chỉ báo chung, tính trên lịch sử dài -> đường MA đủ từ phiên đầu biểu đồ
+        ma = [sma(bars['close'], n).tail(window) for n in (20, 50)]
+        snap = MarketToolkit.get_indicator_snapshot(symbol)
+        subtitle = f" | RSI {snap.rsi:.0f}, MACD {'+' if snap.macd_bull else '-'}" if snap else ""
+        job = dict(
+            ohlcv=bars[['open', 'high', 'low', 'close', 'volume']].tail(window), ma=ma,
+            title=f"{symbol} - Daily Chart ({window} Sessions){subtitle}",
+            style=style, path=path, dpi=ChartConfig.DPI
+        )
+        return path, job
+
+    @staticmethod
+    def _prune(path: str):
+        """Giữ 1 ảnh mới nhất cho mỗi (mã, style, cửa sổ): xóa ảnh của các bar cũ."""
+        prefix = os.path.basename(path).rsplit("_", 1)[0]
+        for old in glob.glob(os.path.join(ChartToolkit.CHART_DIR, f"{prefix}_*.png")):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _submit(path: str, job: dict):
+        """Future đường dẫn ảnh (single-flight theo path, vẽ trong process pool)."""
+        def _render():
+            result = ChartToolkit._get_pool().submit(render_candle, job).result(timeout=ChartConfig.RENDER_TIMEOUT)
+            ChartToolkit._prune(result)
+            return result
+        return ChartToolkit._renders.submit(path, _render)
+
+    @staticmethod
+    def generate_candle_chart(symbol: str, window: int = ChartConfig.WINDOW, style: str = ChartConfig.STYLE) -> str:
+        """Vẽ biểu đồ nến và trả về đường dẫn file ảnh (vẽ 1 lần / bar, sau đó đọc từ cache đĩa)."""
+        symbol = symbol.upper().strip()
+        os.makedirs(ChartToolkit.CHART_DIR, exist_ok=True)
         try:
-            # Định dạng lại index cho mplfinance
-            df = df.set_index('date')
-            
-            # Style chuyên nghiệp
-            mc = mpf.make_marketcolors(up='green', down='red', edge='inherit', wick='inherit', volume='in')
-            s = mpf.make_mpf_style(marketcolors=mc, gridstyle=':', y_on_right=True)
-            
-            filename = f"{symbol}_chart.png"
-            filepath = os.path.join(ChartToolkit.CHART_DIR, filename)
-            
-            # Vẽ biểu đồ
-            mpf.plot(
-                df, 
-                type='candle', 
-                mav=(20, 50), 
-                volume=True, 
-                title=f"{symbol} - Daily Chart (6 Months)",
-                style=s, 
-                savefig=dict(fname=filepath, dpi=100, bbox_inches='tight'),
-                tight_layout=True,
-                figratio=(12, 6),
-                figscale=1.0
-            )
-            return filepath
-            
+            path, job = ChartToolkit._prepare(symbol, window, style)
+            if job is None:
+                return path
+            return ChartToolkit._submit(path, job).result()
+        except ValueError as e:
+            return f"Lỗi: {e}"
         except Exception as e:
-            return f"Lỗi vẽ biểu đồ: {e}"
\ No newline at end of file
+            return f"Lỗi vẽ biểu đồ: {e}"
+
+    @staticmethod
+    def render_watchlist(tickers=None, window: int = ChartConfig.WINDOW, style: str = ChartConfig.STYLE) -> dict:
+        """
+        Vẽ song song biểu đồ cả watchlist (chạy sau crawl hằng đêm): {mã: đường dẫn hoặc chuỗi lỗi}.
+        Ảnh đã có cho bar mới nhất được bỏ qua.
+        """
+        if tickers is None:
+            from .quant_tool import QuantConfig
+            tickers = QuantConfig.TICKERS
+        os.makedirs(ChartToolkit.CHART_DIR, exist_ok=True)
+        results, pending = {}, {}
+        pool = ChartToolkit._get_pool()
+        for symbol in [t.upper().strip() for t in tickers]:
+            try:
+                path, job = ChartToolkit._prepare(symbol, window, style)
+            except Exception as e:
+                results[symbol] = f"Lỗi: {e}"
+                continue
+            if job is None:
+                results[symbol] = path
+            else:
+                pending[pool.submit(render_candle, job)] = symbol
+
+        for fut in as_completed(pending):
+            symbol = pending[fut]
+            try:
+                results[symbol] = fut.result(timeout=ChartConfig.RENDER_TIMEOUT)
+                ChartToolkit._prune(results[symbol])
+            except Exception as e:
+                results[symbol] = f"Lỗi vẽ biểu đồ: {e}"
+        return results
+
+    # --- PAYLOAD JSON (chart phía client, không vẽ raster) ---
+
+    @staticmethod
+    def _series_frame(symbol: str, days: int) -> pd.DataFrame:
+        """OHLCV + đường chỉ báo cho `days` phiên (dùng thư viện chỉ báo chung)."""
+        df = MarketToolkit.get_price_data(symbol, days=days)
+        if df.empty:
+            return df
+        out = df[['date', 'open', 'high', 'low', 'close', 'volume']].reset_index(drop=True)
+        close = out['close']
+        for n in (20, 50, 200):
+            out[f'sma{n}'] = sma(close, n)
+        out['bb_upper'], _, out['bb_lower'] = bollinger(close)
+        out['rsi'] = rsi(close)
+        out['macd'], out['macd_signal'] = macd(close)
+        return out
+
+    @staticmethod
+    def chart_payload(symbol: str, window: int = ChartConfig.PAYLOAD_WINDOW,
+                      max_points: int = ChartConfig.PAYLOAD_MAX_POINTS) -> dict:
+        """
+        Dữ liệu biểu đồ dạng cột (JSON) cho thư viện chart phía trình duyệt.
+        Cửa sổ dài hơn max_points -> giảm mẫu LTTB theo giá đóng cửa; mỗi nến gộp đoạn giữa 2 điểm được chọn
+        (open đầu đoạn, high/low cực trị, close tại điểm chọn, volume cộng dồn) nên không mất đỉnh/đáy.
+        """
+        symbol = symbol.upper().strip()
+        try:
+            days = window + ChartConfig.PAYLOAD_WARMUP
+            frame = ChartToolkit._series.get_or_load(symbol, days, lambda n: ChartToolkit._series_frame(symbol, n))
+            if frame is None or frame.empty:
+                return {"error": "Không có dữ liệu để vẽ biểu đồ."}
+            frame = frame.tail(window)
+
+            close = frame['close'].to_numpy()
+            sel = lttb_indices(close, max_points)
+            starts = np.concatenate([[0], sel[:-1] + 1])
+            payload = {
+                "symbol": symbol,
+                "date": frame['date'].to_numpy()[sel].astype('datetime64[D]').astype(str).tolist(),
+                "open": _column(frame['open'].to_numpy()[starts], 2),
+                "high": _column(np.maximum.reduceat(frame['high'].to_numpy(), starts), 2),
+                "low": _column(np.minimum.reduceat(frame['low'].to_numpy(), starts), 2),
+                "close": _column(close[sel], 2),
+                "volume": _column(np.add.reduceat(frame['volume'].to_numpy(dtype=float), starts), 0),
+                "indicators": {
+                    c: _column(frame[c].to_numpy()[sel], 4)
+                    for c in ('sma20', 'sma50', 'sma200', 'bb_upper', 'bb_lower', 'rsi', 'macd', 'macd_signal')
+                },
+                "meta": {"window": int(len(frame)), "points": int(len(sel)), "downsampled": bool(len(sel) < len(frame))},
+            }
+            return payload
+        except Exception as e:
+            return {"error": f"Lỗi tạo dữ liệu biểu đồ: {e}"}
+
+    @staticmethod
+    def chart_payloads(tickers, window: int = ChartConfig.PAYLOAD_WINDOW,
+                       max_points: int = ChartConfig.PAYLOAD_MAX_POINTS) -> dict:
+        """Payload cho nhiều mã (dashboard): {mã: payload}."""
+        return {t.upper().strip(): ChartToolkit.chart_payload(t, window, max_points) for t in tickers}
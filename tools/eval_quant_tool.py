@@ -1,218 +1,260 @@
 import sys
 import os
-import joblib
+import json
+import shutil
+import hashlib
 import numpy as np
 import pandas as pd
-import xgboost as xgb
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.stats import spearmanr
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Fix path để import module từ thư mục gốc
 sys.path.append(os.getcwd())
 
-try:
-    from database.repo import DataRepository
-    from tools.quant_tool import FeatureEngineer, QuantConfig
-except ImportError:
-    print("❌ Lỗi Import. Hãy chạy script từ thư mục gốc của dự án.")
-    sys.exit(1)
+from database.repo import DataRepository
+from tools.quant_tool import QuantConfig
+from tools.quant_dataset import DatasetCache
+from engine.backtest_engine import BacktestEngine
+from tools import quant_analytics as analytics
 
-# Cấu hình giao diện biểu đồ
-sns.set_theme(style="whitegrid")
-plt.rcParams['figure.figsize'] = (12, 6)
-plt.rcParams['font.size'] = 11
-plt.rcParams['axes.titlesize'] = 14
-plt.rcParams['axes.labelsize'] = 12
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class EvalConfig:
+    CACHE_DIR = os.path.join("data", "eval_cache")
+    REPORT_DIR = os.path.join("reports", "quant_eval")
+    # Tăng khi đổi cách tính metrics để vô hiệu kết quả đã cache
+    RESULT_VERSION = "v1"
+    RENDER_WORKERS = 2
+    TOP_IMPORTANCE = 15
+
+# =============================================================================
+# 2. RESULT OBJECT (cache theo phiên bản model + dữ liệu + tham số)
+# =============================================================================
+
+class EvaluationResult:
+    """
+    Kết quả đánh giá đã tính xong: summary (dict) + các bảng tidy (DataFrame).
+    Lưu dạng thư mục: summary.json + <bảng>.parquet. Vẽ lại báo cáo chỉ cần đọc lại object này.
+    """
+    def __init__(self, key, summary, tables, path=None):
+        self.key = key
+        self.summary = summary
+        self.tables = tables
+        self.path = path
+
+    def save(self, path):
+        tmp = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for name, df in self.tables.items():
+            df.to_parquet(os.path.join(tmp, f"{name}.parquet"), index=False)
+        with open(os.path.join(tmp, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"key": self.key, "tables": list(self.tables), **self.summary},
+                      f, ensure_ascii=False, indent=2, default=str)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "summary.json"), "r", encoding="utf-8") as f:
+            summary = json.load(f)
+        key = summary.pop("key")
+        tables = {name: pd.read_parquet(os.path.join(path, f"{name}.parquet")) for name in summary.pop("tables")}
+        return cls(key, summary, tables, path)
+
+# =============================================================================
+# 3. EVALUATOR (chỉ tính toán, không vẽ)
+# =============================================================================
 
 class QuantEvaluator:
-    def __init__(self):
-        self.repo = DataRepository()
-        self.model = xgb.XGBRanker()
+    def __init__(self, repo=None, cache_dir=EvalConfig.CACHE_DIR):
+        self.repo = repo or DataRepository()
+        self.cache_dir = cache_dir
+        self.model = None
         self.features = []
         self._load_model()
 
     def _load_model(self):
-        if os.path.exists(QuantConfig.MODEL_PATH):
-            try:
-                self.model.load_model(QuantConfig.MODEL_PATH)
-                self.features = joblib.load(QuantConfig.FEATURE_PATH)
-                print(f"✅ Đã load Model DART ({len(self.features)} features).")
-            except Exception as e:
-                print(f"❌ Lỗi load model: {e}")
-                sys.exit(1)
-        else:
-            print("❌ Chưa có Model. Hãy chạy tools/quant_tool.py để train trước.")
-            sys.exit(1)
+        if not os.path.exists(QuantConfig.MODEL_PATH):
+            print("⚠️ Chưa có Model. Hãy chạy tools/quant_tool.py để train trước.")
+            return
+        try:
+            import joblib
+            import xgboost as xgb
+
+            model = xgb.XGBRanker()
+            model.load_model(QuantConfig.MODEL_PATH)
+            self.features = joblib.load(QuantConfig.FEATURE_PATH)
+            self.model = model
+            print(f"✅ Đã load Model DART ({len(self.features)} features).")
+        except Exception as e:
+            print(f"❌ Lỗi load model: {e}")
+
+    def cache_key(self, test_days, top_k, days_history=3650):
+        """Khóa = hash file model + khóa dataset (phiên bản dữ liệu/feature) + tham số đánh giá."""
+        with open(QuantConfig.MODEL_PATH, "rb") as f:
+            model_hash = hashlib.sha1(f.read()).hexdigest()[:12]
+        payload = {
+            "model": model_hash,
+            "dataset": DatasetCache(self.repo).cache_key(days_history),
+            "test_days": test_days, "top_k": top_k,
+            "version": EvalConfig.RESULT_VERSION,
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
 
     def load_test_data(self, test_days=365):
-        """Lấy dữ liệu OOS (Out-of-Sample) để đánh giá"""
-        print(f"📥 Đang tải dữ liệu {test_days} ngày gần nhất từ DB...")
-        
-        data_frames = []
-        for ticker in QuantConfig.TICKERS:
-            # Lấy dư 100 ngày để tính MA, RSI...
-            df = self.repo.get_price_history(ticker, days=test_days + 100)
-            if not df.empty and len(df) > 60:
-                df['ticker'] = ticker
-                data_frames.append(df)
-        
-        if not data_frames:
+        """Lấy dữ liệu OOS (Out-of-Sample) để đánh giá từ dataset cache (memmap) dùng chung với training"""
+        print(f"📥 Đang tải dữ liệu {test_days} ngày gần nhất (dataset cache)...")
+
+        matrix = DatasetCache(self.repo).load_or_build()
+        if matrix is None:
             print("❌ DB rỗng. Hãy chạy crawler trước.")
             return pd.DataFrame()
 
-        full_df = pd.concat(data_frames, ignore_index=True)
-        full_df['date'] = pd.to_datetime(full_df['date'])
-        
-        print("⚙️ Đang tính toán Feature SOTA (bao gồm Dòng tiền khối ngoại)...")
-        
-        # 1. Base Features
-        processed_dfs = []
-        for t in full_df['ticker'].unique():
-            sub = full_df[full_df['ticker'] == t]
-            processed_dfs.append(FeatureEngineer.create_base_features(sub))
-        
-        df_feat = pd.concat(processed_dfs, ignore_index=True)
-        
-        # 2. Tạo Target Thực tế để so sánh (T+3)
-        future_close = df_feat.groupby('ticker')['close'].shift(-3)
-        df_feat['Actual_Return'] = (future_close - df_feat['close']) / df_feat['close']
-        df_feat = df_feat.dropna()
-        
-        # 3. Z-Score Transformation (Sử dụng logic mới nhất của QuantTool)
-        df_test = FeatureEngineer.apply_cross_sectional_zscore(df_feat)
-        
-        # Lọc đúng ngày Test
-        cutoff_date = df_test['date'].max() - timedelta(days=test_days)
-        df_test = df_test[df_test['date'] >= cutoff_date]
-        
-        return df_test.sort_values('date')
-
-    def run_evaluation(self):
-        # Đánh giá 1 năm gần nhất (365 ngày)
-        df = self.load_test_data(test_days=365)
-        if df.empty: return
+        # Lọc đúng ngày Test (dữ liệu đã sort theo date -> chỉ cần lát cắt đuôi)
+        dates = np.asarray(matrix.dates)
+        cutoff_date = dates[-1] - np.timedelta64(test_days, 'D')
+        start = int(np.searchsorted(dates, cutoff_date))
+
+        df_test = pd.DataFrame(np.asarray(matrix.X[start:]), columns=matrix.features)
+        df_test['date'] = pd.to_datetime(dates[start:])
+        df_test['ticker'] = np.asarray(matrix.tickers[start:])
+        # Target Thực tế để so sánh (T+3)
+        df_test['Actual_Return'] = np.asarray(matrix.target[start:])
+        return df_test
+
+    def evaluate(self, test_days=365, top_k=5, force=False):
+        """
+        Tính toàn bộ metrics (importance, IC, decay, quintile, spread, backtest) -> EvaluationResult.
+        Kết quả được cache theo cache_key(); gọi lại với cùng model/dữ liệu không dự báo lại.
+        Trả về {"error": ...} nếu chưa có model hoặc DB rỗng.
+        """
+        if self.model is None:
+            return {"error": "Chưa có Model. Hãy chạy tools/quant_tool.py để train trước."}
+
+        key = self.cache_key(test_days, top_k)
+        path = os.path.join(self.cache_dir, key)
+        if not force and os.path.exists(os.path.join(path, "summary.json")):
+            print(f"⚡ [Eval] CACHE HIT {key}")
+            return EvaluationResult.load(path)
+
+        df = self.load_test_data(test_days=test_days)
+        if df.empty:
+            return {"error": "DB rỗng. Hãy chạy crawler trước."}
 
         print("\n🔮 Đang chạy dự báo trên tập Test...")
-        
         # Đảm bảo đủ cột feature
         missing_cols = set(self.features) - set(df.columns)
         for c in missing_cols: df[c] = 0
-            
-        X = df[self.features]
         # XGBoost predict trả về margin scores
-        df['Pred_Score'] = self.model.predict(X)
+        df['Pred_Score'] = self.model.predict(df[self.features])
 
-        # =========================================================================
-        # 1. FEATURE IMPORTANCE (FIXED ERROR HERE)
-        # =========================================================================
-        print("\n📊 1. Phân tích Tầm quan trọng của Features (Feature Importance)...")
-        
-        # FIX LỖI: Dùng get_booster() trước khi gọi get_score()
         importance = self.model.get_booster().get_score(importance_type='gain')
-        
-        # Map feature names
         imp_df = pd.DataFrame(list(importance.items()), columns=['Feature', 'Gain'])
-        imp_df = imp_df.sort_values('Gain', ascending=False).head(15)
-        
-        plt.figure(figsize=(10, 6))
-        sns.barplot(x='Gain', y='Feature', data=imp_df, palette='viridis')
-        plt.title("Top 15 Yếu tố quan trọng nhất (XGBoost DART Feature Importance)")
-        plt.tight_layout()
-        plt.savefig('eval_feature_importance.png')
-        print("   -> Đã lưu: eval_feature_importance.png")
+        imp_df = imp_df.sort_values('Gain', ascending=False).head(EvalConfig.TOP_IMPORTANCE)
+
+        # Panel (phiên x mã) dùng chung cho mọi phân tích bên dưới: tính vector hóa 1 lượt
+        scores = BacktestEngine.scores_panel(df['date'], df['ticker'], df['Pred_Score'])
+        actual = BacktestEngine.scores_panel(df['date'], df['ticker'], df['Actual_Return'])
+        close = self.repo.get_price_panel(QuantConfig.TICKERS, days=0).get('close')
+        report = analytics.evaluate(scores, returns=actual, close=close,
+                                    horizon=QuantConfig.TARGET_HORIZON, top_k=top_k)
+
+        tables = {
+            "importance": imp_df.reset_index(drop=True),
+            "daily": report['daily'],
+            "quantile_summary": report['quantile_summary'],
+        }
+        if 'decay' in report:
+            tables["decay"] = report['decay']
+
+        summary = {
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "test_days": test_days, "top_k": top_k,
+            "n_features": len(self.features),
+            "signal": report['summary'],
+        }
+        if close is not None and not close.empty:
+            bt = BacktestEngine(TOP_K=top_k).run(scores, close.loc[close.index >= scores.index.min()])
+            if "error" not in bt:
+                tables["backtest"] = pd.DataFrame({
+                    "date": bt['equity'].index, "equity": bt['equity'].values,
+                    "benchmark": bt['benchmark'].values, "drawdown": bt['drawdown'].values,
+                })
+                summary["backtest"] = bt['stats']
+
+        result = EvaluationResult(key, summary, tables)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        result.save(path)
+        return result
+
+    @staticmethod
+    def print_summary(result):
+        s, top_k = result.summary["signal"], result.summary["top_k"]
+
+        print("\n📊 1. Phân tích Tầm quan trọng của Features (Feature Importance)...")
+        for r in result.tables["importance"].head(5).itertuples():
+            print(f"   {r.Feature:<22} {r.Gain:,.2f}")
         print("   (Hãy kiểm tra xem 'Z_Foreign...' có nằm trong Top không)")
 
-        # =========================================================================
-        # 2. IC ANALYSIS
-        # =========================================================================
         print("\n📊 2. Đánh giá Chỉ số IC (Information Coefficient)...")
-        ic_list = []
-        for date, group in df.groupby('date'):
-            if len(group) < 10: continue
-            corr, _ = spearmanr(group['Pred_Score'], group['Actual_Return'])
-            ic_list.append({'date': date, 'ic': corr})
-        
-        ic_df = pd.DataFrame(ic_list)
-        mean_ic = ic_df['ic'].mean()
-        ic_ir = mean_ic / (ic_df['ic'].std() + 1e-9)
-        pos_ratio = (ic_df['ic'] > 0).mean()
-
-        print(f"   ➤ Mean IC: {mean_ic:.4f} (Mục tiêu > 0.03)")
-        print(f"   ➤ ICIR:    {ic_ir:.4f}   (Mục tiêu > 0.5)")
-        print(f"   ➤ Positive Days: {pos_ratio:.1%}")
-
-        plt.figure()
-        plt.bar(ic_df['date'], ic_df['ic'], color='skyblue', alpha=0.8)
-        plt.axhline(mean_ic, color='red', linestyle='--', label=f'Mean IC: {mean_ic:.3f}')
-        plt.title(f"Daily Information Coefficient (IC)")
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig('eval_ic_chart.png')
-        print("   -> Đã lưu: eval_ic_chart.png")
-
-        # =========================================================================
-        # 3. CUMULATIVE ALPHA (SPREAD)
-        # =========================================================================
-        print("\n📊 3. Đánh giá Lợi nhuận Alpha (Top vs Bottom)...")
-        results = []
-        for date, group in df.groupby('date'):
-            if len(group) < 10: continue
-            
-            top5 = group.nlargest(5, 'Pred_Score')
-            bot5 = group.nsmallest(5, 'Pred_Score')
-            
-            ret_top = top5['Actual_Return'].mean()
-            ret_bot = bot5['Actual_Return'].mean()
-            
-            results.append({
-                'date': date,
-                'Top5_Ret': ret_top,
-                'Bot5_Ret': ret_bot,
-                'Spread': ret_top - ret_bot
-            })
-            
-        res_df = pd.DataFrame(results)
-        res_df['Cum_Top'] = res_df['Top5_Ret'].cumsum()
-        res_df['Cum_Bot'] = res_df['Bot5_Ret'].cumsum()
-        res_df['Cum_Spread'] = res_df['Spread'].cumsum()
-
-        total_alpha = res_df['Spread'].sum() * 100
-        print(f"   ➤ Tổng Alpha (Spread): {total_alpha:.2f}%")
-        
-        plt.figure()
-        plt.plot(res_df['date'], res_df['Cum_Spread'], label='Alpha (Top - Bot)', color='green', linewidth=2.5)
-        plt.plot(res_df['date'], res_df['Cum_Top'], label='Long Top 5 Only', color='blue', linestyle='--')
-        plt.plot(res_df['date'], res_df['Cum_Bot'], label='Long Bottom 5 (Benchmark)', color='gray', linestyle=':')
-        plt.title(f"Cumulative Return (Total Alpha = {total_alpha:.1f}%)")
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig('eval_alpha_chart.png')
-        print("   -> Đã lưu: eval_alpha_chart.png")
-
-        # =========================================================================
-        # 4. QUINTILE ANALYSIS
-        # =========================================================================
-        print("\n📊 4. Phân tích Nhóm (Quintile Analysis)...")
-        # Chia 5 nhóm
-        df['Quintile'] = pd.qcut(df['Pred_Score'], 5, labels=['Q1 (Weak)', 'Q2', 'Q3', 'Q4', 'Q5 (Strong)'])
-        quintile_ret = df.groupby('Quintile')['Actual_Return'].mean() * 100
-        
-        print(quintile_ret)
-        
-        plt.figure()
-        colors = ['#ff4d4d', '#ffa64d', '#ffff4d', '#99ff99', '#009900'] # Red to Green
-        ax = quintile_ret.plot(kind='bar', color=colors, edgecolor='black', width=0.6)
-        plt.title("Average Return by Quintile (Monotonicity Check)")
-        plt.ylabel("Avg Return (%)")
-        plt.xticks(rotation=0)
-        plt.tight_layout()
-        plt.savefig('eval_quintile_chart.png')
-        print("   -> Đã lưu: eval_quintile_chart.png")
-        
+        print(f"   ➤ Mean IC: {s['mean_ic'] or 0.0:.4f} (Mục tiêu > 0.03)")
+        print(f"   ➤ ICIR:    {s['icir'] or 0.0:.4f}   (Mục tiêu > 0.5)")
+        print(f"   ➤ Positive Days: {s['positive_ratio'] or 0.0:.1%}")
+        print(f"   ➤ Top-Quintile Turnover: {s['mean_top_turnover'] or 0.0:.1%}/phiên | "
+              f"Rank Autocorr: {s['mean_rank_autocorr'] or 0.0:.3f}")
+        if "decay" in result.tables:
+            print("   ➤ IC Decay: " + " | ".join(
+                f"T+{int(r.horizon)}: {r.mean_ic:.3f}" for r in result.tables["decay"].itertuples()
+                if r.horizon in (1, 3, 5, 10, 20) and pd.notna(r.mean_ic)))
+
+        print(f"\n📊 3. Đánh giá Lợi nhuận Alpha (Top {top_k} vs Bottom {top_k})...")
+        print(f"   ➤ Tổng Alpha (Spread): {result.tables['daily']['spread'].sum() * 100:.2f}%")
+
+        print("\n📊 4. Phân tích Nhóm (Quintile Analysis, chia nhóm theo từng phiên)...")
+        for r in result.tables["quantile_summary"].itertuples():
+            print(f"   {r.quantile}: {r.mean_return * 100:.3f}%")
+        print(f"   ➤ Đơn điệu tăng: {'✅' if s['monotonic'] else '❌'}")
+
+        bt = result.summary.get("backtest")
+        print(f"\n📊 5. Backtest danh mục Top {top_k} (phí + thuế, T+2.5, giá trần/sàn)...")
+        if not bt:
+            print("   ⚠️ Không đọc được panel giá, bỏ qua backtest.")
+        else:
+            print(f"   ➤ Tổng lợi nhuận: {bt['total_return']:.2%} (Benchmark EW: {bt['benchmark_return']:.2%})")
+            print(f"   ➤ Sharpe: {bt['sharpe']:.2f} | Max Drawdown: {bt['max_drawdown']:.2%}")
+            print(f"   ➤ Turnover/năm: {bt['ann_turnover']:.1f}x | Phí + thuế: {bt['total_fees']:,.0f} VND")
+            print(f"   ➤ Lệnh kẹt trần: {bt['blocked_buys']} | Lệnh bán kẹt sàn/chưa về: {bt['blocked_sells']}")
+
+    @staticmethod
+    def render_report(result, report_dir=None, workers=EvalConfig.RENDER_WORKERS, wait=True):
+        """
+        Vẽ biểu đồ từ EvaluationResult đã cache vào thư mục báo cáo, trên process pool nền.
+        wait=False trả về ngay list Future (process chính không import matplotlib).
+        """
+        from tools.eval_report import render_all
+
+        report_dir = report_dir or os.path.join(EvalConfig.REPORT_DIR, result.key)
+        return render_all(result.path, report_dir, workers=workers, wait=wait)
+
+    def run_evaluation(self, test_days=365, top_k=5, render=True, force=False):
+        # Mặc định đánh giá 1 năm gần nhất (365 ngày). Quét nhiều cấu hình: engine/backtest_sweep.py
+        result = self.evaluate(test_days=test_days, top_k=top_k, force=force)
+        if isinstance(result, dict):
+            print(f"❌ {result['error']}")
+            return result
+
+        self.print_summary(result)
+        if render:
+            paths = self.render_report(result)
+            print(f"\n🖼️ Đã lưu {len(paths)} biểu đồ vào {os.path.dirname(paths[0]) if paths else '-'}")
         print("\n✅ ĐÁNH GIÁ HOÀN TẤT.")
+        return result
 
 if __name__ == "__main__":
     evaluator = QuantEvaluator()
-    evaluator.run_evaluation()
\ No newline at end of file
+    evaluator.run_evaluation()
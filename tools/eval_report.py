@@ -0,0 +1,146 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, wait as wait_futures
+
+# Module này chỉ chạy trong process vẽ: matplotlib/seaborn được import trong worker,
+# process gọi (agent, server, notebook) không bị cấu hình đồ họa toàn cục.
+
+_POOL = {}
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    try:
+        import seaborn as sns
+        sns.set_theme(style="whitegrid")
+    except ImportError:
+        pass
+    plt.rcParams['figure.figsize'] = (12, 6)
+    plt.rcParams['font.size'] = 11
+    plt.rcParams['axes.titlesize'] = 14
+    plt.rcParams['axes.labelsize'] = 12
+
+def _load(result_path):
+    from tools.eval_quant_tool import EvaluationResult
+    return EvaluationResult.load(result_path)
+
+# =============================================================================
+# CHARTS (mỗi hàm: EvaluationResult -> plt.Figure)
+# =============================================================================
+
+def _chart_importance(result, plt):
+    imp = result.tables["importance"]
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.barh(imp['Feature'][::-1], imp['Gain'][::-1], color='teal')
+    ax.set_title(f"Top {len(imp)} Yếu tố quan trọng nhất (XGBoost DART Feature Importance)")
+    return fig
+
+def _chart_ic(result, plt):
+    daily = result.tables["daily"].dropna(subset=['ic'])
+    mean_ic = result.summary["signal"]["mean_ic"] or 0.0
+    fig, ax = plt.subplots()
+    ax.bar(daily['date'], daily['ic'], color='skyblue', alpha=0.8)
+    ax.axhline(mean_ic, color='red', linestyle='--', label=f'Mean IC: {mean_ic:.3f}')
+    ax.set_title("Daily Information Coefficient (IC)")
+    ax.legend()
+    return fig
+
+def _chart_ic_decay(result, plt):
+    decay = result.tables["decay"]
+    fig, ax = plt.subplots()
+    ax.bar(decay['horizon'], decay['mean_ic'], color='steelblue', edgecolor='black')
+    ax.set_title("IC Decay (Mean Rank IC by Horizon)")
+    ax.set_xlabel("Horizon (sessions)")
+    return fig
+
+def _chart_alpha(result, plt):
+    daily = result.tables["daily"].dropna(subset=['ic'])
+    top_k = result.summary["top_k"]
+    total_alpha = daily['spread'].sum() * 100
+    fig, ax = plt.subplots()
+    ax.plot(daily['date'], daily['spread'].cumsum(), label='Alpha (Top - Bot)', color='green', linewidth=2.5)
+    ax.plot(daily['date'], daily['top_return'].cumsum(), label=f'Long Top {top_k} Only', color='blue', linestyle='--')
+    ax.plot(daily['date'], daily['bottom_return'].cumsum(), label=f'Long Bottom {top_k} (Benchmark)',
+            color='gray', linestyle=':')
+    ax.set_title(f"Cumulative Return (Total Alpha = {total_alpha:.1f}%)")
+    ax.legend()
+    return fig
+
+def _chart_quintile(result, plt):
+    q = result.tables["quantile_summary"]
+    fig, ax = plt.subplots()
+    colors = ['#ff4d4d', '#ffa64d', '#ffff4d', '#99ff99', '#009900']  # Red to Green
+    ax.bar(q['quantile'], q['mean_return'] * 100, color=colors[:len(q)], edgecolor='black', width=0.6)
+    ax.set_title("Average Return by Quintile (Monotonicity Check)")
+    ax.set_ylabel("Avg Return (%)")
+    return fig
+
+def _chart_backtest(result, plt):
+    bt = result.tables["backtest"]
+    stats = result.summary["backtest"]
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+    ax1.plot(bt['date'], bt['equity'] / bt['equity'].iloc[0], label=f"Top {result.summary['top_k']} (net)",
+             color='green', linewidth=2)
+    ax1.plot(bt['date'], bt['benchmark'], label='Equal-Weight VN30', color='gray', linestyle=':')
+    ax1.set_title(f"Backtest Equity (Sharpe = {stats['sharpe']:.2f})")
+    ax1.legend()
+    ax2.fill_between(bt['date'], bt['drawdown'], 0, color='red', alpha=0.4)
+    ax2.set_ylabel("Drawdown")
+    return fig
+
+# tên file -> (hàm vẽ, bảng cần có)
+CHARTS = {
+    "eval_feature_importance.png": (_chart_importance, "importance"),
+    "eval_ic_chart.png": (_chart_ic, "daily"),
+    "eval_ic_decay_chart.png": (_chart_ic_decay, "decay"),
+    "eval_alpha_chart.png": (_chart_alpha, "daily"),
+    "eval_quintile_chart.png": (_chart_quintile, "quantile_summary"),
+    "eval_backtest_chart.png": (_chart_backtest, "backtest"),
+}
+
+def _render(filename, result_path, out_path):
+    import matplotlib.pyplot as plt
+
+    func, _ = CHARTS[filename]
+    fig = func(_load(result_path), plt)
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+    return out_path
+
+# =============================================================================
+# ENTRY
+# =============================================================================
+
+def _get_pool(workers):
+    if workers not in _POOL:
+        _POOL[workers] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    return _POOL[workers]
+
+def render_all(result_path, report_dir, workers=2, wait=True):
+    """
+    Vẽ mọi biểu đồ có đủ dữ liệu từ kết quả đã cache (đường dẫn EvaluationResult) vào report_dir.
+    Ghi kèm summary.json. wait=True: trả về list đường dẫn PNG; wait=False: list Future.
+    """
+    with open(os.path.join(result_path, "summary.json"), "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    available = set(summary.get("tables", []))
+    pool = _get_pool(workers)
+    futures = [pool.submit(_render, name, result_path, os.path.join(report_dir, name))
+               for name, (_, table) in CHARTS.items() if table in available]
+    if not wait:
+        return futures
+
+    wait_futures(futures)
+    paths = []
+    for fut in futures:
+        try:
+            paths.append(fut.result())
+        except Exception as e:
+            print(f"⚠️ [Eval] Lỗi vẽ biểu đồ: {e}")
+    return paths
@@ -0,0 +1,139 @@
+import hashlib
+import importlib
+
+
+class Feature:
+    """
+    Khai báo 1 feature: tên, hàm tính, các input (cột thô hoặc feature khác),
+    lookback (số phiên cần thêm so với input), version và cách chuẩn hóa cross-sectional:
+      - "zscore": tạo cột Z_<name> = Z-Score theo ngày (clip ±3)
+      - "raw":    tạo cột Z_<name> = giá trị gốc (VD: cờ 0/1)
+      - None:     chỉ là bước trung gian, không đưa vào model
+    Tên bắt đầu bằng "_" là intermediate nội bộ (có thể trả về tuple), không thành cột.
+    """
+    def __init__(self, name, func, inputs, lookback=0, version=1, normalize="zscore"):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.lookback = lookback
+        self.version = version
+        self.normalize = normalize
+
+    @property
+    def is_column(self):
+        return not self.name.startswith("_")
+
+
+class _Context(dict):
+    """Bộ nhớ tạm khi tính: feature đã tính + fallback sang cột thô của DataFrame."""
+    def __init__(self, df):
+        super().__init__()
+        self.df = df
+
+    def __missing__(self, key):
+        return self.df[key]
+
+    def has(self, key):
+        return key in self or key in self.df.columns
+
+
+class FeatureRegistry:
+    def __init__(self):
+        self._features = {}
+        self._plugins_loaded = set()
+
+    def register(self, name, inputs=("close",), lookback=0, version=1, normalize="zscore"):
+        """Decorator: @FEATURE_REGISTRY.register("RSI", inputs=("close",), lookback=14)"""
+        def decorator(func):
+            self._features[name] = Feature(name, func, inputs, lookback, version, normalize)
+            return func
+        return decorator
+
+    def load_plugins(self, modules):
+        """Import các module khai báo thêm feature (alpha factor mới) qua register()."""
+        for mod in modules:
+            if mod not in self._plugins_loaded:
+                importlib.import_module(mod)
+                self._plugins_loaded.add(mod)
+
+    def __contains__(self, name):
+        return name in self._features
+
+    def names(self):
+        return list(self._features)
+
+    def model_features(self, names=None):
+        """Feature có cột Z_ (đưa vào model), theo thứ tự đăng ký."""
+        wanted = None if names is None else set(names)
+        return [f.name for f in self._features.values()
+                if f.is_column and f.normalize is not None and (wanted is None or f.name in wanted)]
+
+    def zscore_features(self, names=None):
+        wanted = None if names is None else set(names)
+        return [f.name for f in self._features.values()
+                if f.is_column and f.normalize == "zscore" and (wanted is None or f.name in wanted)]
+
+    def resolve(self, names=None):
+        """
+        Thứ tự tính (topological) cho các feature yêu cầu + toàn bộ phụ thuộc.
+        Input không phải feature đã đăng ký được coi là cột thô của DataFrame.
+        """
+        targets = self.names() if names is None else list(names)
+        order, state = [], {}
+
+        def visit(name, path):
+            if name not in self._features:
+                return
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Phụ thuộc vòng giữa các feature: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in self._features[name].inputs:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in targets:
+            if name not in self._features:
+                raise KeyError(f"Feature chưa đăng ký: {name}")
+            visit(name, [])
+        return order
+
+    def required_history(self, names=None):
+        """Số phiên lịch sử tối thiểu (đường dài nhất theo lookback trên DAG)."""
+        memo = {}
+
+        def depth(name):
+            if name not in self._features:
+                return 0
+            if name not in memo:
+                f = self._features[name]
+                memo[name] = f.lookback + max((depth(d) for d in f.inputs), default=0)
+            return memo[name]
+
+        return max((depth(n) for n in self.resolve(names)), default=0)
+
+    def version_hash(self, names=None):
+        """Hash phiên bản của tập feature (tên, inputs, lookback, version, normalize)."""
+        parts = []
+        for name in self.resolve(names):
+            f = self._features[name]
+            parts.append(f"{f.name}|{','.join(f.inputs)}|{f.lookback}|{f.version}|{f.normalize}")
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:12]
+
+    def compute(self, df, names=None):
+        """
+        Tính các feature yêu cầu (và CHỈ phụ thuộc của chúng) trên 1 mã đã sort theo date.
+        Intermediate dùng chung (Typical Price, Log Return, Bollinger...) chỉ tính 1 lần.
+        """
+        ctx = _Context(df)
+        for name in self.resolve(names):
+            f = self._features[name]
+            ctx[name] = f.func(ctx)
+            if f.is_column:
+                df[name] = ctx[name]
+        return df
+
+
+FEATURE_REGISTRY = FeatureRegistry()
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    from database.repo import DataRepository
+    from database import versions
+    from database.snapshots import JsonSnapshot
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.indicators import EPS
+    from tools.technical_scanner import align_bars
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from database.repo import DataRepository
+    from database import versions
+    from database.snapshots import JsonSnapshot
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.indicators import EPS
+    from tools.technical_scanner import align_bars
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class FlowConfig:
+    STORE_DIR = os.path.join("data", "flow")
+    PANEL_PATH = os.path.join(STORE_DIR, "panel.parquet")      # Dữ liệu thô (date, ticker, net, volume, close)
+    MARKET_PATH = os.path.join(STORE_DIR, "market.parquet")    # Dòng tiền toàn thị trường theo ngày (toàn lịch sử)
+    SNAPSHOT_PATH = os.path.join(STORE_DIR, "flow.json")       # Phiên cuối từng mã + thị trường (tra cứu O(1))
+
+    FIELDS = ("buy_foreign", "sell_foreign", "volume", "close")
+    WINDOWS = (5, 20, 60)       # Cửa sổ dòng tiền tích lũy
+    Z_WINDOW = 250              # Z-Score so với ~1 năm lịch sử của chính mã
+    Z_MIN_PERIODS = 60
+    PANEL_ROWS = 400            # Số phiên giữ lại mỗi mã (đủ cho Z_WINDOW + cửa sổ dài nhất)
+    HISTORY_DAYS = 3650         # Lần dựng đầu: đọc toàn lịch sử cho chuỗi thị trường
+    OVERLAP_DAYS = 10           # Cập nhật: đọc lại N ngày lịch cuối (bar bị crawler ghi đè)
+    Z_STRONG = 2.0              # |Z| >= 2 = dòng tiền bất thường
+
+# =============================================================================
+# 2. CÔNG THỨC (Series 1 mã hoặc DataFrame phiên x mã, vector hóa theo cột)
+# =============================================================================
+
+def net_flow(buy, sell):
+    return buy - sell
+
+def cumulative_ratio(net, volume, n):
+    """Mua/bán ròng tích lũy N phiên / tổng khối lượng N phiên."""
+    return net.rolling(n).sum() / (volume.rolling(n).sum() + EPS)
+
+def _run_length(mask):
+    """Số phiên liên tiếp mask=True tính đến mỗi phiên (0 nếu phiên đó False)."""
+    count = mask.astype(int).cumsum()
+    return count - count.where(~mask).ffill().fillna(0)
+
+def streak(net):
+    """Chuỗi mua/bán ròng: +N = mua ròng N phiên liên tiếp, -N = bán ròng N phiên liên tiếp."""
+    return _run_length(net > 0) - _run_length(net < 0)
+
+def flow_zscore(x, n=FlowConfig.Z_WINDOW, min_periods=FlowConfig.Z_MIN_PERIODS):
+    """
+    Z-Score so với lịch sử của chính chuỗi (rolling N phiên). Chuỗi không đổi (vd. nguồn dự phòng
+    không có khối ngoại -> toàn 0) cho Z = 0 thay vì NaN: feature tùy chọn không được làm dropna xóa cả mã.
+    """
+    mean = x.rolling(n, min_periods=min_periods).mean()
+    std = x.rolling(n, min_periods=min_periods).std()
+    return ((x - mean) / std.where(std > EPS)).mask(std <= EPS, 0.0)
+
+def market_daily(net, volume, close) -> pd.DataFrame:
+    """Panel (date x ticker) -> dòng tiền toàn thị trường theo ngày: giá trị ròng (VND), khối lượng, độ rộng."""
+    traded = net.notna()
+    return pd.DataFrame({
+        "net_value": (net * close).sum(axis=1, min_count=1),
+        "value": (volume * close).sum(axis=1, min_count=1),
+        "buyers": (net > 0).sum(axis=1),
+        "sellers": (net < 0).sum(axis=1),
+        "tickers": traded.sum(axis=1),
+    })[traded.any(axis=1)]
+
+def flow_table(panel: dict) -> pd.DataFrame:
+    """Panel thô {field: DataFrame date x ticker} -> bảng dòng tiền phiên cuối, 1 dòng / mã."""
+    aligned, last_date, bars = align_bars(panel)
+    net, volume, close = aligned["net"], aligned["volume"], aligned["close"]
+    ratio = net / (volume + EPS)
+    t = pd.DataFrame({"date": last_date, "bars": bars})
+    t["net"] = net.iloc[-1]
+    t["net_ratio"] = ratio.iloc[-1]
+    t["net_value"] = (net * close).iloc[-1]
+    for w in FlowConfig.WINDOWS:
+        t[f"cum_{w}"] = cumulative_ratio(net, volume, w).iloc[-1]
+        t[f"cum_value_{w}"] = (net * close).rolling(w).sum().iloc[-1]
+    t["streak"] = streak(net).iloc[-1].fillna(0).astype(int)
+    t["z"] = flow_zscore(ratio).iloc[-1]
+    t["z_cum_20"] = flow_zscore(cumulative_ratio(net, volume, 20)).iloc[-1]
+    t.index.name = "ticker"
+    return t
+
+def market_summary(market: pd.DataFrame) -> dict:
+    """Chuỗi thị trường theo ngày -> chỉ số phiên cuối (ròng, tích lũy, chuỗi, Z-Score, độ rộng)."""
+    if market.empty:
+        return {}
+    net = market["net_value"]
+    last = market.iloc[-1]
+    out = {
+        "date": market.index[-1].strftime("%Y-%m-%d"),
+        "net_value": float(net.iloc[-1]),
+        "net_ratio": float(net.iloc[-1] / (last["value"] + EPS)),
+        "buyers": int(last["buyers"]), "sellers": int(last["sellers"]), "tickers": int(last["tickers"]),
+        "streak": int(streak(net).iloc[-1]),
+        "z": flow_zscore(net).iloc[-1],
+    }
+    for w in FlowConfig.WINDOWS:
+        out[f"cum_value_{w}"] = float(net.tail(w).sum()) if len(net) >= w else None
+    return {k: (None if isinstance(v, float) and not np.isfinite(v) else v) for k, v in out.items()}
+
+# =============================================================================
+# 3. QUANT FEATURES (plugin: QuantConfig.FEATURE_PLUGINS += ["tools.foreign_flow"])
+# Dòng tiền thị trường là hằng số trong 1 phiên -> vô nghĩa với ranker theo phiên, chỉ đưa vào báo cáo.
+# =============================================================================
+
+def _has_foreign(d):
+    return d.has('buy_foreign') and d.has('sell_foreign')
+
+def _register_cumulative(n):
+    @FEATURE_REGISTRY.register(f"Foreign_Cum_{n}", inputs=("buy_foreign", "sell_foreign", "volume"), lookback=n)
+    def _f_foreign_cum(d):
+        if not _has_foreign(d):
+            return 0
+        return cumulative_ratio(net_flow(d['buy_foreign'], d['sell_foreign']), d['volume'], n)
+
+for _n in (20, 60):
+    _register_cumulative(_n)
+
+@FEATURE_REGISTRY.register("Foreign_Streak", inputs=("buy_foreign", "sell_foreign"))
+def _f_foreign_streak(d):
+    if not _has_foreign(d):
+        return 0
+    return streak(net_flow(d['buy_foreign'], d['sell_foreign']))
+
+@FEATURE_REGISTRY.register("Foreign_Flow_Z", inputs=("Foreign_Net_Ratio",), lookback=FlowConfig.Z_WINDOW)
+def _f_foreign_flow_z(d):
+    if not _has_foreign(d):
+        return 0
+    return flow_zscore(d['Foreign_Net_Ratio'])
+
+# =============================================================================
+# 4. ENGINE (cập nhật tăng dần) + STORE
+# =============================================================================
+
+def _write_parquet(df, path):
+    tmp = f"{path}.tmp"
+    df.to_parquet(tmp)
+    os.replace(tmp, path)
+
+def _clean(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and not np.isfinite(v):
+        return None
+    return v
+
+class FlowEngine:
+    """
+    Dòng tiền khối ngoại cả universe, cập nhật tăng dần: chỉ đọc DB từ phiên cuối đã lưu
+    (trừ OVERLAP_DAYS), ghép vào panel thô đã lưu rồi tính lại bảng phiên cuối trong 1 lượt.
+    Không có bar mới (database/versions.py) -> bỏ qua.
+    """
+    def __init__(self, repo=None, store_dir=FlowConfig.STORE_DIR):
+        self.repo = repo
+        self.panel_path = os.path.join(store_dir, os.path.basename(FlowConfig.PANEL_PATH))
+        self.market_path = os.path.join(store_dir, os.path.basename(FlowConfig.MARKET_PATH))
+        self.snapshot_path = os.path.join(store_dir, os.path.basename(FlowConfig.SNAPSHOT_PATH))
+
+    def _load_state(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            long = pd.read_parquet(self.panel_path)
+            market = pd.read_parquet(self.market_path)
+        except (OSError, ValueError):
+            return None, None, None
+        panel = {f: long.pivot(index="date", columns="ticker", values=f) for f in ("net", "volume", "close")}
+        return meta, panel, market
+
+    def update(self, tickers=None, force=False) -> dict:
+        t0 = time.time()
+        repo = self.repo or DataRepository()
+        try:
+            tickers = [t.upper().strip() for t in tickers] if tickers else repo.get_tickers()
+            if not tickers:
+                return {"error": "Không có mã nào trong DB."}
+            current = versions.current()
+            stamp = {t: current.get(t, 0) for t in tickers}
+            meta, old, market = (None, None, None) if force else self._load_state()
+            if meta and meta.get("versions") == stamp:
+                return {"status": "unchanged", "as_of": meta.get("as_of")}
+
+            if old is not None and set(tickers) == set(old["net"].columns):
+                start = old["net"].index[-1] - pd.Timedelta(days=FlowConfig.OVERLAP_DAYS)
+            else:
+                old, market = None, None
+                start = pd.Timestamp.now().normalize() - pd.Timedelta(days=FlowConfig.HISTORY_DAYS)
+            raw = repo.get_price_panel(tickers, days=0, fields=FlowConfig.FIELDS, start=start)
+        finally:
+            if self.repo is None:
+                repo.close()
+        if not raw:
+            return {"error": "Không có dữ liệu khối ngoại."}
+
+        new = {"net": net_flow(raw["buy_foreign"], raw["sell_foreign"]),
+               "volume": raw["volume"], "close": raw["close"]}
+        first = new["net"].index[0]
+        new_market = market_daily(new["net"], new["volume"], new["close"])
+        if old is not None:
+            new = {f: pd.concat([old[f][old[f].index < first], w]) for f, w in new.items()}
+            new_market = pd.concat([market[market.index < first], new_market])
+        panel = {f: w.reindex(columns=tickers).tail(FlowConfig.PANEL_ROWS) for f, w in new.items()}
+
+        table = flow_table(panel)
+        summary = market_summary(new_market)
+        entries = {
+            ticker: {k: _clean(v) for k, v in row.items()} | {"date": pd.Timestamp(row["date"]).strftime("%Y-%m-%d")}
+            for ticker, row in table.iterrows() if row["bars"] > 0
+        }
+
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        long = pd.DataFrame({f: w.stack() for f, w in panel.items()}).rename_axis(["date", "ticker"]).reset_index()
+        _write_parquet(long.dropna(subset=["close"]), self.panel_path)
+        _write_parquet(new_market, self.market_path)
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"built_at": datetime.now().isoformat(timespec="seconds"), "as_of": summary.get("date"),
+                       "versions": stamp, "market": {k: _clean(v) for k, v in summary.items()},
+                       "tickers": entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.snapshot_path)
+        mode = "cập nhật" if old is not None else "dựng mới"
+        print(f"🌏 [Flow] {mode} {len(entries)} mã từ {first:%Y-%m-%d} -> {self.snapshot_path} ({time.time() - t0:.1f}s)")
+        return {"status": "updated", "tickers": len(entries), "as_of": summary.get("date")}
+
+class FlowStore:
+    """Tra cứu O(1) dòng tiền đã tính sẵn; đọc lại file chỉ khi file đổi."""
+    _file = JsonSnapshot()
+
+    @staticmethod
+    def get(ticker: str, path=FlowConfig.SNAPSHOT_PATH):
+        return FlowStore._file.load(path).get("tickers", {}).get(ticker.upper().strip())
+
+    @staticmethod
+    def market(path=FlowConfig.SNAPSHOT_PATH):
+        return FlowStore._file.load(path).get("market")
+
+# =============================================================================
+# 5. RENDERING
+# =============================================================================
+
+def _bn(v):
+    return f"{v / 1e9:+,.1f} tỷ" if v is not None else "N/A"
+
+def _pct(v):
+    return f"{v:+.1%}" if v is not None else "N/A"
+
+def _z(v):
+    if v is None:
+        return "N/A"
+    tag = " (bất thường)" if abs(v) >= FlowConfig.Z_STRONG else ""
+    return f"{v:+.2f}{tag}"
+
+def _streak(n):
+    if not n:
+        return "Không có chuỗi"
+    return f"{'Mua' if n > 0 else 'Bán'} ròng {abs(int(n))} phiên liên tiếp"
+
+def render_flow(entry: dict, market: dict = None) -> str:
+    """Mục "dòng tiền khối ngoại" cho báo cáo kỹ thuật / prompt của TechnicalAgent."""
+    if not entry:
+        return ""
+    cum = " / ".join(f"{_pct(entry.get(f'cum_{w}'))} ({_bn(entry.get(f'cum_value_{w}'))})" for w in FlowConfig.WINDOWS)
+    windows = "/".join(str(w) for w in FlowConfig.WINDOWS)
+    text = f"""
+            **5. DÒNG TIỀN KHỐI NGOẠI (ngày {entry['date']}):**
+            - Ròng phiên: {entry['net']:+,.0f} cp ({_pct(entry.get('net_ratio'))} KL, {_bn(entry.get('net_value'))}) | Z-Score {FlowConfig.Z_WINDOW} phiên: {_z(entry.get('z'))}
+            - Tích lũy {windows} phiên (% KL): {cum} | Z-Score tích lũy 20 phiên: {_z(entry.get('z_cum_20'))}
+            - Chuỗi: {_streak(entry.get('streak'))}
+            """
+    if market:
+        text += f"""- Toàn thị trường: {_bn(market.get('net_value'))} (Z {_z(market.get('z'))}), {market['buyers']}/{market['tickers']} mã mua ròng, 20 phiên: {_bn(market.get('cum_value_20'))}, {_streak(market.get('streak'))}
+            """
+    return text
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# THƯ VIỆN CHỈ BÁO DÙNG CHUNG (báo cáo kỹ thuật, scanner, chart, feature Quant)
+# Mọi hàm nhận Series (1 mã) hoặc DataFrame phiên x mã (tính theo cột, vector hóa).
+# =============================================================================
+
+EPS = 1e-9      # Chống chia 0 (một giá trị cho mọi nơi -> RSI của agent kỹ thuật và Quant khớp nhau)
+
+def sma(x, n):
+    return x.rolling(n).mean()
+
+def rsi(close, period=14):
+    delta = close.diff()
+    # where(notna): phiên đệm NaN (panel đã dồn) không được tính là "tăng 0" trong cửa sổ
+    valid = close.notna()
+    gain = delta.where(delta > 0, 0).where(valid).rolling(period).mean()
+    loss = (-delta.where(delta < 0, 0)).where(valid).rolling(period).mean()
+    return 100 - (100 / (1 + gain / loss.replace(0, EPS)))
+
+def stoch_rsi(rsi_values, n=14):
+    lo, hi = rsi_values.rolling(n).min(), rsi_values.rolling(n).max()
+    return (rsi_values - lo) / (hi - lo)
+
+def macd(close, f=12, s=26, sig=9):
+    line = close.ewm(span=f, adjust=False).mean() - close.ewm(span=s, adjust=False).mean()
+    return line, line.ewm(span=sig, adjust=False).mean()
+
+def bollinger(close, n=20, k=2):
+    mid = close.rolling(n).mean()
+    std = close.rolling(n).std()
+    return mid + k * std, mid, mid - k * std
+
+def ichimoku(high, low, conversion=9, base=26):
+    """(Tenkan-sen, Kijun-sen)"""
+    tenkan = (high.rolling(conversion).max() + low.rolling(conversion).min()) / 2
+    kijun = (high.rolling(base).max() + low.rolling(base).min()) / 2
+    return tenkan, kijun
+
+def support_resistance(high, low, n=20):
+    """Hỗ trợ/kháng cự đơn giản: đáy/đỉnh N phiên"""
+    return low.rolling(n).min(), high.rolling(n).max()
+
+def atr(high, low, close, n=14):
+    """Average True Range (trung bình đơn giản của True Range)"""
+    prev = close.shift(1)
+    # fmax: phiên đầu (chưa có close trước) -> TR = high - low
+    tr = np.fmax(high - low, np.fmax((high - prev).abs(), (low - prev).abs()))
+    return tr.where(close.notna()).rolling(n).mean()
+
+def mfi_from_tp(tp, vol, n=14):
+    mf = tp * vol
+    pos = (mf.where(tp > tp.shift(), 0)).rolling(n).sum()
+    neg = (mf.where(tp < tp.shift(), 0)).rolling(n).sum()
+    return 100 - (100 / (1 + pos / (neg.replace(0, EPS))))
+
+def mfi(high, low, close, vol, n=14):
+    return mfi_from_tp((high + low + close) / 3, vol, n)
+
+def compute_indicators(bars: dict, sr_window: int = 20) -> dict:
+    """Bộ chỉ báo của báo cáo kỹ thuật trên {high, low, close, volume}: {tên: Series/DataFrame}."""
+    close, high, low, volume = bars["close"], bars["high"], bars["low"], bars["volume"]
+    out = {"sma50": sma(close, 50), "sma200": sma(close, 200)}
+    out["tenkan"], out["kijun"] = ichimoku(high, low)
+    out["rsi"] = rsi(close, 14)
+    out["stoch_rsi"] = stoch_rsi(out["rsi"], 14)
+    out["macd"], out["macd_signal"] = macd(close)
+    out["bb_upper"], out["bb_mid"], out["bb_lower"] = bollinger(close)
+    out["support"], out["resistance"] = support_resistance(high, low, sr_window)
+    out["vol_ma20"] = sma(volume, 20)
+    return out
+
+# =============================================================================
+# SNAPSHOT (giá trị phiên cuối của 1 mã) + CACHE THEO (mã, ngày)
+# =============================================================================
+
+@dataclass(frozen=True)
+class IndicatorSnapshot:
+    ticker: str
+    date: pd.Timestamp
+    bars: int
+    close: float
+    prev_close: float
+    change_pct: float
+    volume: float
+    sma50: float
+    sma200: float
+    tenkan: float
+    kijun: float
+    rsi: float
+    stoch_rsi: float
+    macd: float
+    macd_signal: float
+    macd_hist: float
+    bb_upper: float
+    bb_mid: float
+    bb_lower: float
+    support: float
+    resistance: float
+    vol_ma20: float
+    vol_ratio: float
+    above_sma50: bool
+    above_sma200: bool
+    ichimoku_bull: bool
+    macd_bull: bool
+    rsi_zone: str           # overbought | oversold | neutral
+    stoch_zone: str         # low | high | mid
+    bb_position: str        # above | below | inside
+    vol_status: str         # spike | low | normal
+
+    @classmethod
+    def from_row(cls, ticker: str, row) -> "IndicatorSnapshot":
+        """1 dòng của bảng chỉ báo (tools/technical_scanner.build_table) -> snapshot."""
+        values = {f.name: row[f.name] for f in fields(cls) if f.name != "ticker"}
+        for k, v in values.items():
+            if isinstance(v, np.generic):
+                values[k] = v.item()
+        values["date"] = pd.Timestamp(values["date"])
+        return cls(ticker=ticker, **values)
+
+    def to_dict(self) -> dict:
+        d = {f.name: getattr(self, f.name) for f in fields(self)}
+        d["date"] = self.date.strftime("%Y-%m-%d")
+        return d
+
+class SnapshotCache:
+    """LRU (mã, ngày bar cuối) -> IndicatorSnapshot: mỗi chỉ báo chỉ tính 1 lần / bar / process."""
+    MAX_ENTRIES = 4096
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ticker, date):
+        key = (ticker, pd.Timestamp(date))
+        with self._lock:
+            snap = self._entries.get(key)
+            if snap is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return snap
+
+    def put(self, snap: IndicatorSnapshot):
+        with self._lock:
+            self._entries[(snap.ticker, snap.date)] = snap
+            self._entries.move_to_end((snap.ticker, snap.date))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+SNAPSHOTS = SnapshotCache()
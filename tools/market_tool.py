@@ -3,149 +3,190 @@ import numpy as np
 import sys
 import os
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from database.repo import DataRepository
 from jobs.crawler import MarketCrawler
+from tools.price_cache import PriceCache, SingleFlight
+from tools.technical_scanner import ScannerConfig, render_report, snapshot_from_frame
+from tools.technical_levels import LevelEngine, LevelStore, render_levels
+from tools.foreign_flow import FlowEngine, FlowStore, render_flow
+
+class PriceLoadConfig:
+    STALE_AFTER_DAYS = 4        # Bar cuối cũ hơn N ngày lịch -> trả data hiện có + refresh nền
+    REFRESH_COOLDOWN = 900      # Giây; không tải lại 1 mã từ nguồn trong khoảng này
+    REFRESH_WORKERS = 2         # Thread refresh nền (nhịp gọi nguồn do SOURCE_LIMITER quyết định)
 
 class MarketToolkit:
-    _price_cache = {}
+    # LRU theo dung lượng, khóa (mã, số phiên), hết hạn khi crawler ghi bar mới
+    _price_cache = PriceCache()
+    # Tải từ nguồn: mỗi mã chỉ 1 lần tải đang chạy, các caller khác dùng chung kết quả
+    _fetches = SingleFlight()
+    _refresh_lock = threading.Lock()
+    _last_refresh = {}
+    _executor = None
+    _levels = {}                # Vùng giá tính tại chỗ khi store đêm chưa có bar mới nhất
+    _flow_updates = SingleFlight()  # Nhiều báo cáo cùng thấy store dòng tiền cũ -> chỉ 1 lần cập nhật
 
     @staticmethod
-    def get_price_data(symbol: str, days: int = 730) -> pd.DataFrame:
-        """Lấy dữ liệu giá có Cache (Giữ nguyên logic cũ)"""
-        symbol = symbol.upper().strip()
-        
-        # Check Cache RAM
-        if symbol in MarketToolkit._price_cache:
-            last_time, cached_df = MarketToolkit._price_cache[symbol]
-            if (pd.Timestamp.now() - last_time).total_seconds() < 3600:
-                # Lọc data cần thiết
-                return cached_df.tail(days + 50) # Lấy dư để tính chỉ báo
+    def _get_executor() -> ThreadPoolExecutor:
+        with MarketToolkit._refresh_lock:
+            if MarketToolkit._executor is None:
+                MarketToolkit._executor = ThreadPoolExecutor(
+                    max_workers=PriceLoadConfig.REFRESH_WORKERS, thread_name_prefix="price-refresh"
+                )
+            return MarketToolkit._executor
+
+    @staticmethod
+    def _claim_refresh(symbol: str) -> bool:
+        """True nếu mã đã qua cooldown (và đánh dấu đã refresh) -> tránh gọi nguồn liên tục cho mã không có bar mới"""
+        now = time.monotonic()
+        with MarketToolkit._refresh_lock:
+            last = MarketToolkit._last_refresh.get(symbol)
+            if last is not None and now - last < PriceLoadConfig.REFRESH_COOLDOWN:
+                return False
+            MarketToolkit._last_refresh[symbol] = now
+            return True
+
+    @staticmethod
+    def _fetch_and_store(symbol: str) -> int:
+        """Tải 10 năm từ nguồn (đã rate limit trong crawler) rồi ghi DB. Ghi bar mới -> cache giá tự hết hạn"""
+        crawler = MarketCrawler()
+        try:
+            df_new = crawler._fetch_from_api(symbol)
+            return crawler.repo.save_daily_data(symbol, df_new) if not df_new.empty else 0
+        except Exception as e:
+            print(f"⚠️ Lỗi tải {symbol} từ nguồn: {e}", file=sys.stderr)
+            return 0
+        finally:
+            crawler.repo.close()
 
+    @staticmethod
+    def _refresh(symbol: str, background: bool = False):
+        """Future số bar mới ghi được (single-flight theo mã)"""
+        executor = MarketToolkit._get_executor() if background else None
+        return MarketToolkit._fetches.submit(symbol, lambda: MarketToolkit._fetch_and_store(symbol), executor)
+
+    @staticmethod
+    def _load_price_history(symbol: str, days: int) -> pd.DataFrame:
+        """Đọc DB (lazy-load từ nguồn nếu mã chưa có dữ liệu)"""
         repo = DataRepository()
         try:
             # 1. Query DB
-            df = repo.get_price_history(symbol, days=days + 100) # Lấy dư 100 ngày để tính MA200
+            df = repo.get_price_history(symbol, days=days)
             
-            # 2. Lazy Loading
-            if df.empty:
-                crawler = MarketCrawler()
-                df_new = crawler._fetch_from_api(symbol)
-                if not df_new.empty:
-                    repo.save_daily_data(symbol, df_new)
-                    df = repo.get_price_history(symbol, days=days + 100)
-                time.sleep(1)
-
-            # Cache lại
-            if not df.empty:
-                MarketToolkit._price_cache[symbol] = (pd.Timestamp.now(), df)
-                return df.tail(days)
+            # 2. Lazy Loading (gộp với lần tải đang chạy nếu có)
+            if df.empty and (MarketToolkit._fetches.in_flight(symbol) or MarketToolkit._claim_refresh(symbol)):
+                if MarketToolkit._refresh(symbol).result() > 0:
+                    df = repo.get_price_history(symbol, days=days)
             return df
-            
+        finally:
+            repo.close()
+
+    @staticmethod
+    def _finish(symbol: str, df: pd.DataFrame, days: int, refresh_stale: bool) -> pd.DataFrame:
+        """Stale-while-revalidate: data cũ vẫn trả ngay, refresh chạy nền"""
+        if refresh_stale and not df.empty:
+            age = (pd.Timestamp.now() - pd.Timestamp(df['date'].iloc[-1])).days
+            if age > PriceLoadConfig.STALE_AFTER_DAYS and MarketToolkit._claim_refresh(symbol):
+                MarketToolkit._refresh(symbol, background=True)
+        return df.tail(days)
+
+    @staticmethod
+    def get_price_data(symbol: str, days: int = 730, refresh_stale: bool = True) -> pd.DataFrame:
+        """Lấy dữ liệu giá có Cache (đúng `days` phiên gần nhất)"""
+        symbol = symbol.upper().strip()
+        try:
+            # Lấy dư 100 ngày để tính MA200; bản cache dài hơn được dùng lại cho yêu cầu ngắn hơn
+            df = MarketToolkit._price_cache.get_or_load(
+                symbol, days + 100,
+                lambda n: MarketToolkit._load_price_history(symbol, n)
+            )
+            return MarketToolkit._finish(symbol, df, days, refresh_stale)
         except Exception as e:
             print(f"❌ Lỗi MarketTool: {e}", file=sys.stderr)
             return pd.DataFrame()
-        finally:
-            repo.close()
 
     @staticmethod
-    def get_technical_report(symbol: str) -> str:
+    async def get_price_data_async(symbol: str, days: int = 730, refresh_stale: bool = True) -> pd.DataFrame:
+        """Bản async: hit cache trả ngay trên event loop; miss -> đọc DB/tải nguồn trong thread, không chặn loop"""
+        symbol = symbol.upper().strip()
+        try:
+            df = MarketToolkit._price_cache.get(symbol, days + 100)
+            if df is None:
+                df = await asyncio.to_thread(
+                    MarketToolkit._price_cache.load, symbol, days + 100,
+                    lambda n: MarketToolkit._load_price_history(symbol, n)
+                )
+            return MarketToolkit._finish(symbol, df, days, refresh_stale)
+        except Exception as e:
+            print(f"❌ Lỗi MarketTool: {e}", file=sys.stderr)
+            return pd.DataFrame()
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Bộ đếm hit/miss/coalesced/eviction/invalidation của cache giá + số lần tải nguồn được gộp"""
+        return dict(MarketToolkit._price_cache.stats(), shared_fetches=MarketToolkit._fetches.shared)
+
+    @staticmethod
+    def get_indicator_snapshot(symbol: str):
+        """IndicatorSnapshot phiên cuối (cache theo mã + ngày bar; None nếu không có dữ liệu)"""
+        symbol = symbol.upper().strip()
+        # Lấy đủ dài để tính MA200 và Ichimoku
+        df = MarketToolkit.get_price_data(symbol, days=ScannerConfig.LOOKBACK)
+        return snapshot_from_frame(symbol, df)
+
+    @staticmethod
+    def get_levels(symbol: str, date=None):
         """
-        Phân tích kỹ thuật CHUYÊN SÂU (Advanced Technical Analysis)
+        Vùng hỗ trợ/kháng cự + mẫu hình: tra store tính sẵn hằng đêm (O(1));
+        store cũ hơn bar `date` -> tính tại chỗ cho riêng mã này.
         """
-        # Lấy đủ dài để tính MA200 và Ichimoku
-        df = MarketToolkit.get_price_data(symbol, days=365)
-        if df.empty: return "⚠️ Không có dữ liệu giá."
+        symbol = symbol.upper().strip()
+        day = pd.Timestamp(date).strftime("%Y-%m-%d") if date is not None else None
+        for entry in (LevelStore.get(symbol), MarketToolkit._levels.get(symbol)):
+            if entry and (day is None or entry["date"] >= day):
+                return entry
+        entry = LevelEngine().compute([symbol]).get(symbol)
+        if entry:
+            MarketToolkit._levels[symbol] = entry
+        return entry
 
-        try:
-            close = df['close']
-            high = df['high']
-            low = df['low']
-            
-            # --- 1. TREND INDICATORS ---
-            sma50 = close.rolling(50).mean()
-            sma200 = close.rolling(200).mean()
-            
-            # Ichimoku Cloud (Cơ bản: Conversion & Base Line)
-            nine_period_high = high.rolling(window=9).max()
-            nine_period_low = low.rolling(window=9).min()
-            tenkan_sen = (nine_period_high + nine_period_low) / 2
-            
-            twenty_six_period_high = high.rolling(window=26).max()
-            twenty_six_period_low = low.rolling(window=26).min()
-            kijun_sen = (twenty_six_period_high + twenty_six_period_low) / 2
-
-            # --- 2. MOMENTUM INDICATORS ---
-            # RSI
-            delta = close.diff()
-            gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-            loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-            rs = gain / (loss.replace(0, 1e-10))
-            rsi = 100 - (100 / (1 + rs))
-            
-            # Stochastic RSI (Nhạy hơn RSI thường)
-            min_rsi = rsi.rolling(14).min()
-            max_rsi = rsi.rolling(14).max()
-            stoch_rsi = (rsi - min_rsi) / (max_rsi - min_rsi)
-
-            # MACD
-            k = close.ewm(span=12, adjust=False).mean()
-            d = close.ewm(span=26, adjust=False).mean()
-            macd = k - d
-            signal = macd.ewm(span=9, adjust=False).mean()
-
-            # --- 3. VOLATILITY & LEVELS ---
-            # Bollinger Bands
-            sma20 = close.rolling(20).mean()
-            std = close.rolling(20).std()
-            upper = sma20 + 2*std
-            lower = sma20 - 2*std
-            
-            # Support & Resistance (Đơn giản: Đáy/Đỉnh 20 phiên)
-            support_20d = low.rolling(20).min().iloc[-1]
-            resistance_20d = high.rolling(20).max().iloc[-1]
+    @staticmethod
+    def get_foreign_flow(symbol: str, date=None):
+        """
+        Dòng tiền khối ngoại phiên cuối của mã + toàn thị trường: (entry, market), tra store O(1).
+        Store cũ hơn bar `date` -> cập nhật tăng dần cả universe (chỉ đọc phiên mới) rồi tra lại.
+        """
+        symbol = symbol.upper().strip()
+        day = pd.Timestamp(date).strftime("%Y-%m-%d") if date is not None else None
+        entry = FlowStore.get(symbol)
+        if entry is None or (day is not None and entry["date"] < day):
+            MarketToolkit._flow_updates.submit("flow", lambda: FlowEngine().update()).result()
+            entry = FlowStore.get(symbol)
+        return entry, FlowStore.market()
 
-            # --- TỔNG HỢP DỮ LIỆU HIỆN TẠI ---
-            curr_price = close.iloc[-1]
-            prev_price = close.iloc[-2]
-            
-            # Đánh giá Trend
-            trend_long = "UPTREND" if curr_price > sma200.iloc[-1] else "DOWNTREND"
-            trend_short = "BULLISH" if curr_price > sma50.iloc[-1] else "BEARISH"
-            
-            # Ichimoku Signal
-            ichimoku_sig = "Tích cực" if tenkan_sen.iloc[-1] > kijun_sen.iloc[-1] else "Tiêu cực"
-
-            # Oscillator Signals
-            rsi_val = rsi.iloc[-1]
-            stoch_val = stoch_rsi.iloc[-1]
-            macd_val = macd.iloc[-1]
-            sig_val = signal.iloc[-1]
-            
-            rsi_status = "QUÁ MUA (>70)" if rsi_val > 70 else "QUÁ BÁN (<30)" if rsi_val < 30 else "Trung tính"
-            macd_status = "MUA (Cắt lên)" if macd_val > sig_val else "BÁN (Cắt xuống)"
-            
-            # Volume Analysis
-            vol_mean = df['volume'].rolling(20).mean().iloc[-1]
-            curr_vol = df['volume'].iloc[-1]
-            vol_status = "Đột biến" if curr_vol > 1.5 * vol_mean else "Thấp" if curr_vol < 0.7 * vol_mean else "Trung bình"
+    @staticmethod
+    def technical_sections(snap) -> tuple:
+        """(chỉ báo, mục 4 vùng giá/mẫu hình, mục 5 khối ngoại) của 1 snapshot; mục không có dữ liệu là ""."""
+        flow, market = MarketToolkit.get_foreign_flow(snap.ticker, snap.date)
+        return (render_report(snap), render_levels(MarketToolkit.get_levels(snap.ticker, snap.date)),
+                render_flow(flow, market))
 
-            return f"""
-            ### 📊 PHÂN TÍCH KỸ THUẬT NÂNG CAO: {symbol}
-            
-            **1. CẤU TRÚC GIÁ & XU HƯỚNG:**
-            - Giá hiện tại: {curr_price:,.0f} VND ({trend_short} ngắn hạn / {trend_long} dài hạn)
-            - Hỗ trợ gần nhất (20d): {support_20d:,.0f}
-            - Kháng cự gần nhất (20d): {resistance_20d:,.0f}
-            - Ichimoku (Tenkan/Kijun): {ichimoku_sig}
-            
-            **2. ĐỘNG LƯỢNG (MOMENTUM):**
-            - RSI (14): {rsi_val:.2f} [{rsi_status}]
-            - Stoch RSI: {stoch_val:.2f} (0-1) - {'Vùng đáy' if stoch_val < 0.2 else 'Vùng đỉnh' if stoch_val > 0.8 else 'Trung gian'}
-            - MACD: {macd_status} (Histogram: {macd_val - sig_val:.2f})
-            
-            **3. BIẾN ĐỘNG & THANH KHOẢN:**
-            - Bollinger Bands: Giá đang ở {'TRÊN' if curr_price > upper.iloc[-1] else 'DƯỚI' if curr_price < lower.iloc[-1] else 'GIỮA'} dải băng.
-            - Volume: {curr_vol:,.0f} ({vol_status} so với TB 20 phiên)
-            """
+    @staticmethod
+    def render_technical(snap) -> str:
+        """Báo cáo kỹ thuật đầy đủ của 1 snapshot (chỉ báo + vùng giá/mẫu hình + khối ngoại), dùng chung cho tool và agent."""
+        return "".join(MarketToolkit.technical_sections(snap))
+
+    @staticmethod
+    def get_technical_report(symbol: str) -> str:
+        """
+        Phân tích kỹ thuật CHUYÊN SÂU (Advanced Technical Analysis)
+        """
+        try:
+            snap = MarketToolkit.get_indicator_snapshot(symbol)
+            if snap is None: return "⚠️ Không có dữ liệu giá."
+            return MarketToolkit.render_technical(snap)
         except Exception as e:
             return f"❌ Lỗi tính toán: {e}"
\ No newline at end of file
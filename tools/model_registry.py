@@ -0,0 +1,61 @@
+import os
+import json
+import uuid
+from datetime import datetime
+
+try:
+    from tools.quant_tool import QuantConfig
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+
+
+class ModelRegistry:
+    """
+    Sổ đăng ký model/thí nghiệm (append-only JSON Lines).
+    Mỗi dòng là một run: loại run, tham số, metrics và đường dẫn artifact.
+    """
+    REGISTRY_PATH = os.path.join(QuantConfig.MODEL_DIR, "registry.jsonl")
+
+    def __init__(self, path=None):
+        self.path = path or ModelRegistry.REGISTRY_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def log_run(self, kind: str, params: dict, metrics: dict, artifacts: dict = None, tags: dict = None) -> str:
+        """Ghi 1 run và trả về run_id."""
+        run_id = uuid.uuid4().hex[:12]
+        record = {
+            "run_id": run_id,
+            "kind": kind,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "params": params,
+            "metrics": metrics,
+            "artifacts": artifacts or {},
+            "tags": tags or {},
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        return run_id
+
+    def list_runs(self, kind: str = None) -> list:
+        if not os.path.exists(self.path):
+            return []
+        runs = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if kind is None or rec.get("kind") == kind:
+                    runs.append(rec)
+        return runs
+
+    def best_run(self, kind: str, metric: str, maximize: bool = True):
+        runs = [r for r in self.list_runs(kind) if metric in r.get("metrics", {})]
+        if not runs:
+            return None
+        return (max if maximize else min)(runs, key=lambda r: r["metrics"][metric])
@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    from database import versions
+except ImportError:
+    import os, sys
+    sys.path.append(os.getcwd())
+    from database import versions
+
+class CacheConfig:
+    MAX_BYTES = 64 * 1024 * 1024    # Tổng dung lượng DataFrame giữ trong RAM
+
+class PriceCache:
+    """
+    Cache LRU giới hạn theo dung lượng cho DataFrame giá, an toàn đa luồng.
+    - Khóa = (mã, số phiên đã nạp): yêu cầu ít phiên hơn dùng lại bản dài hơn, yêu cầu dài hơn -> nạp lại.
+    - Khóa riêng từng mã: nhiều thread cùng hỏi 1 mã chỉ nạp DB 1 lần (các thread còn lại chờ rồi dùng chung).
+    - Hết hạn theo phiên bản dữ liệu (database/versions.py) thay vì TTL: crawler ghi bar mới -> mã đó bị loại.
+    """
+    def __init__(self, max_bytes=CacheConfig.MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()       # (symbol, days) -> (df, nbytes, version)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._key_locks = {}
+        self._seen_versions = None
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    # --- Internals (gọi khi đang giữ self._lock) ---
+    def _remove(self, key, counter=None):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+        if counter:
+            self._stats[counter] += 1
+
+    def _sync_versions(self):
+        current = versions.current()
+        if current is self._seen_versions:
+            return
+        self._seen_versions = current
+        for key in [k for k, (_, _, v) in self._entries.items() if current.get(k[0], 0) != v]:
+            self._remove(key, "invalidations")
+
+    def _lookup(self, symbol, days):
+        # Bản ngắn nhất vẫn phủ đủ `days` phiên
+        best = None
+        for key in self._entries:
+            if key[0] == symbol and key[1] >= days and (best is None or key[1] < best[1]):
+                best = key
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best][0]
+
+    def _key_lock(self, symbol):
+        with self._lock:
+            return self._key_locks.setdefault(symbol, threading.Lock())
+
+    # --- Public ---
+    def get(self, symbol, days):
+        with self._lock:
+            self._sync_versions()
+            df = self._lookup(symbol, days)
+            self._stats["hits" if df is not None else "misses"] += 1
+            return df
+
+    def put(self, symbol, days, df, version=None):
+        if df is None or df.empty:
+            return
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if version is None:
+                version = versions.current().get(symbol, 0)
+            # Bản mới phủ các bản ngắn hơn của cùng mã -> bỏ bản cũ
+            for key in [k for k in self._entries if k[0] == symbol and k[1] <= days]:
+                self._remove(key)
+            self._entries[(symbol, days)] = (df, nbytes, version)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)), "evictions")
+
+    def get_or_load(self, symbol, days, loader):
+        """Trả về DataFrame >= `days` phiên của mã; miss -> loader(days) (chỉ 1 thread nạp mỗi mã)."""
+        df = self.get(symbol, days)
+        if df is not None:
+            return df
+        return self.load(symbol, days, loader)
+
+    def load(self, symbol, days, loader):
+        """Phần nạp của get_or_load (sau khi get() đã miss): chờ khóa mã, kiểm tra lại rồi mới gọi loader."""
+        with self._key_lock(symbol):
+            with self._lock:
+                self._sync_versions()
+                df = self._lookup(symbol, days)
+                if df is not None:
+                    self._stats["coalesced"] += 1
+                    return df
+                version = versions.current().get(symbol, 0)
+            df = loader(days)
+            self.put(symbol, days, df, version)
+            return df
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            for key in [k for k in self._entries if symbol is None or k[0] == symbol]:
+                self._remove(key, "invalidations")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+class SingleFlight:
+    """
+    Gộp các lời gọi trùng khóa đang chạy: chỉ 1 lần thực thi, các caller khác nhận chung Future.
+    Dùng cho tải dữ liệu từ nguồn (nhiều request cùng 1 mã thiếu dữ liệu -> 1 lần download).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def submit(self, key, fn, executor=None) -> Future:
+        """Future của lần gọi fn đang chạy cho key (tạo mới nếu chưa có).
+        executor=None -> caller đầu tiên chạy fn ngay trên thread của mình."""
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.shared += 1
+                return fut
+            fut = Future()
+            self._calls[key] = fut
+
+        def run():
+            try:
+                result, error = fn(), None
+            except BaseException as e:
+                result, error = None, e
+            with self._lock:
+                self._calls.pop(key, None)
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+        if executor is None:
+            run()
+        else:
+            executor.submit(run)
+        return fut
+
+    def do(self, key, fn):
+        """Chạy (hoặc chờ lần đang chạy) và trả kết quả."""
+        return self.submit(key, fn).result()
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
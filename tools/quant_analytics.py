@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class AnalyticsConfig:
+    N_QUANTILES = 5
+    TOP_K = 5
+    DECAY_HORIZONS = tuple(range(1, 21))    # T+1 .. T+20
+    MIN_NAMES = 10                          # Bỏ phiên có quá ít mã hợp lệ (giống evaluator cũ)
+
+# =============================================================================
+# 2. PRIMITIVES (mảng phiên x mã, tính theo trục cuối)
+# =============================================================================
+
+def _as_array(panel):
+    return np.asarray(panel.values if isinstance(panel, pd.DataFrame) else panel, dtype=np.float64)
+
+def _pairwise(x, y):
+    """Chỉ giữ các ô mà cả x và y cùng hợp lệ (NaN ở chỗ còn lại)."""
+    valid = np.isfinite(x) & np.isfinite(y)
+    return np.where(valid, x, np.nan), np.where(valid, y, np.nan), valid
+
+def row_rank(a):
+    """Hạng trung bình (ties = average) theo từng hàng, bỏ qua NaN. Hỗ trợ mảng 2D/3D."""
+    return rankdata(a, axis=-1, nan_policy="omit")
+
+def row_corr(x, y):
+    """Tương quan Pearson theo từng hàng (chỉ trên các cặp hợp lệ). Trả về (corr, số mã)."""
+    x, y, valid = _pairwise(x, y)
+    n = valid.sum(axis=-1)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xm = np.where(valid, x - x.sum(axis=-1, keepdims=True) / n[..., None], 0.0)
+        ym = np.where(valid, y - y.sum(axis=-1, keepdims=True) / n[..., None], 0.0)
+        corr = (xm * ym).sum(axis=-1) / np.sqrt((xm * xm).sum(axis=-1) * (ym * ym).sum(axis=-1))
+    corr[n < 3] = np.nan
+    return corr, n
+
+def rank_ic(scores, returns):
+    """Spearman IC theo từng phiên = Pearson trên hạng (xếp hạng sau khi ghép cặp hợp lệ)."""
+    x, y, _ = _pairwise(scores, returns)
+    return row_corr(row_rank(x), row_rank(y))
+
+def forward_returns(close, horizons):
+    """Lợi nhuận T+h từ giá đóng cửa: mảng (len(horizons) x phiên x mã)."""
+    close = _as_array(close)
+    out = np.full((len(horizons),) + close.shape, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i, h in enumerate(horizons):
+            out[i, :-h] = close[h:] / close[:-h] - 1.0
+    return out
+
+def quantile_buckets(scores, n_quantiles):
+    """Nhóm quantile theo TỪNG phiên (0 = điểm thấp nhất); -1 cho ô không hợp lệ."""
+    ranks = row_rank(scores)
+    n = np.isfinite(ranks).sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bucket = np.floor((ranks - 1.0) * n_quantiles / n)
+    return np.where(np.isfinite(bucket), bucket, -1).astype(np.int64)
+
+def _masked_mean(values, mask):
+    cnt = mask.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(mask, values, 0.0).sum(axis=-1) / cnt, cnt
+
+def _round_mean(values, digits):
+    values = values[np.isfinite(values)]
+    return round(float(values.mean()), digits) if len(values) else None
+
+# =============================================================================
+# 3. ANALYTICS
+# =============================================================================
+
+def ic_summary(ic, periods_per_year=252):
+    ic = ic[np.isfinite(ic)]
+    if len(ic) == 0:
+        return {"mean_ic": None, "ic_std": None, "icir": None, "t_stat": None, "positive_ratio": None, "n_days": 0}
+    std = ic.std(ddof=1) if len(ic) > 1 else np.nan
+    return {
+        "mean_ic": round(float(ic.mean()), 5),
+        "ic_std": round(float(std), 5),
+        "icir": round(float(ic.mean() / (std + 1e-9)), 4),
+        "ann_icir": round(float(ic.mean() / (std + 1e-9) * np.sqrt(periods_per_year)), 4),
+        "t_stat": round(float(ic.mean() / (std + 1e-9) * np.sqrt(len(ic))), 3),
+        "positive_ratio": round(float((ic > 0).mean()), 4),
+        "n_days": int(len(ic)),
+    }
+
+def quantile_returns(scores, returns, n_quantiles=AnalyticsConfig.N_QUANTILES):
+    """Lợi nhuận trung bình mỗi quantile theo từng phiên: mảng (phiên x quantile)."""
+    x, y, _ = _pairwise(scores, returns)
+    bucket = quantile_buckets(x, n_quantiles)
+    out = np.full((len(y), n_quantiles), np.nan)
+    for q in range(n_quantiles):
+        out[:, q], _ = _masked_mean(y, bucket == q)
+    return out
+
+def top_bottom_spread(scores, returns, k=AnalyticsConfig.TOP_K):
+    """Lợi nhuận TB Top-k, Bottom-k và chênh lệch theo từng phiên."""
+    x, y, valid = _pairwise(scores, returns)
+    ranks = row_rank(x)
+    n = valid.sum(axis=-1, keepdims=True)
+    top, _ = _masked_mean(y, ranks > n - k)
+    bot, _ = _masked_mean(y, ranks <= k)
+    return top, bot, top - bot
+
+def top_turnover(scores, n_quantiles=AnalyticsConfig.N_QUANTILES, lag=1):
+    """Tỷ lệ mã mới vào nhóm quantile cao nhất so với `lag` phiên trước."""
+    top = quantile_buckets(_as_array(scores), n_quantiles) == n_quantiles - 1
+    out = np.full(len(top), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[lag:] = 1.0 - (top[lag:] & top[:-lag]).sum(axis=-1) / top[lag:].sum(axis=-1)
+    return out
+
+def rank_autocorrelation(scores, lag=1):
+    """Tương quan hạng của điểm giữa phiên t và t-lag (độ ổn định tín hiệu)."""
+    s = _as_array(scores)
+    out = np.full(len(s), np.nan)
+    out[lag:], _ = rank_ic(s[lag:], s[:-lag])
+    return out
+
+def aligned_forward_returns(close, dates, tickers, horizons):
+    """
+    Lợi nhuận T+h tính trên TOÀN BỘ panel giá rồi mới lấy các phiên `dates`,
+    để phiên cuối của tập điểm vẫn có lợi nhuận tương lai nếu panel giá dài hơn.
+    """
+    close = close.sort_index().reindex(columns=tickers)
+    pos = close.index.get_indexer(pd.DatetimeIndex(dates))
+    fwd = forward_returns(close, horizons)[:, pos]
+    fwd[:, pos < 0] = np.nan
+    return fwd
+
+def ic_decay(scores, close, horizons=AnalyticsConfig.DECAY_HORIZONS):
+    """IC theo từng kỳ hạn T+h, tính gộp trên mảng 3D (kỳ hạn x phiên x mã). Trả về (IC, số mã)."""
+    fwd = aligned_forward_returns(close, scores.index, scores.columns, horizons)
+    s = np.broadcast_to(_as_array(scores), fwd.shape)
+    return rank_ic(s, fwd)
+
+def evaluate(scores, returns=None, close=None, horizon=3, n_quantiles=AnalyticsConfig.N_QUANTILES,
+             top_k=AnalyticsConfig.TOP_K, decay_horizons=AnalyticsConfig.DECAY_HORIZONS,
+             min_names=AnalyticsConfig.MIN_NAMES):
+    """
+    Toàn bộ phân tích tín hiệu cho 1 panel điểm (DataFrame phiên x mã), không vẽ biểu đồ.
+    returns: panel lợi nhuận kỳ hạn chính (VD: Raw_Target T+3); nếu None thì tính từ close.
+    close:   panel giá đóng cửa, cần cho IC decay (bỏ qua nếu None).
+    Trả về dict các DataFrame dạng tidy + summary.
+    """
+    dates = scores.index
+    if returns is None:
+        if close is None:
+            raise ValueError("Cần returns hoặc close.")
+        returns = aligned_forward_returns(close, dates, scores.columns, (horizon,))[0]
+    else:
+        returns = returns.reindex(index=dates, columns=scores.columns)
+
+    S = _as_array(scores)
+    R = _as_array(returns)
+    # Phiên quá ít mã -> loại khỏi mọi thống kê
+    thin = (np.isfinite(S) & np.isfinite(R)).sum(axis=1) < min_names
+    S = np.where(thin[:, None], np.nan, S)
+
+    ic, n_names = rank_ic(S, R)
+    qret = quantile_returns(S, R, n_quantiles)
+    top, bot, spread = top_bottom_spread(S, R, top_k)
+    labels = [f"Q{q + 1}" for q in range(n_quantiles)]
+
+    daily = pd.DataFrame({
+        "date": dates, "n": n_names, "ic": ic,
+        "top_return": top, "bottom_return": bot, "spread": spread,
+        "top_turnover": top_turnover(S, n_quantiles),
+        "rank_autocorr": rank_autocorrelation(S),
+    })
+    quantiles = pd.DataFrame(qret, columns=labels).assign(date=dates).melt(
+        id_vars="date", var_name="quantile", value_name="mean_return")
+
+    q_mean, _ = _masked_mean(np.nan_to_num(qret).T, np.isfinite(qret).T)
+    diffs = np.diff(q_mean)
+    result = {
+        "daily": daily,
+        "quantile_returns": quantiles,
+        "quantile_summary": pd.DataFrame({"quantile": labels, "mean_return": q_mean}),
+        "summary": dict(
+            ic_summary(ic),
+            horizon=horizon,
+            mean_spread=_round_mean(spread, 6),
+            monotonic=bool(np.isfinite(diffs).all() and np.all(diffs > 0)),
+            mean_top_turnover=_round_mean(daily["top_turnover"].values, 4),
+            mean_rank_autocorr=_round_mean(daily["rank_autocorr"].values, 4),
+        ),
+    }
+
+    if close is not None and len(decay_horizons):
+        S_frame = pd.DataFrame(S, index=dates, columns=scores.columns)
+        decay_ic, _ = ic_decay(S_frame, close, decay_horizons)
+        rows = []
+        for h, series in zip(decay_horizons, decay_ic):
+            s = ic_summary(series)
+            rows.append({"horizon": h, "mean_ic": s["mean_ic"], "ic_std": s["ic_std"], "icir": s["icir"]})
+        result["decay"] = pd.DataFrame(rows)
+    return result
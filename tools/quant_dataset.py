@@ -0,0 +1,213 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    from tools.quant_tool import QuantConfig, FeatureEngineer
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.quant_groups import grouping_fingerprint, industry_map, uses_industry
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig, FeatureEngineer
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.quant_groups import grouping_fingerprint, industry_map, uses_industry
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class DatasetConfig:
+    CACHE_DIR = os.path.join("data", "datasets")
+    # Tăng khi đổi logic Target / tiền xử lý để vô hiệu cache cũ
+    # (thay đổi từng feature đã được phản ánh qua FEATURE_REGISTRY.version_hash())
+    FEATURE_VERSION = "v1"
+    MAX_ENTRIES = 3             # Giữ tối đa N bản dataset gần nhất trên đĩa
+
+# =============================================================================
+# 2. TRAINING MATRIX
+# =============================================================================
+
+class TrainingMatrix:
+    """
+    Ma trận huấn luyện dạng mảng liên tục (đã sort theo date):
+    X (float32), y (Target_Rank), target (Raw_Target), qid (chỉ số phiên), dates, tickers,
+    fwd_returns (lợi nhuận T+h cho từng kỳ hạn trong meta["horizons"], NaN ở cuối chuỗi).
+    Khi được load từ cache, các mảng là np.memmap (read-only, không parse).
+    """
+    ARRAYS = ("X", "y", "target", "qid", "dates", "tickers", "fwd_returns")
+
+    def __init__(self, X, y, target, qid, dates, tickers, features, fwd_returns=None, meta=None, path=None):
+        self.X = X
+        self.y = y
+        self.target = target
+        self.qid = qid
+        self.dates = dates
+        self.tickers = tickers
+        self.fwd_returns = fwd_returns if fwd_returns is not None else np.empty((len(y), 0))
+        self.features = list(features)
+        self.meta = meta or {}
+        self.path = path
+
+    def __len__(self):
+        return len(self.y)
+
+    @property
+    def grouping(self):
+        """ZSCORE_GROUPING dùng khi dựng Z-Score của ma trận (ghi kèm model train từ ma trận này)."""
+        return self.meta.get("zscore_grouping", QuantConfig.ZSCORE_GROUPING)
+
+    @property
+    def horizons(self):
+        return [int(h) for h in self.meta.get("horizons", [])]
+
+    def horizon_target(self, h):
+        """Lợi nhuận tương lai T+h của mọi dòng (dùng chung X cho mọi kỳ hạn)."""
+        if h in self.horizons:
+            return self.fwd_returns[:, self.horizons.index(h)]
+        if h == self.meta.get("target_horizon", QuantConfig.TARGET_HORIZON):
+            return self.target
+        raise KeyError(f"Dataset không có kỳ hạn T+{h} (có: {self.horizons})")
+
+    @property
+    def unique_dates(self):
+        # qid = chỉ số phiên (0..n_days-1) nên ngày đầu tiên của mỗi qid là lịch phiên
+        first = np.flatnonzero(np.r_[True, self.qid[1:] != self.qid[:-1]])
+        return np.asarray(self.dates[first])
+
+    @classmethod
+    def from_frame(cls, train_df, features, meta=None):
+        dates = train_df['date'].values.astype('datetime64[ns]')
+        qid = np.searchsorted(np.unique(dates), dates).astype(np.int32)
+        horizons = [int(c.split('_')[-1]) for c in train_df.columns if c.startswith('Fwd_Ret_')]
+        fwd = train_df[[f'Fwd_Ret_{h}' for h in horizons]].values.astype(np.float64)
+        return cls(
+            fwd_returns=np.ascontiguousarray(fwd),
+            X=np.ascontiguousarray(train_df[features].values, dtype=np.float32),
+            y=train_df['Target_Rank'].values.astype(np.int32),
+            target=train_df['Raw_Target'].values.astype(np.float64),
+            qid=qid,
+            dates=dates,
+            tickers=train_df['ticker'].values.astype('U10'),
+            features=features,
+            meta=dict(meta or {}, horizons=horizons),
+        )
+
+    def to_frame(self):
+        """DataFrame tương thích build_training_frame() (dùng cho notebook / evaluator)."""
+        df = pd.DataFrame(np.asarray(self.X), columns=self.features)
+        df.insert(0, 'ticker', np.asarray(self.tickers))
+        df.insert(0, 'date', pd.to_datetime(np.asarray(self.dates)))
+        df['Raw_Target'] = np.asarray(self.target)
+        df['Target_Rank'] = np.asarray(self.y)
+        for i, h in enumerate(self.horizons):
+            df[f'Fwd_Ret_{h}'] = np.asarray(self.fwd_returns[:, i])
+        return df
+
+    def save(self, path):
+        """Ghi nguyên tử: ghi vào thư mục tạm rồi rename."""
+        tmp = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        meta = dict(self.meta, features=self.features, n_rows=len(self),
+                    created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in cls.ARRAYS}
+        return cls(features=meta["features"], meta=meta, path=path, **arrays)
+
+    # Khi gửi sang process con chỉ gửi đường dẫn, process con tự memmap lại (không copy dữ liệu)
+    def __getstate__(self):
+        if self.path:
+            return {"path": self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {"path"}:
+            state = TrainingMatrix.load(state["path"]).__dict__
+        self.__dict__.update(state)
+
+# =============================================================================
+# 3. CACHE
+# =============================================================================
+
+class DatasetCache:
+    def __init__(self, repo, cache_dir=DatasetConfig.CACHE_DIR):
+        self.repo = repo
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_key(self, days_history):
+        """Khóa = phiên bản dữ liệu (fingerprint DB) + phiên bản feature/target. Không chứa hyperparameter."""
+        FEATURE_REGISTRY.load_plugins(QuantConfig.FEATURE_PLUGINS)
+        payload = {
+            "data": self.repo.get_data_fingerprint(QuantConfig.TICKERS),
+            "days_history": days_history,
+            "feature_version": DatasetConfig.FEATURE_VERSION,
+            "feature_registry": FEATURE_REGISTRY.version_hash(),
+            "target_horizon": QuantConfig.TARGET_HORIZON,
+            "horizons": list(QuantConfig.HORIZONS),
+            "zscore_grouping": self.grouping_key(),
+        }
+        raw = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha1(raw).hexdigest()[:16]
+
+    def grouping_key(self):
+        mode = QuantConfig.ZSCORE_GROUPING
+        industries = industry_map(self.repo, QuantConfig.TICKERS) if uses_industry(mode) else None
+        return grouping_fingerprint(mode, industries)
+
+    def load_or_build(self, days_history=3650, force=False):
+        """
+        Trả về TrainingMatrix từ cache (memmap) nếu khóa khớp; nếu không thì dựng lại bằng
+        FeatureEngineer.build_training_frame, lưu cache rồi mở lại dạng memmap.
+        """
+        key = self.cache_key(days_history)
+        path = os.path.join(self.cache_dir, key)
+
+        if not force and os.path.exists(os.path.join(path, "meta.json")):
+            try:
+                matrix = TrainingMatrix.load(path)
+                print(f"⚡ [Dataset] CACHE HIT {key} ({len(matrix)} mẫu)")
+                return matrix
+            except Exception as e:
+                print(f"⚠️ [Dataset] Cache hỏng ({e}), dựng lại...")
+
+        print(f"🐢 [Dataset] CACHE MISS {key}: dựng lại features & target...")
+        train_df, features = FeatureEngineer.build_training_frame(self.repo, days_history)
+        if train_df.empty:
+            return None
+
+        meta = {"key": key, "days_history": days_history,
+                "feature_version": DatasetConfig.FEATURE_VERSION,
+                "feature_registry": FEATURE_REGISTRY.version_hash(),
+                "target_horizon": QuantConfig.TARGET_HORIZON,
+                "zscore_grouping": QuantConfig.ZSCORE_GROUPING}
+        TrainingMatrix.from_frame(train_df, features, meta).save(path)
+        self._evict()
+        return TrainingMatrix.load(path)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, "meta.json")
+            if os.path.exists(meta_path):
+                entries.append((os.path.getmtime(meta_path), name))
+        for _, name in sorted(entries, reverse=True)[DatasetConfig.MAX_ENTRIES:]:
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from tools.quant_tool import QuantConfig
+    from tools.quant_walkforward import WalkForwardConfig, daily_rank_ic
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+    from tools.quant_walkforward import WalkForwardConfig, daily_rank_ic
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class EnsembleConfig:
+    HORIZONS = QuantConfig.HORIZONS
+    BLEND_HORIZON = QuantConfig.TARGET_HORIZON   # Trọng số blend chấm theo IC với lợi nhuận T+3
+    MODEL_PATTERN = os.path.join(QuantConfig.MODEL_DIR, "ranker_h{h}.json")
+    MANIFEST_PATH = QuantConfig.ENSEMBLE_PATH
+    VALID_DAYS = WalkForwardConfig.VALID_DAYS    # Số phiên cuối giữ lại để ước lượng trọng số
+    N_BINS = 5                                   # Nhãn quintile theo ngày (như Target_Rank)
+    MAX_WORKERS = WalkForwardConfig.MAX_WORKERS
+    THREADS_PER_MODEL = WalkForwardConfig.THREADS_PER_FOLD
+    REFIT = True                                 # Train lại trên toàn bộ dữ liệu sau khi chọn trọng số
+
+# =============================================================================
+# 2. HELPERS (dữ liệu đã sort theo phiên: qid = chỉ số phiên)
+# =============================================================================
+
+def _group_bounds(qid):
+    starts = np.flatnonzero(np.r_[True, qid[1:] != qid[:-1]])
+    return starts, np.diff(np.r_[starts, len(qid)])
+
+def horizon_labels(qid, target, n_bins=EnsembleConfig.N_BINS):
+    """Nhãn quantile theo từng phiên (0..n_bins-1) của lợi nhuận T+h; -1 nếu thiếu target."""
+    s = pd.Series(target)
+    ranks = s.groupby(qid).rank(method="min").values
+    counts = s.notna().groupby(qid).transform("sum").values
+    with np.errstate(invalid="ignore", divide="ignore"):
+        labels = np.floor((ranks - 1) * n_bins / counts)
+    return np.where(np.isfinite(labels), labels, -1).astype(np.int32)
+
+def groupwise_zscore(values, qid=None):
+    """Z-Score theo từng phiên (cột = model). qid=None: cả mảng là 1 phiên (snapshot)."""
+    values = np.asarray(values, dtype=np.float64)
+    if qid is None:
+        mean, std = values.mean(axis=0), values.std(axis=0)
+        return (values - mean) / (std + 1e-9)
+    starts, counts = _group_bounds(np.asarray(qid))
+    sums = np.add.reduceat(values, starts, axis=0)
+    sq = np.add.reduceat(values * values, starts, axis=0)
+    mean = sums / counts[:, None]
+    std = np.sqrt(np.maximum(sq / counts[:, None] - mean * mean, 0.0))
+    return (values - np.repeat(mean, counts, axis=0)) / (np.repeat(std, counts, axis=0) + 1e-9)
+
+# =============================================================================
+# 3. WORKER: mỗi process train 1 kỳ hạn trên cùng TrainingMatrix (memmap)
+# =============================================================================
+
+_SHARED = {}
+
+def _init_worker(matrix):
+    # Số thread mỗi model do n_jobs giới hạn (xem _train_horizon)
+    _SHARED["matrix"] = matrix
+
+def _fit(X, y, qid, features, params):
+    import xgboost as xgb
+
+    model = xgb.XGBRanker(**params)
+    model.fit(pd.DataFrame(X, columns=features), y, qid=qid)
+    return model
+
+def _train_horizon(h, params, valid_days, refit, threads):
+    m = _SHARED["matrix"]
+    qid = np.asarray(m.qid)
+    target = np.asarray(m.horizon_target(h))
+    labels = horizon_labels(qid, target)
+    has_label = labels >= 0
+    params = dict(params, n_jobs=threads)
+    start = time.time()
+
+    # Train trên phần đầu, bỏ h phiên trước cửa sổ valid (purge) để nhãn không chồng lấn
+    cutoff = int(qid[-1]) + 1 - valid_days
+    train_end = int(np.searchsorted(qid, max(cutoff - h, 0)))
+    valid_start = int(np.searchsorted(qid, cutoff))
+    tr = np.flatnonzero(has_label[:train_end])
+    model = _fit(m.X[tr], labels[tr], qid[tr], m.features, params)
+    X_valid = np.ascontiguousarray(m.X[valid_start:], dtype=np.float32)
+    valid_pred = model.get_booster().inplace_predict(X_valid, validate_features=False)
+
+    if refit:
+        rows = np.flatnonzero(has_label)
+        model = _fit(m.X[rows], labels[rows], qid[rows], m.features, params)
+
+    return {
+        "horizon": h,
+        "n_train": int(len(tr)),
+        "valid_pred": np.asarray(valid_pred, dtype=np.float64),
+        "valid_ic_own": daily_rank_ic(qid[valid_start:], valid_pred, target[valid_start:]),
+        "fit_seconds": round(time.time() - start, 2),
+        "model_raw": bytes(model.get_booster().save_raw("json")),
+    }
+
+# =============================================================================
+# 4. TRAINER + BLENDER
+# =============================================================================
+
+class EnsembleTrainer:
+    def __init__(self, horizons=EnsembleConfig.HORIZONS, params=None, blend_horizon=EnsembleConfig.BLEND_HORIZON,
+                 valid_days=EnsembleConfig.VALID_DAYS, refit=EnsembleConfig.REFIT,
+                 max_workers=EnsembleConfig.MAX_WORKERS, threads_per_model=EnsembleConfig.THREADS_PER_MODEL):
+        self.horizons = [int(h) for h in horizons]
+        self.params = dict(params or QuantConfig.RANKER_PARAMS)
+        self.blend_horizon = blend_horizon
+        self.valid_days = valid_days
+        self.refit = refit
+        self.max_workers = max_workers
+        self.threads = threads_per_model
+
+    def run(self, matrix):
+        """matrix: TrainingMatrix có fwd_returns cho các kỳ hạn (tools/quant_dataset.py)."""
+        missing = [h for h in self.horizons + [self.blend_horizon]
+                   if h not in matrix.horizons and h != QuantConfig.TARGET_HORIZON]
+        if missing:
+            return {"error": f"Dataset thiếu kỳ hạn {missing}. Thêm vào QuantConfig.HORIZONS rồi dựng lại cache."}
+
+        print(f"🚀 [Ensemble] Train {len(self.horizons)} ranker (T+{', T+'.join(map(str, self.horizons))}) "
+              f"trên cùng 1 ma trận feature ({len(matrix)} mẫu)...")
+        results = {}
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(self.horizons)),
+                                 initializer=_init_worker, initargs=(matrix,)) as pool:
+            futures = {pool.submit(_train_horizon, h, self.params, self.valid_days, self.refit, self.threads): h
+                       for h in self.horizons}
+            for fut in as_completed(futures):
+                h = futures[fut]
+                try:
+                    results[h] = fut.result()
+                    print(f"   T+{h}: IC valid = {results[h]['valid_ic_own']:.4f} ({results[h]['fit_seconds']}s)")
+                except Exception as e:
+                    print(f"⚠️ [Ensemble] Ranker T+{h} lỗi: {e}")
+        if not results:
+            return {"error": "Không train được ranker nào."}
+
+        horizons = [h for h in self.horizons if h in results]
+        qid = np.asarray(matrix.qid)
+        valid_start = int(np.searchsorted(qid, int(qid[-1]) + 1 - self.valid_days))
+        valid_qid = qid[valid_start:]
+        blend_target = np.asarray(matrix.horizon_target(self.blend_horizon))[valid_start:]
+
+        # Điểm các model khác thang đo -> Z-Score theo phiên trước khi so sánh / blend
+        Z = groupwise_zscore(np.column_stack([results[h]["valid_pred"] for h in horizons]), valid_qid)
+        ics = np.array([daily_rank_ic(valid_qid, Z[:, i], blend_target) for i in range(len(horizons))])
+        positive = np.clip(np.nan_to_num(ics), 0, None)
+        weights = positive / positive.sum() if positive.sum() > 0 else np.full(len(horizons), 1.0 / len(horizons))
+        blend_ic = daily_rank_ic(valid_qid, Z @ weights, blend_target)
+
+        os.makedirs(QuantConfig.MODEL_DIR, exist_ok=True)
+        models = {}
+        for h in horizons:
+            path = EnsembleConfig.MODEL_PATTERN.format(h=h)
+            with open(path, "wb") as f:
+                f.write(results[h]["model_raw"])
+            models[str(h)] = path
+
+        manifest = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "features": list(matrix.features),
+            "horizons": horizons,
+            "models": models,
+            "weights": [round(float(w), 6) for w in weights],
+            "blend_horizon": self.blend_horizon,
+            "valid_days": self.valid_days,
+            "valid_ic": {str(h): round(float(ic), 5) for h, ic in zip(horizons, ics)},
+            "blend_valid_ic": round(float(blend_ic), 5),
+            "refit": self.refit,
+            QuantConfig.GROUPING_ATTR: matrix.grouping,
+        }
+        with open(EnsembleConfig.MANIFEST_PATH, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        from tools.model_registry import ModelRegistry
+        manifest["run_id"] = ModelRegistry().log_run(
+            "ensemble", self.params,
+            {"blend_valid_ic": manifest["blend_valid_ic"], **{f"valid_ic_t{h}": v for h, v in manifest["valid_ic"].items()}},
+            artifacts={"manifest": EnsembleConfig.MANIFEST_PATH, **{f"t{h}": p for h, p in models.items()}},
+            tags={"weights": dict(zip(map(str, horizons), manifest["weights"])), "zscore_grouping": matrix.grouping}
+        )
+        print(f"✅ [Ensemble] Trọng số {dict(zip(horizons, manifest['weights']))} -> IC blend (T+{self.blend_horizon}) "
+              f"= {blend_ic:.4f} | {EnsembleConfig.MANIFEST_PATH}")
+        return manifest
+
+# =============================================================================
+# 5. SERVING: chấm mọi ranker trong 1 lượt batch rồi blend
+# =============================================================================
+
+class MultiHorizonRanker:
+    """
+    Backend suy luận cho ensemble (cùng interface với tools/quant_inference.py: name, features, predict).
+    X được chuyển sang float32 liên tục đúng 1 lần và dùng chung cho mọi booster.
+    """
+    name = "ensemble"
+
+    def __init__(self, manifest):
+        import xgboost as xgb
+
+        self.manifest = manifest
+        self.features = list(manifest["features"])
+        self.horizons = [int(h) for h in manifest["horizons"]]
+        self.weights = np.asarray(manifest["weights"], dtype=np.float64)
+        self.boosters = []
+        for h in self.horizons:
+            booster = xgb.Booster(model_file=manifest["models"][str(h)])
+            booster.set_param({"nthread": 1})
+            self.boosters.append(booster)
+
+    @classmethod
+    def load(cls, path=EnsembleConfig.MANIFEST_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def predict_all(self, X):
+        """Điểm thô của từng ranker: mảng (số dòng x số kỳ hạn)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.empty((len(X), len(self.boosters)))
+        for i, booster in enumerate(self.boosters):
+            out[:, i] = booster.inplace_predict(X, validate_features=False)
+        return out
+
+    def blend(self, raw, qid=None):
+        return groupwise_zscore(raw, qid) @ self.weights
+
+    def predict(self, X, qid=None):
+        """Điểm blend. qid=None: X là 1 lát cắt cùng phiên (snapshot xếp hạng)."""
+        return self.blend(self.predict_all(X), qid)
+
+    def contributions(self, X):
+        """
+        Đóng góp SHAP của điểm blend (1 phiên): Z-Score là phép affine nên
+        đóng góp = sum_h w_h * SHAP_h / std_h, bias hấp thụ phần trung bình. Tổng mỗi dòng = điểm blend.
+        """
+        import xgboost as xgb
+
+        raw = self.predict_all(X)
+        mean, std = raw.mean(axis=0), raw.std(axis=0) + 1e-9
+        dmat = xgb.DMatrix(np.ascontiguousarray(X, dtype=np.float32), feature_names=self.features)
+        total = np.zeros((len(X), len(self.features) + 1))
+        for i, booster in enumerate(self.boosters):
+            c = booster.predict(dmat, pred_contribs=True).astype(float)
+            c[:, -1] -= mean[i]
+            total += self.weights[i] / std[i] * c
+        return total
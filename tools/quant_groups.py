@@ -0,0 +1,139 @@
+import time
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class GroupConfig:
+    # "market": Z-Score trên toàn universe (mặc định, như cũ)
+    # "industry": trong từng ngành | "regime": trong nhóm cùng Trend_Regime | "industry_regime": cả hai
+    MODES = ("market", "industry", "regime", "industry_regime")
+    MIN_GROUP_SIZE = 5          # Nhóm ít mã hơn -> dùng Z-Score toàn thị trường cho nhóm đó
+    REGIME_COLUMN = "Trend_Regime"
+    DEFAULT_INDUSTRY = "GENERAL"
+    CACHE_TTL = 6 * 3600        # Giây; bảng symbols hầu như không đổi trong ngày
+
+    # Dự phòng khi bảng symbols chưa có ngành (đồng bộ với agents/financial_analysis.py)
+    FALLBACK_INDUSTRY = {
+        "BANK": ["ACB", "BID", "CTG", "HDB", "LPB", "MBB", "SHB", "SSB",
+                 "STB", "TCB", "TPB", "VCB", "VIB", "VPB"],
+        "REAL_ESTATE": ["BCM", "VHM", "VIC", "VRE"],
+    }
+
+def uses_industry(mode):
+    return mode in ("industry", "industry_regime")
+
+def uses_regime(mode):
+    return mode in ("regime", "industry_regime")
+
+# =============================================================================
+# 2. GROUP ASSIGNMENTS (cache theo process)
+# =============================================================================
+
+_INDUSTRY_CACHE = {}
+
+def fallback_industries(tickers):
+    lookup = {t: ind for ind, members in GroupConfig.FALLBACK_INDUSTRY.items() for t in members}
+    return {t: lookup.get(t, GroupConfig.DEFAULT_INDUSTRY) for t in tickers}
+
+def industry_map(repo, tickers, refresh=False):
+    """
+    {ticker: ngành} từ bảng symbols, mã thiếu ngành lấy theo FALLBACK_INDUSTRY.
+    Kết quả được cache CACHE_TTL giây (training, evaluation và ranking dùng chung).
+    """
+    key = tuple(sorted(tickers))
+    hit = _INDUSTRY_CACHE.get(key)
+    if hit and not refresh and time.time() - hit[0] < GroupConfig.CACHE_TTL:
+        return hit[1]
+
+    mapping = fallback_industries(tickers)
+    if repo is not None:
+        mapping.update(repo.get_industry_map(tickers))
+    _INDUSTRY_CACHE[key] = (time.time(), mapping)
+    return mapping
+
+def grouping_fingerprint(mode, industries=None):
+    """Phần khóa cache dataset: đổi cách chia nhóm / bảng ngành -> dựng lại Z-Score."""
+    payload = {"mode": mode, "min_size": GroupConfig.MIN_GROUP_SIZE}
+    if uses_industry(mode):
+        payload["industries"] = sorted((industries or {}).items())
+    return hashlib.sha1(json.dumps(payload).encode()).hexdigest()[:12]
+
+# =============================================================================
+# 3. SEGMENT REDUCTIONS
+# =============================================================================
+
+def segment_zscore(values, segments, ddof=1):
+    """
+    Z-Score của từng cột trong mỗi segment (values: n x k, segments: mã nhóm int, n).
+    Sort 1 lần theo segment rồi dùng np.add.reduceat -> O(n log n), không groupby Python.
+    Trả về (z: n x k, kích thước segment của từng dòng). Segment 1 phần tử -> NaN (như pandas std).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    segments = np.asarray(segments)
+    n = len(segments)
+    if n == 0:
+        return values.copy(), np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(segments, kind="stable")
+    seg = segments[order]
+    starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    sizes = np.diff(np.r_[starts, n])
+
+    v = values[order]
+    valid = np.isfinite(v)
+    v0 = np.where(valid, v, 0.0)
+    cnt = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.add.reduceat(v0, starts, axis=0) / cnt
+        dev = np.where(valid, v0 - np.repeat(mean, sizes, axis=0), 0.0)
+        var = np.add.reduceat(dev * dev, starts, axis=0) / (cnt - ddof)
+        var[cnt - ddof <= 0] = np.nan
+        z = np.where(valid, dev / (np.repeat(np.sqrt(var), sizes, axis=0) + 1e-9), np.nan)
+
+    out = np.empty_like(z)
+    out[order] = z
+    row_sizes = np.empty(n, dtype=np.int64)
+    row_sizes[order] = np.repeat(sizes, sizes)
+    return out, row_sizes
+
+def group_codes(frame, mode, industries=None):
+    """Mã nhóm (int) của từng dòng theo mode; None nếu mode = market."""
+    if mode not in GroupConfig.MODES:
+        raise ValueError(f"ZSCORE_GROUPING không hợp lệ: {mode} (chọn trong {GroupConfig.MODES})")
+    if mode == "market":
+        return None
+
+    keys = []
+    if uses_industry(mode):
+        industries = industries or fallback_industries(frame["ticker"].unique())
+        keys.append(frame["ticker"].map(industries).fillna(GroupConfig.DEFAULT_INDUSTRY).astype(str).values)
+    if uses_regime(mode):
+        keys.append(frame[GroupConfig.REGIME_COLUMN].fillna(-1).astype(int).astype(str).values)
+    combined = keys[0] if len(keys) == 1 else np.char.add(np.char.add(keys[0], "|"), keys[1])
+    return pd.factorize(combined)[0]
+
+def grouped_zscore(frame, columns, mode="market", industries=None, date_col="date",
+                   min_size=GroupConfig.MIN_GROUP_SIZE):
+    """
+    Z-Score cross-sectional (theo phiên `date_col`, bỏ qua nếu không có cột) của `columns`,
+    chia nhóm theo mode. Nhóm nhỏ hơn min_size trong phiên -> Z-Score toàn thị trường.
+    Trả về ndarray (dòng x cột), chưa clip.
+    """
+    values = frame[columns].to_numpy(dtype=np.float64)
+    if date_col in frame.columns:
+        day = pd.factorize(frame[date_col])[0].astype(np.int64)
+    else:
+        day = np.zeros(len(frame), dtype=np.int64)
+
+    z_market, _ = segment_zscore(values, day)
+    codes = group_codes(frame, mode, industries)
+    if codes is None:
+        return z_market
+
+    z_group, sizes = segment_zscore(values, day * (int(codes.max()) + 1) + codes)
+    return np.where((sizes >= min_size)[:, None], z_group, z_market)
@@ -0,0 +1,153 @@
+import os
+import time
+import hashlib
+import numpy as np
+
+try:
+    from tools.quant_tool import QuantConfig
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class InferenceConfig:
+    BACKENDS = ("xgboost", "inplace", "treelite")
+    COMPILED_DIR = os.path.join(QuantConfig.MODEL_DIR, "compiled")
+    VERIFY_ROWS = 512
+    VERIFY_ATOL = 1e-4
+    NTHREAD = 1                 # Universe nhỏ: 1 thread nhanh hơn chi phí đồng bộ đa luồng
+
+# =============================================================================
+# 2. BACKENDS
+# =============================================================================
+
+class XGBoostBackend:
+    """Tham chiếu: XGBRanker.predict trên DataFrame (như cũ)."""
+    name = "xgboost"
+
+    def __init__(self, model, features):
+        import pandas as pd
+
+        self._pd = pd
+        self.model = model
+        self.features = list(features)
+
+    def predict(self, X):
+        return self.model.predict(self._pd.DataFrame(X, columns=self.features))
+
+
+class InplaceBackend:
+    """
+    Booster.inplace_predict trên mảng float32 liên tục: bỏ qua DataFrame -> DMatrix.
+    Giữ nguyên iteration_range (best_iteration) như XGBRanker.predict.
+    """
+    name = "inplace"
+
+    def __init__(self, model, features):
+        self.booster = model.get_booster()
+        self.booster.set_param({"nthread": InferenceConfig.NTHREAD})
+        self.features = list(features)
+        best = getattr(model, "best_iteration", None)
+        self.iteration_range = (0, best + 1) if best is not None else (0, 0)
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range, validate_features=False)
+
+
+class TreeliteBackend:
+    """
+    Cây được biên dịch thành thư viện native qua treelite + tl2cgen (tùy chọn).
+    Thư viện được cache theo hash của file model, chỉ biên dịch lại khi model đổi.
+    """
+    name = "treelite"
+
+    def __init__(self, model, features, model_path=QuantConfig.MODEL_PATH):
+        import treelite
+        import tl2cgen
+
+        self._tl2cgen = tl2cgen
+        self.features = list(features)
+
+        with open(model_path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:12]
+        os.makedirs(InferenceConfig.COMPILED_DIR, exist_ok=True)
+        ext = ".dll" if os.name == "nt" else ".so"
+        libpath = os.path.join(InferenceConfig.COMPILED_DIR, f"ranker_{digest}{ext}")
+
+        if not os.path.exists(libpath):
+            booster = model.get_booster()
+            best = getattr(model, "best_iteration", None)
+            if best is not None:
+                # Treelite không biết best_iteration -> cắt bớt cây thừa trước khi biên dịch
+                booster = booster[: best + 1]
+            tl_model = treelite.frontend.from_xgboost(booster)
+            print(f"⚙️ [Quant] Biên dịch model -> {libpath} ...")
+            tl2cgen.export_lib(tl_model, toolchain="msvc" if os.name == "nt" else "gcc",
+                               libpath=libpath, params={"parallel_comp": os.cpu_count() or 1})
+        self.predictor = tl2cgen.Predictor(libpath, nthread=InferenceConfig.NTHREAD)
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = self.predictor.predict(self._tl2cgen.DMatrix(X), pred_margin=True)
+        return np.asarray(out).reshape(len(X))
+
+# =============================================================================
+# 3. FACTORY & VERIFICATION
+# =============================================================================
+
+def verify_backend(backend, reference, n_features, n_rows=InferenceConfig.VERIFY_ROWS,
+                   atol=InferenceConfig.VERIFY_ATOL, seed=0):
+    """
+    So sánh số học backend với tham chiếu trên mẫu Z-Score tổng hợp (trong [-3, 3]).
+    Trả về dict: ok, max_abs_err, thời gian mỗi dòng (µs) của hai bên.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.ascontiguousarray(rng.uniform(-3, 3, size=(n_rows, n_features)), dtype=np.float32)
+
+    t0 = time.perf_counter()
+    ref = np.asarray(reference.predict(X), dtype=np.float64)
+    t1 = time.perf_counter()
+    out = np.asarray(backend.predict(X), dtype=np.float64)
+    t2 = time.perf_counter()
+
+    err = float(np.max(np.abs(out - ref))) if n_rows else 0.0
+    return {
+        "backend": backend.name,
+        "ok": bool(err <= atol),
+        "max_abs_err": err,
+        "reference_us_per_row": round((t1 - t0) / max(n_rows, 1) * 1e6, 3),
+        "backend_us_per_row": round((t2 - t1) / max(n_rows, 1) * 1e6, 3),
+    }
+
+def make_backend(name, model, features, verify=True):
+    """
+    Tạo backend suy luận. Backend tùy chọn bị thiếu thư viện hoặc lệch số học
+    so với tham chiếu sẽ tự fallback về XGBoostBackend.
+    """
+    reference = XGBoostBackend(model, features)
+    if name == "xgboost":
+        return reference
+    if name not in InferenceConfig.BACKENDS:
+        print(f"⚠️ [Quant] Backend '{name}' không hỗ trợ, dùng 'xgboost'.")
+        return reference
+
+    try:
+        backend = InplaceBackend(model, features) if name == "inplace" else TreeliteBackend(model, features)
+    except ImportError:
+        print(f"⚠️ [Quant] Thiếu thư viện cho backend '{name}' (pip install treelite tl2cgen), dùng 'xgboost'.")
+        return reference
+    except Exception as e:
+        print(f"⚠️ [Quant] Không khởi tạo được backend '{name}': {e}. Dùng 'xgboost'.")
+        return reference
+
+    if verify:
+        report = verify_backend(backend, reference, len(features))
+        if not report["ok"]:
+            print(f"⚠️ [Quant] Backend '{name}' lệch tham chiếu (max_err={report['max_abs_err']:.2e}), dùng 'xgboost'.")
+            return reference
+    return backend
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    from tools.quant_tool import QuantConfig
+    from tools.quant_analytics import rank_ic
+    from tools.feature_registry import FEATURE_REGISTRY
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+    from tools.quant_analytics import rank_ic
+    from tools.feature_registry import FEATURE_REGISTRY
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class MonitorConfig:
+    STATE_DIR = os.path.join("data", "monitor")
+    PROFILE_PATH = os.path.join(STATE_DIR, "drift_profile.json")
+    STATE_PATH = os.path.join(STATE_DIR, "drift_state.json")
+
+    N_BINS = 10                 # Histogram tham chiếu: biên theo decile của dữ liệu train
+    N_QUANTILES = 101           # Sketch CDF tham chiếu (cho KS): phân vị 0..100%
+    REFERENCE_DAYS = 750        # Chỉ lấy ~3 năm cuối của dataset làm phân phối tham chiếu (None = tất cả)
+    WINDOW_DAYS = 20            # Cửa sổ trượt của snapshot live để tính PSI/KS
+    MIN_WINDOW_DAYS = 5         # Chưa đủ số phiên -> chỉ ghi metrics, chưa cảnh báo
+
+    PSI_WARN = 0.10
+    PSI_ALERT = 0.25            # Ngưỡng kinh điển: > 0.25 = lệch phân phối đáng kể
+    KS_ALERT = 0.30
+    MAX_DRIFTED = 3             # Số feature vượt PSI_ALERT để đề xuất retrain
+
+    IC_HORIZON = QuantConfig.TARGET_HORIZON
+    IC_WINDOW = 20              # Rolling IC trên N phiên đã có lợi nhuận thực tế
+    MIN_IC_DAYS = 10
+    MIN_ROLLING_IC = 0.0        # Rolling IC <= ngưỡng -> đề xuất retrain
+
+# =============================================================================
+# 2. SKETCH / DISTANCE PRIMITIVES
+# =============================================================================
+
+def _bin_edges(values, n_bins=MonitorConfig.N_BINS):
+    inner = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])
+    return np.unique(inner)
+
+def bin_counts(values, edges):
+    """Số mẫu mỗi bin (len(edges) + 1 bin), bỏ qua NaN."""
+    values = values[np.isfinite(values)]
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+def psi(expected, actual, eps=1e-4):
+    """Population Stability Index giữa 2 histogram (đếm hoặc tỷ lệ)."""
+    e = np.asarray(expected, dtype=np.float64)
+    a = np.asarray(actual, dtype=np.float64)
+    if a.sum() == 0 or e.sum() == 0:
+        return np.nan
+    e = np.clip(e / e.sum(), eps, None)
+    a = np.clip(a / a.sum(), eps, None)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+def ks_statistic(ref_quantiles, values):
+    """KS giữa mẫu live và CDF tham chiếu (nội suy từ sketch phân vị)."""
+    x = np.sort(values[np.isfinite(values)])
+    n = len(x)
+    if n == 0:
+        return np.nan
+    probs = np.linspace(0, 1, len(ref_quantiles))
+    # Phân vị trùng nhau (điểm khối, VD cờ 0/1 hoặc Z bị fill 0) -> lấy CDF bên phải
+    ref_q, idx = np.unique(ref_quantiles[::-1], return_index=True)
+    ref_cdf = probs[::-1][idx]
+    f_ref = np.interp(x, ref_q, ref_cdf, left=0.0, right=1.0)
+    f_hi = np.arange(1, n + 1) / n
+    f_lo = np.arange(0, n) / n
+    return float(max(np.max(f_hi - f_ref), np.max(f_ref - f_lo)))
+
+# =============================================================================
+# 3. MONITOR
+# =============================================================================
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+class DriftMonitor:
+    """
+    Giám sát lệch phân phối feature/target và IC thực tế của model đang chạy.
+    - Profile tham chiếu (histogram + sketch phân vị từng feature) dựng 1 lần từ dataset train, cache JSON.
+    - Mỗi ngày: thêm histogram của snapshot live vào cửa sổ trượt (state JSON), tính PSI/KS,
+      chấm IC các phiên đã đủ T+h, ghi bảng quant_metrics và trả về cờ đề xuất retrain.
+    """
+    def __init__(self, toolkit=None):
+        if toolkit is None:
+            from tools.quant_tool import QuantToolkit
+            toolkit = QuantToolkit()
+        self.qt = toolkit
+        self.repo = toolkit.repo
+        os.makedirs(MonitorConfig.STATE_DIR, exist_ok=True)
+
+    # --- Model + Profile ---
+    def model_id(self):
+        path = QuantConfig.ENSEMBLE_PATH if getattr(self.qt.backend, "name", "") == "ensemble" else QuantConfig.MODEL_PATH
+        return _file_digest(path) if os.path.exists(path) else "none"
+
+    def build_profile(self, matrix=None):
+        """Dựng profile tham chiếu từ TrainingMatrix (memmap đã cache)."""
+        if matrix is None:
+            matrix = self.qt.load_training_matrix()
+        if matrix is None:
+            return None
+
+        qid = np.asarray(matrix.qid)
+        start = 0
+        if MonitorConfig.REFERENCE_DAYS:
+            start = int(np.searchsorted(qid, qid[-1] + 1 - MonitorConfig.REFERENCE_DAYS))
+        X = np.asarray(matrix.X[start:])
+        columns = {f: X[:, i] for i, f in enumerate(matrix.features) if f in self.qt.features}
+        columns["__target__"] = np.asarray(matrix.target[start:])
+
+        probs = np.linspace(0, 1, MonitorConfig.N_QUANTILES)
+        features = {}
+        for name, values in columns.items():
+            values = values[np.isfinite(values)]
+            edges = _bin_edges(values)
+            features[name] = {
+                "edges": edges.tolist(),
+                "counts": bin_counts(values, edges).tolist(),
+                "quantiles": np.quantile(values, probs).tolist(),
+                "std": float(values.std()),
+            }
+
+        profile = {
+            "model": self.model_id(),
+            "dataset": matrix.meta.get("key"),
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "n_rows": int(len(X)),
+            "features": features,
+        }
+        with open(MonitorConfig.PROFILE_PATH, "w", encoding="utf-8") as f:
+            json.dump(profile, f)
+        print(f"📐 [Monitor] Profile tham chiếu: {len(features) - 1} feature, {len(X)} mẫu")
+        return profile
+
+    def load_profile(self):
+        if os.path.exists(MonitorConfig.PROFILE_PATH):
+            with open(MonitorConfig.PROFILE_PATH, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+            # Model đổi (retrain) -> phân phối tham chiếu cũ không còn đúng
+            if profile.get("model") == self.model_id() and set(self.qt.features) <= set(profile["features"]):
+                return profile
+        return self.build_profile()
+
+    # --- State (cửa sổ trượt) ---
+    def _load_state(self, model):
+        if os.path.exists(MonitorConfig.STATE_PATH):
+            with open(MonitorConfig.STATE_PATH, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("model") == model:
+                return state
+        return {"model": model, "days": [], "pending": [], "ic": []}
+
+    def _save_state(self, state):
+        tmp = MonitorConfig.STATE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, MonitorConfig.STATE_PATH)
+
+    # --- Daily update ---
+    def update(self, snapshot=None, force=False):
+        """
+        Cập nhật giám sát cho phiên mới nhất. snapshot: DataFrame từ QuantToolkit._rank_table()
+        (có cột feature, 'Rank_Score', 'ticker', 'date'); None -> tự dựng.
+        """
+        if not self.qt.features:
+            return {"error": "Model chưa được huấn luyện."}
+        if snapshot is None:
+            snapshot, _ = self.qt._rank_table()
+        if snapshot is None or snapshot.empty:
+            return {"error": "Không đủ dữ liệu snapshot."}
+
+        profile = self.load_profile()
+        if profile is None:
+            return {"error": "Không dựng được profile tham chiếu (DB rỗng)."}
+
+        start = time.perf_counter()
+        model = profile["model"]
+        state = self._load_state(model)
+        as_of = pd.Timestamp(snapshot["date"].max()).strftime("%Y-%m-%d")
+
+        if force or not state["days"] or state["days"][-1]["date"] != as_of:
+            state["days"] = [d for d in state["days"] if d["date"] != as_of]
+            state["days"].append({
+                "date": as_of,
+                "values": {f: np.round(snapshot[f].to_numpy(dtype=np.float64), 6).tolist()
+                           for f in self.qt.features if f in snapshot.columns},
+            })
+            state["days"] = state["days"][-MonitorConfig.WINDOW_DAYS:]
+            state["pending"] = [p for p in state["pending"] if p["date"] != as_of]
+            state["pending"].append({"date": as_of, "scores": dict(zip(snapshot["ticker"],
+                                                                        snapshot["Rank_Score"].astype(float)))})
+
+        realized = self._mature_pending(state)
+        report = self._evaluate(profile, state, realized)
+        report.update(date=as_of, model=model)
+        self._save_state(state)
+        report["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        records = [{"date": pd.Timestamp(as_of).to_pydatetime(), "model": model, "metric": m,
+                    "feature": f, "value": None if v is None or not np.isfinite(v) else float(v)}
+                   for m, f, v in report.pop("_records")]
+        self.repo.save_quant_metrics(records)
+
+        flag = "🚨 CẦN RETRAIN" if report["retrain"] else "✅ Ổn định"
+        print(f"📡 [Monitor] {as_of}: {flag} | PSI max={report['max_psi']} | "
+              f"Rolling IC={report['rolling_ic']} ({report['elapsed_ms']} ms)")
+        return report
+
+    def _mature_pending(self, state):
+        """Chấm IC cho các phiên đã có đủ T+h phiên giá sau đó. Trả về lợi nhuận thực tế mới (cho target drift)."""
+        h = MonitorConfig.IC_HORIZON
+        if not state["pending"]:
+            return np.array([])
+
+        first = min(p["date"] for p in state["pending"])
+        panel = self.repo.get_price_panel(QuantConfig.TICKERS, days=0, start=first).get("close")
+        if panel is None or panel.empty:
+            return np.array([])
+
+        index = {d.strftime("%Y-%m-%d"): i for i, d in enumerate(panel.index)}
+        realized, keep = [], []
+        for item in state["pending"]:
+            i = index.get(item["date"])
+            if i is None or i + h >= len(panel):
+                keep.append(item)
+                continue
+            tickers = [t for t in item["scores"] if t in panel.columns]
+            fwd = (panel[tickers].iloc[i + h] / panel[tickers].iloc[i] - 1.0).to_numpy(dtype=np.float64)
+            scores = np.array([item["scores"][t] for t in tickers])
+            ic, _ = rank_ic(scores[None, :], fwd[None, :])
+            state["ic"].append({"date": item["date"], "ic": None if np.isnan(ic[0]) else float(ic[0])})
+            realized.append(fwd)
+        state["pending"] = keep[-(MonitorConfig.IC_WINDOW + h):]
+        state["ic"] = state["ic"][-MonitorConfig.IC_WINDOW:]
+        return np.concatenate(realized) if realized else np.array([])
+
+    def _evaluate(self, profile, state, realized):
+        records, drifted, dead, psi_by_feature = [], [], [], {}
+        n_days = len(state["days"])
+        zscored = {f"Z_{c}" for c in FEATURE_REGISTRY.zscore_features()}
+
+        for f in self.qt.features:
+            ref = profile["features"].get(f)
+            if ref is None:
+                continue
+            live = np.array([v for d in state["days"] for v in d["values"].get(f, [])], dtype=np.float64)
+            edges = np.asarray(ref["edges"])
+            p = psi(ref["counts"], bin_counts(live, edges))
+            k = ks_statistic(np.asarray(ref["quantiles"]), live)
+            psi_by_feature[f] = p
+            records += [("psi", f, p), ("ks", f, k)]
+
+            # Feature "chết" (VD cột khối ngoại bị fill 0): Z-Score cả snapshot hôm nay là hằng số
+            today = np.asarray(state["days"][-1]["values"].get(f, []), dtype=np.float64)
+            if f in zscored and len(today) > 1 and np.nanstd(today) < 1e-9 and ref["std"] > 1e-6:
+                dead.append(f)
+            if n_days >= MonitorConfig.MIN_WINDOW_DAYS and (
+                    (np.isfinite(p) and p > MonitorConfig.PSI_ALERT) or (np.isfinite(k) and k > MonitorConfig.KS_ALERT)):
+                drifted.append(f)
+
+        target_psi = None
+        if len(realized):
+            # Tích lũy histogram lợi nhuận thực tế trong state (cửa sổ theo số phiên IC)
+            ref = profile["features"]["__target__"]
+            counts = bin_counts(realized, np.asarray(ref["edges"]))
+            state.setdefault("target_counts", []).append(counts.tolist())
+            state["target_counts"] = state["target_counts"][-MonitorConfig.IC_WINDOW:]
+        if state.get("target_counts"):
+            target_psi = psi(profile["features"]["__target__"]["counts"], np.sum(state["target_counts"], axis=0))
+            records.append(("target_psi", None, target_psi))
+
+        ics = np.array([x["ic"] for x in state["ic"] if x["ic"] is not None], dtype=np.float64)
+        rolling_ic = float(ics.mean()) if len(ics) else None
+        if state["ic"] and state["ic"][-1]["ic"] is not None:
+            records.append(("daily_ic", None, state["ic"][-1]["ic"]))
+        if rolling_ic is not None:
+            records.append(("rolling_ic", None, rolling_ic))
+
+        reasons = []
+        if dead:
+            reasons.append(f"Feature hằng số trên snapshot: {dead}")
+        if len(drifted) >= MonitorConfig.MAX_DRIFTED:
+            reasons.append(f"{len(drifted)} feature lệch phân phối (PSI>{MonitorConfig.PSI_ALERT} hoặc KS>{MonitorConfig.KS_ALERT})")
+        if target_psi is not None and target_psi > MonitorConfig.PSI_ALERT:
+            reasons.append(f"Phân phối lợi nhuận T+{MonitorConfig.IC_HORIZON} lệch (PSI={target_psi:.3f})")
+        if len(ics) >= MonitorConfig.MIN_IC_DAYS and rolling_ic <= MonitorConfig.MIN_ROLLING_IC:
+            reasons.append(f"Rolling IC {rolling_ic:.4f} <= {MonitorConfig.MIN_ROLLING_IC} ({len(ics)} phiên)")
+
+        finite = [v for v in psi_by_feature.values() if np.isfinite(v)]
+        records += [("max_psi", None, max(finite) if finite else None),
+                    ("n_drifted", None, len(drifted)),
+                    ("retrain_flag", None, float(bool(reasons)))]
+        top = sorted(((v, f) for f, v in psi_by_feature.items() if np.isfinite(v)), reverse=True)[:5]
+        return {
+            "window_days": n_days,
+            "max_psi": round(max(finite), 4) if finite else None,
+            "top_psi": {f: round(v, 4) for v, f in top},
+            "warn": [f for f, v in psi_by_feature.items() if np.isfinite(v) and v > MonitorConfig.PSI_WARN],
+            "drifted": drifted,
+            "dead_features": dead,
+            "target_psi": None if target_psi is None else round(target_psi, 4),
+            "rolling_ic": None if rolling_ic is None else round(rolling_ic, 4),
+            "ic_days": int(len(ics)),
+            "retrain": bool(reasons),
+            "reasons": reasons,
+            "_records": records,
+        }
+
+
+if __name__ == "__main__":
+    print(json.dumps(DriftMonitor().update(), ensure_ascii=False, indent=2, default=str))
@@ -0,0 +1,274 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from tools.quant_tool import QuantConfig
+    from tools.quant_walkforward import WalkForwardConfig, make_walk_forward_splits
+    from tools.model_registry import ModelRegistry
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+    from tools.quant_walkforward import WalkForwardConfig, make_walk_forward_splits
+    from tools.model_registry import ModelRegistry
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class SearchConfig:
+    N_CONFIGS = 27              # Số cấu hình ở rung đầu tiên
+    ETA = 3                     # Mỗi rung giữ lại 1/ETA cấu hình, nhân ETA số vòng boosting
+    MIN_ROUNDS = 100
+    MAX_ROUNDS = QuantConfig.RANKER_PARAMS["n_estimators"]
+    N_FOLDS = 3                 # Số fold Walk-Forward gần nhất dùng để chấm điểm
+    MAX_WORKERS = WalkForwardConfig.MAX_WORKERS
+    THREADS_PER_TRIAL = WalkForwardConfig.THREADS_PER_FOLD
+    TIME_BUDGET = 3600          # giây
+    MAX_BIN = 256
+
+    # Không gian tìm kiếm: (kiểu, tham số)
+    SPACE = {
+        "booster": ("choice", ["gbtree", "dart"]),
+        "learning_rate": ("loguniform", 0.005, 0.2),
+        "max_depth": ("int", 3, 8),
+        "subsample": ("uniform", 0.5, 1.0),
+        "colsample_bytree": ("uniform", 0.3, 1.0),
+        "reg_lambda": ("loguniform", 0.1, 100.0),
+        "reg_alpha": ("loguniform", 0.01, 30.0),
+        "min_child_weight": ("loguniform", 1.0, 50.0),
+    }
+
+def sample_config(rng, space=SearchConfig.SPACE):
+    cfg = {}
+    for name, spec in space.items():
+        kind = spec[0]
+        if kind == "choice":
+            cfg[name] = spec[1][rng.integers(len(spec[1]))]
+        elif kind == "int":
+            cfg[name] = int(rng.integers(spec[1], spec[2] + 1))
+        elif kind == "uniform":
+            cfg[name] = float(rng.uniform(spec[1], spec[2]))
+        elif kind == "loguniform":
+            cfg[name] = float(np.exp(rng.uniform(np.log(spec[1]), np.log(spec[2]))))
+    return cfg
+
+def to_native_params(params, threads, max_bin=SearchConfig.MAX_BIN):
+    """Đổi tham số kiểu sklearn (XGBRanker) sang xgb.train; trả về (params, num_boost_round)."""
+    native = {k: v for k, v in params.items() if k not in ("n_estimators", "n_jobs", "random_state")}
+    native.update(
+        tree_method="hist", max_bin=max_bin, nthread=threads,
+        seed=params.get("random_state", 42),
+        eval_metric=WalkForwardConfig.EVAL_METRIC,
+    )
+    return native, int(params.get("n_estimators", 100))
+
+# =============================================================================
+# 2. WORKER: cache QuantileDMatrix theo fold trong mỗi process
+# =============================================================================
+
+_SHARED = {}
+_DMATRIX_CACHE = {}
+
+def _init_worker(matrix, folds):
+    # Số thread mỗi trial do nthread của params giới hạn (xem to_native_params)
+    _SHARED.update(X=matrix.X, y=matrix.y, qid=matrix.qid, day_index=matrix.qid, folds=folds)
+
+def _get_dmatrices(fold_id, max_bin):
+    """
+    Dựng QuantileDMatrix (đã lượng tử hóa theo histogram) MỘT lần cho mỗi (fold, max_bin);
+    mọi trial sau trong cùng process dùng lại, không phải build lại.
+    """
+    import xgboost as xgb
+
+    key = (fold_id, max_bin)
+    if key not in _DMATRIX_CACHE:
+        X, y, qid, day_index = _SHARED["X"], _SHARED["y"], _SHARED["qid"], _SHARED["day_index"]
+        fold = _SHARED["folds"][fold_id]
+        t0, t1 = fold["train"]
+        v0, v1 = fold["valid"]
+        tr = slice(*np.searchsorted(day_index, [t0, t1]))
+        va = slice(*np.searchsorted(day_index, [v0, v1]))
+        dtrain = xgb.QuantileDMatrix(X[tr], y[tr], qid=qid[tr], max_bin=max_bin)
+        dvalid = xgb.QuantileDMatrix(X[va], y[va], qid=qid[va], ref=dtrain)
+        _DMATRIX_CACHE[key] = (dtrain, dvalid)
+    return _DMATRIX_CACHE[key]
+
+def _run_trial(trial_id, params, fold_ids, threads, max_bin, early_stopping_rounds):
+    import xgboost as xgb
+
+    native, rounds = to_native_params(params, threads, max_bin)
+    scores, best_iters = [], []
+    start = time.time()
+    for fold_id in fold_ids:
+        dtrain, dvalid = _get_dmatrices(fold_id, max_bin)
+        history = {}
+        booster = xgb.train(
+            native, dtrain, num_boost_round=rounds,
+            evals=[(dvalid, "valid")], evals_result=history,
+            early_stopping_rounds=early_stopping_rounds, verbose_eval=False
+        )
+        curve = history["valid"][WalkForwardConfig.EVAL_METRIC]
+        best = getattr(booster, "best_iteration", len(curve) - 1)
+        scores.append(float(curve[best]))
+        best_iters.append(int(best))
+
+    return {
+        "trial": trial_id,
+        "params": params,
+        "score": float(np.mean(scores)),
+        "fold_scores": scores,
+        "best_iterations": best_iters,
+        "train_seconds": round(time.time() - start, 2),
+    }
+
+# =============================================================================
+# 3. SUCCESSIVE HALVING
+# =============================================================================
+
+class HyperparameterSearch:
+    def __init__(self, base_params=None, n_configs=SearchConfig.N_CONFIGS, eta=SearchConfig.ETA,
+                 min_rounds=SearchConfig.MIN_ROUNDS, max_rounds=SearchConfig.MAX_ROUNDS,
+                 n_folds=SearchConfig.N_FOLDS, max_workers=SearchConfig.MAX_WORKERS,
+                 threads_per_trial=SearchConfig.THREADS_PER_TRIAL, time_budget=SearchConfig.TIME_BUDGET,
+                 space=None, seed=42, registry=None):
+        self.base_params = dict(base_params or QuantConfig.RANKER_PARAMS)
+        self.n_configs = n_configs
+        self.eta = eta
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.n_folds = n_folds
+        self.max_workers = max_workers
+        self.threads = threads_per_trial
+        self.time_budget = time_budget
+        self.space = space or SearchConfig.SPACE
+        self.rng = np.random.default_rng(seed)
+        self.registry = registry or ModelRegistry()
+
+    def run(self, matrix):
+        """matrix: TrainingMatrix (tools/quant_dataset.py)."""
+        dates = matrix.unique_dates
+        folds = make_walk_forward_splits(dates)[-self.n_folds:]
+        if not folds:
+            print("❌ [Search] Không đủ lịch sử để chia fold.")
+            return {}
+        for i, f in enumerate(folds):
+            f["fold"] = i
+
+        shared = (matrix, folds)
+
+        deadline = time.time() + self.time_budget
+        configs = [dict(self.base_params, **sample_config(self.rng, self.space)) for _ in range(self.n_configs)]
+        fold_ids = [f["fold"] for f in folds]
+        leaderboard, rounds, rung = [], self.min_rounds, 0
+
+        print(f"🔎 [Search] Successive Halving: {len(configs)} cấu hình, {len(folds)} fold, "
+              f"ngân sách {self.time_budget}s...")
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                 initargs=shared) as pool:
+            while configs and time.time() < deadline:
+                trials = [dict(c, n_estimators=rounds) for c in configs]
+                results = self._run_rung(pool, trials, fold_ids, deadline, rung)
+                for r in results:
+                    r["rung"] = rung
+                leaderboard.extend(results)
+                if not results:
+                    break
+
+                results.sort(key=lambda r: r["score"], reverse=True)
+                best = results[0]
+                print(f"   Rung {rung}: {len(results)} trial x {rounds} vòng -> best NDCG={best['score']:.4f}")
+
+                keep = max(1, len(results) // self.eta)
+                if len(results) == 1 or rounds >= self.max_rounds:
+                    break
+                configs = [{k: v for k, v in r["params"].items() if k != "n_estimators"} for r in results[:keep]]
+                rounds = min(self.max_rounds, rounds * self.eta)
+                rung += 1
+
+            if not leaderboard:
+                print("⚠️ [Search] Hết ngân sách trước khi hoàn thành trial nào.")
+                return {}
+
+            # Trial tốt nhất ở rung cao nhất (nhiều vòng nhất)
+            top_rung = max(r["rung"] for r in leaderboard)
+            best = max((r for r in leaderboard if r["rung"] == top_rung), key=lambda r: r["score"])
+            if time.time() < deadline:
+                comparison = self._compare_boosters(pool, best, fold_ids)
+            else:
+                comparison = {"skipped": "Hết ngân sách thời gian"}
+
+        for r in leaderboard:
+            self.registry.log_run("hparam_trial", r["params"],
+                                  {"ndcg": r["score"], "train_seconds": r["train_seconds"]},
+                                  tags={"rung": r["rung"], "trial": r["trial"]})
+        run_id = self.registry.log_run(
+            "hparam_search", best["params"],
+            {"ndcg": best["score"], "n_trials": len(leaderboard)},
+            tags={"booster_comparison": comparison}
+        )
+        print(f"✅ [Search] Best NDCG={best['score']:.4f} (registry run {run_id})")
+        return {"best": best, "leaderboard": leaderboard, "booster_comparison": comparison, "run_id": run_id}
+
+    def _run_rung(self, pool, trials, fold_ids, deadline, rung):
+        futures = {
+            pool.submit(_run_trial, f"{rung}-{i}", p, fold_ids, self.threads,
+                        SearchConfig.MAX_BIN, WalkForwardConfig.EARLY_STOPPING_ROUNDS): i
+            for i, p in enumerate(trials)
+        }
+        results = []
+        while futures:
+            done, _ = wait(futures, timeout=max(0.0, deadline - time.time()), return_when=FIRST_COMPLETED)
+            for fut in done:
+                futures.pop(fut)
+                try:
+                    results.append(fut.result())
+                except Exception as e:
+                    print(f"⚠️ [Search] Trial lỗi: {e}")
+            if time.time() >= deadline:
+                # Hết giờ: hủy trial chưa chạy, chờ trial đang chạy dở
+                for fut in list(futures):
+                    if fut.cancel():
+                        futures.pop(fut)
+                for fut in wait(futures).done:
+                    futures.pop(fut)
+                    try:
+                        results.append(fut.result())
+                    except Exception as e:
+                        print(f"⚠️ [Search] Trial lỗi: {e}")
+        return results
+
+    def _compare_boosters(self, pool, best, fold_ids):
+        """So sánh thời gian train/điểm của cấu hình tốt nhất giữa DART và gbtree + hist."""
+        variants = {
+            "dart+hist": dict(best["params"], booster="dart"),
+            "gbtree+hist": dict(best["params"], booster="gbtree"),
+        }
+        futures = {
+            name: pool.submit(_run_trial, name, p, fold_ids, self.threads,
+                              SearchConfig.MAX_BIN, WalkForwardConfig.EARLY_STOPPING_ROUNDS)
+            for name, p in variants.items()
+        }
+        comparison = {}
+        for name, fut in futures.items():
+            try:
+                r = fut.result()
+                comparison[name] = {"ndcg": round(r["score"], 5), "train_seconds": r["train_seconds"]}
+            except Exception as e:
+                comparison[name] = {"error": str(e)}
+        for name, c in comparison.items():
+            print(f"   ⚖️ {name}: {c}")
+        return comparison
+
+
+if __name__ == "__main__":
+    from tools.quant_tool import QuantToolkit
+
+    matrix = QuantToolkit().load_training_matrix()
+    if matrix is None:
+        print("❌ DB rỗng. Hãy chạy crawler trước.")
+    else:
+        HyperparameterSearch().run(matrix)
@@ -16,11 +16,17 @@ warnings.filterwarnings('ignore')
 #   tools/quant_tool.py
 try:
     from database.repo import DataRepository
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.quant_groups import GroupConfig, grouped_zscore, industry_map, uses_industry, uses_regime
+    from tools import indicators
 except ImportError:
     # Fallback cho trường hợp chạy trực tiếp module
     import sys
     sys.path.append(os.getcwd())
     from database.repo import DataRepository
+    from tools.feature_registry import FEATURE_REGISTRY
+    from tools.quant_groups import GroupConfig, grouped_zscore, industry_map, uses_industry, uses_regime
+    from tools import indicators
 
 # =============================================================================
 # 1. CONFIGURATION
@@ -34,6 +40,34 @@ class QuantConfig:
     if not os.path.exists(MODEL_DIR):
         os.makedirs(MODEL_DIR)
 
+    # Horizon của target (T+3) và bộ tham số mặc định của Ranker
+    TARGET_HORIZON = 3
+    # Các kỳ hạn lợi nhuận tương lai lưu trong dataset (Fwd_Ret_h) cho ranker đa kỳ hạn
+    HORIZONS = (1, 3, 10, 20)
+    RANKER_PARAMS = dict(
+        booster='dart', objective='rank:ndcg',
+        n_estimators=2000, learning_rate=0.011,
+        max_depth=4, subsample=0.6, colsample_bytree=0.5,
+        reg_lambda=50, reg_alpha=10,
+        tree_method="hist", n_jobs=-1, random_state=42
+    )
+
+    # Module khai báo thêm feature qua FEATURE_REGISTRY.register (alpha factor mới)
+    # tools.foreign_flow: dòng tiền khối ngoại tích lũy 20/60 phiên, chuỗi mua/bán ròng, Z-Score
+    FEATURE_PLUGINS = ["tools.foreign_flow"]
+
+    # Backend suy luận: "xgboost" (tham chiếu) | "inplace" | "treelite" (xem tools/quant_inference.py)
+    INFERENCE_BACKEND = "inplace"
+
+    # Chuẩn hóa cross-sectional: "market" | "industry" | "regime" | "industry_regime" (tools/quant_groups.py)
+    # Cách chia nhóm lúc train được lưu kèm model (attribute booster / manifest ensemble); suy luận dùng theo model
+    ZSCORE_GROUPING = "market"
+    GROUPING_ATTR = "zscore_grouping"
+
+    # Ensemble đa kỳ hạn (tools/quant_ensemble.py): bật để xếp hạng bằng điểm blend của các ranker T+h
+    USE_ENSEMBLE = False
+    ENSEMBLE_PATH = os.path.join(MODEL_DIR, "ensemble.json")
+
     TICKERS = [
         "ACB", "BCM", "BID", "CTG", "DGC", "FPT", "GAS", "GVR", "HDB", "HPG",
         "LPB", "MBB", "MSN", "MWG", "PLX", "SAB", "SHB", "SSB", "SSI", "STB",
@@ -45,39 +79,114 @@ class QuantConfig:
 # =============================================================================
 
 class TechnicalAnalysis:
-    @staticmethod
-    def rsi(series, period=14):
-        delta = series.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(period).mean()
-        rs = gain / (loss.replace(0, 1e-9))
-        return 100 - (100 / (1 + rs))
+    """Giữ tên cũ cho code ngoài; công thức nằm ở tools/indicators.py (dùng chung với báo cáo kỹ thuật)."""
+    rsi = staticmethod(indicators.rsi)
+    macd = staticmethod(indicators.macd)
+    bollinger = staticmethod(indicators.bollinger)
+    mfi = staticmethod(indicators.mfi)
+    mfi_from_tp = staticmethod(indicators.mfi_from_tp)
 
-    @staticmethod
-    def macd(series, f=12, s=26, sig=9):
-        k = series.ewm(span=f, adjust=False).mean()
-        d = series.ewm(span=s, adjust=False).mean()
-        macd = k - d
-        signal = macd.ewm(span=sig, adjust=False).mean()
-        return macd, signal
+# --- KHAI BÁO FEATURE (DAG). Thêm alpha factor mới: đăng ký ở module riêng + QuantConfig.FEATURE_PLUGINS ---
 
-    @staticmethod
-    def bollinger(series, n=20, k=2):
-        sma = series.rolling(n).mean()
-        std = series.rolling(n).std()
-        return sma + k*std, sma, sma - k*std
+@FEATURE_REGISTRY.register("Log_Ret", inputs=("close",), lookback=1, normalize=None)
+def _f_log_ret(d):
+    return np.log(d['close'] / d['close'].shift(1).replace(0, np.nan)).fillna(0)
+
+@FEATURE_REGISTRY.register("Vol_10", inputs=("Log_Ret",), lookback=10, normalize=None)
+def _f_vol_10(d):
+    return d['Log_Ret'].rolling(10).std()
+
+@FEATURE_REGISTRY.register("_Typical_Price", inputs=("high", "low", "close"))
+def _f_typical_price(d):
+    return (d['high'] + d['low'] + d['close']) / 3
+
+@FEATURE_REGISTRY.register("_MACD", inputs=("close",), lookback=35)
+def _f_macd(d):
+    return TechnicalAnalysis.macd(d['close'])
+
+@FEATURE_REGISTRY.register("_BB", inputs=("close",), lookback=20)
+def _f_bb(d):
+    return TechnicalAnalysis.bollinger(d['close'])
+
+@FEATURE_REGISTRY.register("RSI", inputs=("close",), lookback=15)
+def _f_rsi(d):
+    return TechnicalAnalysis.rsi(d['close'], 14)
+
+@FEATURE_REGISTRY.register("MACD_Div", inputs=("_MACD",))
+def _f_macd_div(d):
+    macd, sig = d['_MACD']
+    return macd - sig
+
+@FEATURE_REGISTRY.register("BB_Pb", inputs=("close", "_BB"))
+def _f_bb_pb(d):
+    u, m, l = d['_BB']
+    return (d['close'] - l) / (u - l + 1e-9)
+
+@FEATURE_REGISTRY.register("BB_Width", inputs=("_BB",))
+def _f_bb_width(d):
+    u, m, l = d['_BB']
+    return (u - l) / (m + 1e-9)
+
+@FEATURE_REGISTRY.register("Vol_Ratio", inputs=("volume",), lookback=20)
+def _f_vol_ratio(d):
+    return d['volume'] / (d['volume'].rolling(20).mean() + 1)
+
+@FEATURE_REGISTRY.register("MFI", inputs=("_Typical_Price", "volume"), lookback=15)
+def _f_mfi(d):
+    return TechnicalAnalysis.mfi_from_tp(d['_Typical_Price'], d['volume'])
+
+@FEATURE_REGISTRY.register("RSI_MFI_Div", inputs=("RSI", "MFI"))
+def _f_rsi_mfi_div(d):
+    return d['RSI'] - d['MFI']
+
+@FEATURE_REGISTRY.register("Panic_Score", inputs=("Vol_10", "Vol_Ratio"))
+def _f_panic_score(d):
+    return d['Vol_10'] * d['Vol_Ratio']
+
+def _register_lag_return(lag):
+    @FEATURE_REGISTRY.register(f"Ret_{lag}d", inputs=("close",), lookback=lag)
+    def _f_ret(d):
+        return d['close'].pct_change(lag)
+
+for _lag in [1, 3, 5, 10]:
+    _register_lag_return(_lag)
+
+# --- FOREIGN FLOW (DÒNG TIỀN KHỐI NGOẠI) ---
+@FEATURE_REGISTRY.register("Foreign_Net_Ratio", inputs=("buy_foreign", "sell_foreign", "volume"))
+def _f_foreign_net_ratio(d):
+    # Net Buy Ratio: (Mua - Bán) / Tổng Vol. Fallback 0 nếu thiếu cột
+    if not (d.has('buy_foreign') and d.has('sell_foreign')):
+        return 0
+    return (d['buy_foreign'] - d['sell_foreign']) / (d['volume'] + 1e-9)
+
+@FEATURE_REGISTRY.register("Foreign_Flow_5d", inputs=("Foreign_Net_Ratio",), lookback=5)
+def _f_foreign_flow_5d(d):
+    # Cumulative Flow (Dòng tiền tích lũy 5 ngày)
+    if not (d.has('buy_foreign') and d.has('sell_foreign')):
+        return 0
+    return d['Foreign_Net_Ratio'].rolling(5).mean()
+
+# --- MARKET REGIME (cờ 0/1, không Z-Score) ---
+@FEATURE_REGISTRY.register("Trend_Regime", inputs=("close",), lookback=50, normalize="raw")
+def _f_trend_regime(d):
+    return (d['close'] > d['close'].rolling(50).mean()).astype(int)
 
-    @staticmethod
-    def mfi(high, low, close, vol, n=14):
-        tp = (high + low + close) / 3
-        mf = tp * vol
-        pos = (mf.where(tp > tp.shift(), 0)).rolling(n).sum()
-        neg = (mf.where(tp < tp.shift(), 0)).rolling(n).sum()
-        return 100 - (100 / (1 + pos/(neg.replace(0, 1e-9))))
 
 class FeatureEngineer:
     @staticmethod
-    def create_base_features(df):
+    def base_names(model_features):
+        """['Z_RSI', 'Z_MFI', ...] (danh sách feature của model) -> ['RSI', 'MFI', ...]"""
+        FEATURE_REGISTRY.load_plugins(QuantConfig.FEATURE_PLUGINS)
+        names = [f[2:] if f.startswith('Z_') else f for f in model_features]
+        return [n for n in names if n in FEATURE_REGISTRY]
+
+    @staticmethod
+    def create_base_features(df, features=None):
+        """
+        Tính feature theo registry. `features`: tên feature gốc cần (None = tất cả);
+        chỉ các feature này và phụ thuộc của chúng được tính.
+        """
+        FEATURE_REGISTRY.load_plugins(QuantConfig.FEATURE_PLUGINS)
         df = df.copy().sort_values('date')
         
         # --- CLEAN DATA ---
@@ -85,51 +194,7 @@ class FeatureEngineer:
         # Tránh chia cho 0
         df['volume'] = df['volume'].replace(0, 1) 
         
-        # 1. Base Price Indicators
-        # Log Return
-        df['Log_Ret'] = np.log(df['close'] / df['close'].shift(1).replace(0, np.nan))
-        df['Log_Ret'] = df['Log_Ret'].fillna(0)
-        
-        # Volatility
-        df['Vol_10'] = df['Log_Ret'].rolling(10).std()
-        
-        # RSI & MACD
-        df['RSI'] = TechnicalAnalysis.rsi(df['close'], 14)
-        macd, sig = TechnicalAnalysis.macd(df['close'])
-        df['MACD_Div'] = (macd - sig)
-        
-        # Bollinger %B
-        u, m, l = TechnicalAnalysis.bollinger(df['close'])
-        df['BB_Pb'] = (df['close'] - l) / (u - l + 1e-9)
-        df['BB_Width'] = (u - l) / (m + 1e-9)
-        
-        # Volume features
-        df['Vol_Ratio'] = df['volume'] / (df['volume'].rolling(20).mean() + 1)
-        df['MFI'] = TechnicalAnalysis.mfi(df['high'], df['low'], df['close'], df['volume'])
-        
-        # --- NEW: FOREIGN FLOW FEATURES (DÒNG TIỀN KHỐI NGOẠI) ---
-        # 1. Net Buy Ratio: (Mua - Bán) / Tổng Vol
-        if 'buy_foreign' in df.columns and 'sell_foreign' in df.columns:
-            net_foreign = df['buy_foreign'] - df['sell_foreign']
-            df['Foreign_Net_Ratio'] = net_foreign / (df['volume'] + 1e-9)
-            
-            # 2. Cumulative Flow (Dòng tiền tích lũy 5 ngày)
-            df['Foreign_Flow_5d'] = df['Foreign_Net_Ratio'].rolling(5).mean()
-        else:
-            # Fallback nếu thiếu cột
-            df['Foreign_Net_Ratio'] = 0
-            df['Foreign_Flow_5d'] = 0
-        
-        # 3. Market Regime
-        df['Trend_Regime'] = (df['close'] > df['close'].rolling(50).mean()).astype(int)
-        
-        # 4. Interaction Features
-        df['RSI_MFI_Div'] = df['RSI'] - df['MFI']
-        df['Panic_Score'] = df['Vol_10'] * df['Vol_Ratio']
-        
-        # 5. Lag Returns
-        for lag in [1, 3, 5, 10]:
-            df[f'Ret_{lag}d'] = df['close'].pct_change(lag)
+        df = FEATURE_REGISTRY.compute(df, features)
             
         # Clean Final NaN
         df = df.replace([np.inf, -np.inf], np.nan).dropna()
@@ -137,65 +202,153 @@ class FeatureEngineer:
         return df
 
     @staticmethod
-    def apply_cross_sectional_zscore(df_snapshot):
-        # Cập nhật danh sách các cột cần tính Z-Score (bao gồm Foreign)
-        cols_to_norm = [
-            'RSI', 'MACD_Div', 'BB_Pb', 'BB_Width', 'Vol_Ratio', 'MFI',
-            'RSI_MFI_Div', 'Panic_Score', 
-            'Ret_1d', 'Ret_3d', 'Ret_5d', 'Ret_10d',
-            'Foreign_Net_Ratio', 'Foreign_Flow_5d' 
-        ]
-        
+    def apply_cross_sectional_zscore(df_snapshot, features=None, grouping=None, industries=None, date_col=None):
+        """
+        Z-Score cross-sectional, chia nhóm theo `grouping` (mặc định QuantConfig.ZSCORE_GROUPING).
+        industries: {ticker: ngành}. date_col=None: cả bảng là 1 lát cắt (snapshot); 'date': theo từng phiên.
+        """
+        # Danh sách cột cần Z-Score lấy từ registry (không hard-code)
         df_norm = df_snapshot.copy()
-        
-        for col in cols_to_norm:
-            if col not in df_norm.columns: continue
-            
-            # Tính Z-Score Cross-Sectional
-            mean_val = df_norm[col].mean()
-            std_val = df_norm[col].std() + 1e-9
-            
-            df_norm[f'Z_{col}'] = (df_norm[col] - mean_val) / std_val
-            df_norm[f'Z_{col}'] = df_norm[f'Z_{col}'].clip(-3, 3).fillna(0)
-            
-        df_norm['Z_Trend_Regime'] = df_norm['Trend_Regime']
+        cols = [c for c in FEATURE_REGISTRY.zscore_features(features) if c in df_norm.columns]
+
+        if cols:
+            z = grouped_zscore(df_norm, cols, grouping or QuantConfig.ZSCORE_GROUPING, industries, date_col)
+            z = np.nan_to_num(np.clip(z, -3, 3), nan=0.0)
+            z_cols = [f'Z_{c}' for c in cols]
+            df_norm = pd.concat([df_norm.drop(columns=z_cols, errors='ignore'),
+                                 pd.DataFrame(z, columns=z_cols, index=df_norm.index)], axis=1)
+
+        for col in FEATURE_REGISTRY.model_features(features):
+            if f'Z_{col}' not in df_norm.columns and col in df_norm.columns:
+                df_norm[f'Z_{col}'] = df_norm[col]
         
         return df_norm
+
+    @staticmethod
+    def build_training_frame(repo, days_history=3650):
+        """
+        Dựng bảng huấn luyện (date x ticker) đầy đủ: features, Raw_Target (T+h),
+        Target_Rank (quintile theo ngày) và các cột Z_ đã chuẩn hóa cross-sectional.
+        Trả về (train_df đã sort theo date, danh sách features). DataFrame rỗng nếu DB trống.
+        """
+        FEATURE_REGISTRY.load_plugins(QuantConfig.FEATURE_PLUGINS)
+        data_frames = []
+        for ticker in QuantConfig.TICKERS:
+            df = repo.get_price_history(ticker, days=days_history)
+            if not df.empty and len(df) > 100:
+                df['ticker'] = ticker
+                data_frames.append(df)
+        
+        if not data_frames:
+            return pd.DataFrame(), []
+
+        full_df = pd.concat(data_frames, ignore_index=True)
+        full_df['date'] = pd.to_datetime(full_df['date'])
+        
+        # 1. Feature Engineering
+        processed_dfs = []
+        for t in full_df['ticker'].unique():
+            sub = full_df[full_df['ticker'] == t]
+            processed_dfs.append(FeatureEngineer.create_base_features(sub))
+        
+        train_df = pd.concat(processed_dfs, ignore_index=True)
+
+        # 2. Create Target (+ lợi nhuận tương lai các kỳ hạn khác, NaN ở cuối chuỗi)
+        close_by_ticker = train_df.groupby('ticker')['close']
+        future_close = close_by_ticker.shift(-QuantConfig.TARGET_HORIZON)
+        train_df['Raw_Target'] = (future_close - train_df['close']) / train_df['close']
+        for h in QuantConfig.HORIZONS:
+            train_df[f'Fwd_Ret_{h}'] = close_by_ticker.shift(-h) / train_df['close'] - 1
+        train_df = train_df.replace([np.inf, -np.inf], np.nan)
+        train_df = train_df.dropna(subset=[c for c in train_df.columns if not c.startswith('Fwd_Ret_')])
+
+        # 3. Create Rank Target
+        def discretize(x):
+            try: return pd.qcut(x, 5, labels=False, duplicates='drop')
+            except: return np.zeros(len(x))
+            
+        train_df['Target_Rank'] = train_df.groupby('date')['Raw_Target'].transform(discretize)
+        train_df['Target_Rank'] = train_df['Target_Rank'].fillna(2).astype(int)
+
+        # 4. Z-Score Transformation theo phiên (danh sách cột lấy từ FEATURE_REGISTRY, nhóm theo ZSCORE_GROUPING)
+        industries = None
+        if uses_industry(QuantConfig.ZSCORE_GROUPING):
+            industries = industry_map(repo, QuantConfig.TICKERS)
+        train_df = FeatureEngineer.apply_cross_sectional_zscore(train_df, industries=industries, date_col='date')
+
+        train_df = train_df.sort_values('date', kind='stable').reset_index(drop=True)
+        features = [c for c in train_df.columns if c.startswith('Z_')]
+        return train_df, features
+
 # =============================================================================
 # 3. QUANT TOOLKIT
 # =============================================================================
 
 class QuantToolkit:
-    def __init__(self):
+    def __init__(self, backend=QuantConfig.INFERENCE_BACKEND):
         self.model = xgb.XGBRanker()
         self.features = []
+        self.grouping = None        # ZSCORE_GROUPING lúc train của model đang load (None = model cũ, không ghi)
+        self.backend_name = backend
+        self.backend = None
         self.repo = DataRepository()
         self._load_model()
 
     def _load_model(self):
+        if QuantConfig.USE_ENSEMBLE and os.path.exists(QuantConfig.ENSEMBLE_PATH):
+            try:
+                from tools.quant_ensemble import MultiHorizonRanker
+                self.backend = MultiHorizonRanker.load(QuantConfig.ENSEMBLE_PATH)
+                self.features = self.backend.features
+                self.grouping = self.backend.manifest.get(QuantConfig.GROUPING_ATTR)
+                return
+            except Exception as e:
+                print(f"⚠️ [Quant] Lỗi load ensemble, dùng model đơn: {e}")
         if os.path.exists(QuantConfig.MODEL_PATH):
             try:
                 self.model.load_model(QuantConfig.MODEL_PATH)
                 self.features = joblib.load(QuantConfig.FEATURE_PATH)
+                self.grouping = self.model.get_booster().attr(QuantConfig.GROUPING_ATTR)
+                from tools.quant_inference import make_backend
+                self.backend = make_backend(self.backend_name, self.model, self.features)
             except Exception as e:
                 print(f"⚠️ [Quant] Lỗi load model: {e}")
         else:
             print("⚠️ [Quant] Chưa có Model. Cần chạy train_model().")
 
-    def get_market_ranking(self):
+    def verify_inference(self):
+        """So sánh số học + tốc độ backend hiện tại với XGBRanker.predict (tham chiếu)."""
         if not self.features:
             return {"error": "Model chưa được huấn luyện."}
+        if self.backend.name == "ensemble":
+            return {"error": "Ensemble không có backend tham chiếu để so sánh."}
+        from tools.quant_inference import XGBoostBackend, verify_backend
+        return verify_backend(self.backend, XGBoostBackend(self.model, self.features), len(self.features))
 
+    def _build_snapshot(self):
+        """
+        Snapshot phiên gần nhất (1 dòng / mã) đã chuẩn hóa Z-Score cross-sectional.
+        Chỉ tính các feature mà model đang load thực sự dùng (rank_features.pkl).
+        """
+        needed = FeatureEngineer.base_names(self.features)
+        # Z-Score phải chia nhóm đúng như lúc train; config đổi mà chưa train lại -> cảnh báo, giữ theo model
+        grouping = self.grouping or QuantConfig.ZSCORE_GROUPING
+        if grouping != QuantConfig.ZSCORE_GROUPING:
+            print(f"⚠️ [Quant] Model train với ZSCORE_GROUPING='{grouping}' nhưng config là "
+                  f"'{QuantConfig.ZSCORE_GROUPING}' -> chuẩn hóa theo model (train lại để áp dụng config mới).")
+        if uses_regime(grouping) and GroupConfig.REGIME_COLUMN not in needed:
+            needed = needed + [GroupConfig.REGIME_COLUMN]
+        # Lấy đủ lịch sử cho feature có lookback dài nhất (tối thiểu 100 phiên như cũ)
+        days = max(100, 2 * FEATURE_REGISTRY.required_history(needed))
         snapshot = []
         
         for ticker in QuantConfig.TICKERS:
-            # Lấy 100 ngày gần nhất để tính chỉ báo
-            df = self.repo.get_price_history(ticker, days=100)
+            df = self.repo.get_price_history(ticker, days=days)
             
             if df.empty or len(df) < 60: continue
             
             df['date'] = pd.to_datetime(df['date'])
-            df_feat = FeatureEngineer.create_base_features(df)
+            df_feat = FeatureEngineer.create_base_features(df, needed)
             
             if not df_feat.empty:
                 latest = df_feat.iloc[-1:].copy()
@@ -203,29 +356,164 @@ class QuantToolkit:
                 snapshot.append(latest)
 
         if not snapshot:
-            return {"error": "Không đủ dữ liệu."}
+            return pd.DataFrame()
 
         df_now = pd.concat(snapshot, ignore_index=True)
-        df_now = FeatureEngineer.apply_cross_sectional_zscore(df_now)
+        industries = industry_map(self.repo, QuantConfig.TICKERS) if uses_industry(grouping) else None
+        df_now = FeatureEngineer.apply_cross_sectional_zscore(df_now, needed, grouping, industries)
         
-        try:
-            # Đảm bảo đủ feature
-            missing_cols = set(self.features) - set(df_now.columns)
-            if missing_cols:
-                # Fill missing cols với 0 để không crash
-                for c in missing_cols: df_now[c] = 0
-            
-            X = df_now[self.features]
-            scores = self.model.predict(X)
-            df_now['Rank_Score'] = scores
-        except Exception as e:
-            return {"error": f"Lỗi dự báo: {str(e)}"}
+        # Đảm bảo đủ feature (fill 0 cho cột thiếu để không crash)
+        for c in set(self.features) - set(df_now.columns):
+            df_now[c] = 0
+        return df_now
+
+    def _rank_table(self, with_contributions=False):
+        """
+        Chấm điểm toàn bộ universe trong MỘT lần predict.
+        Trả về (DataFrame đã sort theo Rank_Score, ma trận đóng góp SHAP hoặc None).
+        """
+        df_now = self._build_snapshot()
+        if df_now.empty:
+            return df_now, None
+
+        X = df_now[self.features]
+        df_now['Rank_Score'] = self.backend.predict(np.ascontiguousarray(X.values, dtype=np.float32))
 
-        df_sorted = df_now.sort_values('Rank_Score', ascending=False)
+        contribs = None
+        if with_contributions:
+            # pred_contribs = TreeSHAP: mỗi dòng gồm đóng góp từng feature + bias (cột cuối)
+            if hasattr(self.backend, "contributions"):
+                contribs = self.backend.contributions(X.values)
+            else:
+                dmat = xgb.DMatrix(X)
+                contribs = self.model.get_booster().predict(dmat, pred_contribs=True).astype(float)
+
+        order = np.argsort(-df_now['Rank_Score'].values, kind='stable')
+        df_sorted = df_now.iloc[order].reset_index(drop=True)
+        if contribs is not None:
+            contribs = contribs[order]
+
+        n = len(df_sorted)
         min_s, max_s = df_sorted['Rank_Score'].min(), df_sorted['Rank_Score'].max()
         # Tránh chia cho 0 nếu min == max
         div = (max_s - min_s) if (max_s - min_s) > 1e-9 else 1.0
         df_sorted['Confidence'] = (df_sorted['Rank_Score'] - min_s) / div * 100
+        df_sorted['Rank'] = np.arange(1, n + 1)
+        df_sorted['Percentile'] = (n - df_sorted['Rank']) / max(n - 1, 1) * 100
+        return df_sorted, contribs
+
+    @staticmethod
+    def _rank_label(rank, n, top_k=5):
+        if rank <= top_k: return "STRONG BUY"
+        if rank > n - top_k: return "AVOID / SELL"
+        return "NEUTRAL"
+
+    def get_full_ranking(self, with_contributions=True):
+        """
+        Bảng xếp hạng TOÀN BỘ universe dạng cột (columnar): mỗi key là một list cùng độ dài,
+        đã sort theo Rank_Score giảm dần. Gồm score, percentile, Z-features và đóng góp SHAP.
+        """
+        if not self.features:
+            return {"error": "Model chưa được huấn luyện."}
+
+        try:
+            df_sorted, contribs = self._rank_table(with_contributions=with_contributions)
+        except Exception as e:
+            return {"error": f"Lỗi dự báo: {str(e)}"}
+
+        if df_sorted.empty:
+            return {"error": "Không đủ dữ liệu."}
+
+        result = {
+            "status": "success",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "as_of": df_sorted['date'].max().strftime("%Y-%m-%d"),
+            "n": len(df_sorted),
+            "features": list(self.features),
+            "columns": {
+                "ticker": df_sorted['ticker'].tolist(),
+                "rank": df_sorted['Rank'].astype(int).tolist(),
+                "score": np.round(df_sorted['Rank_Score'].values.astype(float), 4).tolist(),
+                "percentile": np.round(df_sorted['Percentile'].values.astype(float), 1).tolist(),
+                "confidence": np.round(df_sorted['Confidence'].values.astype(float), 1).tolist(),
+                "price": df_sorted['close'].tolist(),
+            },
+            "zscores": {
+                f: np.round(df_sorted[f].astype(float).values, 3).tolist() for f in self.features
+            },
+        }
+        if contribs is not None:
+            result["contributions"] = {
+                f: np.round(contribs[:, i], 4).tolist() for i, f in enumerate(self.features)
+            }
+            result["contributions"]["bias"] = np.round(contribs[:, -1], 4).tolist()
+        return result
+
+    def get_ticker_ranks(self, tickers, ranking=None, top_contrib=3):
+        """
+        Tra cứu thứ hạng cho NHIỀU mã từ một lần tính duy nhất.
+        `ranking`: kết quả get_full_ranking() có sẵn (nếu muốn tái sử dụng).
+        """
+        ranking = ranking or self.get_full_ranking()
+        if "error" in ranking:
+            return ranking
+
+        cols = ranking["columns"]
+        n = ranking["n"]
+        index = {t: i for i, t in enumerate(cols["ticker"])}
+        contribs = ranking.get("contributions", {})
+
+        out = {}
+        for t in tickers:
+            t = t.upper().strip()
+            i = index.get(t)
+            if i is None:
+                out[t] = {"error": "Không có trong universe hoặc thiếu dữ liệu."}
+                continue
+
+            drivers = sorted(
+                ((f, contribs[f][i]) for f in ranking["features"] if f in contribs),
+                key=lambda kv: abs(kv[1]), reverse=True
+            )[:top_contrib]
+
+            out[t] = {
+                "rank": cols["rank"][i],
+                "of": n,
+                "label": self._rank_label(cols["rank"][i], n),
+                "score": cols["score"][i],
+                "percentile": cols["percentile"][i],
+                "confidence": cols["confidence"][i],
+                "price": cols["price"][i],
+                "drivers": [{"feature": f, "contribution": c} for f, c in drivers],
+            }
+        return out
+
+    @staticmethod
+    def render_rank_report(ticker, info):
+        """Định dạng kết quả get_ticker_ranks() cho 1 mã thành Markdown cho Agent."""
+        if "error" in info:
+            return f"❌ Lỗi Quant ({ticker}): {info['error']}"
+
+        drivers = ", ".join(f"{d['feature']} ({d['contribution']:+.3f})" for d in info["drivers"])
+        return f"""
+        ### 🤖 DỰ BÁO ĐỊNH LƯỢNG
+        - **Mã:** {ticker}
+        - **Xếp hạng:** {info['label']} (#{info['rank']}/{info['of']}, Percentile {info['percentile']:.1f})
+        - **Điểm:** {info['confidence']:.1f}
+        - **Yếu tố chính:** {drivers or 'N/A'}
+        """
+
+    def get_market_ranking(self):
+        if not self.features:
+            return {"error": "Model chưa được huấn luyện."}
+
+        try:
+            df_sorted, _ = self._rank_table()
+        except Exception as e:
+            return {"error": f"Lỗi dự báo: {str(e)}"}
+
+        if df_sorted.empty:
+            return {"error": "Không đủ dữ liệu."}
 
         top5 = df_sorted.head(5)
         bot5 = df_sorted.tail(5)
@@ -251,83 +539,78 @@ class QuantToolkit:
             ]
         }
 
+    def build_training_frame(self, days_history=3650):
+        return FeatureEngineer.build_training_frame(self.repo, days_history)
+
+    def load_training_matrix(self, days_history=3650, force=False):
+        """
+        Ma trận huấn luyện đã cache nhị phân (memmap) theo phiên bản dữ liệu + feature.
+        Chỉ đổi hyperparameter -> dùng lại cache, bỏ qua toàn bộ tiền xử lý.
+        """
+        from tools.quant_dataset import DatasetCache
+
+        return DatasetCache(self.repo).load_or_build(days_history, force=force)
+
     def train_model(self, days_history=3650):
-            print(f"🧠 [Quant] Bắt đầu Train Model với dữ liệu {days_history} ngày...")
-            
-            data_frames = []
-            for ticker in QuantConfig.TICKERS:
-                df = self.repo.get_price_history(ticker, days=days_history)
-                if not df.empty and len(df) > 100:
-                    df['ticker'] = ticker
-                    data_frames.append(df)
-            
-            if not data_frames:
-                print("❌ DB rỗng. Hãy chạy crawler trước.")
-                return
+        print(f"🧠 [Quant] Bắt đầu Train Model với dữ liệu {days_history} ngày...")
 
-            full_df = pd.concat(data_frames, ignore_index=True)
-            full_df['date'] = pd.to_datetime(full_df['date'])
-            
-            # 1. Feature Engineering
-            processed_dfs = []
-            for t in full_df['ticker'].unique():
-                sub = full_df[full_df['ticker'] == t]
-                processed_dfs.append(FeatureEngineer.create_base_features(sub))
-            
-            train_df = pd.concat(processed_dfs, ignore_index=True)
-
-            # 2. Create Target
-            future_close = train_df.groupby('ticker')['close'].shift(-3)
-            train_df['Raw_Target'] = (future_close - train_df['close']) / train_df['close']
-            train_df = train_df.replace([np.inf, -np.inf], np.nan).dropna()
-
-            # 3. Create Rank Target
-            def discretize(x):
-                try: return pd.qcut(x, 5, labels=False, duplicates='drop')
-                except: return np.zeros(len(x))
-                
-            train_df['Target_Rank'] = train_df.groupby('date')['Raw_Target'].transform(discretize)
-            train_df['Target_Rank'] = train_df['Target_Rank'].fillna(2).astype(int)
-
-            # 4. Z-Score Transformation (CẬP NHẬT LIST CỘT MỚI TẠI ĐÂY)
-            cols_to_norm = [
-                'RSI', 'MACD_Div', 'BB_Pb', 'BB_Width', 'Vol_Ratio', 'MFI',
-                'RSI_MFI_Div', 'Panic_Score', 
-                'Ret_1d', 'Ret_3d', 'Ret_5d', 'Ret_10d',
-                'Foreign_Net_Ratio', 'Foreign_Flow_5d' 
-            ]
-            
-            def to_zscore(x): return (x - x.mean()) / (x.std() + 1e-9)
+        matrix = self.load_training_matrix(days_history)
+        if matrix is None:
+            print("❌ DB rỗng. Hãy chạy crawler trước.")
+            return
 
-            for col in cols_to_norm:
-                train_df[f'Z_{col}'] = train_df.groupby('date')[col].transform(to_zscore)
-                train_df[f'Z_{col}'] = train_df[f'Z_{col}'].clip(-3, 3).fillna(0)
-            
-            train_df['Z_Trend_Regime'] = train_df['Trend_Regime']
+        # 5. Train XGBoost
+        features = matrix.features
+        X = pd.DataFrame(matrix.X, columns=features)
+        
+        model = xgb.XGBRanker(**QuantConfig.RANKER_PARAMS)
+        
+        print(f"🚀 Fitting DART Model trên {len(X)} mẫu...")
+        model.fit(X, matrix.y, qid=matrix.qid)
+        
+        model.get_booster().set_attr(**{QuantConfig.GROUPING_ATTR: matrix.grouping})
+        model.save_model(QuantConfig.MODEL_PATH)
+        joblib.dump(features, QuantConfig.FEATURE_PATH)
+        print(f"✅ Model đã lưu tại: {QuantConfig.MODEL_PATH}")
+        self._load_model()
 
-            # 5. Train XGBoost
-            train_df = train_df.sort_values('date').reset_index(drop=True)
-            features = [c for c in train_df.columns if c.startswith('Z_')]
-            
-            X = train_df[features]
-            y = train_df['Target_Rank']
-            qid = train_df.groupby('date').ngroup().values
-            
-            model = xgb.XGBRanker(
-                booster='dart', objective='rank:ndcg',
-                n_estimators=2000, learning_rate=0.011,
-                max_depth=4, subsample=0.6, colsample_bytree=0.5,
-                reg_lambda=50, reg_alpha=10,
-                tree_method="hist", n_jobs=-1, random_state=42
-            )
-            
-            print(f"🚀 Fitting DART Model trên {len(X)} mẫu...")
-            model.fit(X, y, qid=qid)
-            
-            model.save_model(QuantConfig.MODEL_PATH)
-            joblib.dump(features, QuantConfig.FEATURE_PATH)
-            print(f"✅ Model đã lưu tại: {QuantConfig.MODEL_PATH}")
+    def train_walk_forward(self, days_history=3650, **kwargs):
+        """
+        Huấn luyện Walk-Forward (nhiều fold song song, có purge/embargo và early stopping).
+        Metric các fold chỉ để báo cáo; model production được refit trên toàn lịch sử
+        (số cây = trung vị best_iteration) và lưu vào MODEL_PATH. Trả về report (metrics từng fold + quy tắc chọn).
+        """
+        from tools.quant_walkforward import WalkForwardTrainer
+
+        print(f"🧠 [Quant] Walk-Forward Training với dữ liệu {days_history} ngày...")
+        matrix = self.load_training_matrix(days_history)
+        if matrix is None:
+            print("❌ DB rỗng. Hãy chạy crawler trước.")
+            return {"folds": [], "selected": None}
+
+        trainer = WalkForwardTrainer(**kwargs)
+        report = trainer.run(matrix)
+        if report.get("selected") is not None:
+            self._load_model()
+        return report
+
+    def train_ensemble(self, days_history=3650, **kwargs):
+        """
+        Huấn luyện ranker cho từng kỳ hạn (QuantConfig.HORIZONS) trên cùng ma trận feature,
+        blend theo IC validation. Bật QuantConfig.USE_ENSEMBLE để dùng khi xếp hạng.
+        """
+        from tools.quant_ensemble import EnsembleTrainer
+
+        print(f"🧠 [Quant] Ensemble đa kỳ hạn với dữ liệu {days_history} ngày...")
+        matrix = self.load_training_matrix(days_history)
+        if matrix is None:
+            print("❌ DB rỗng. Hãy chạy crawler trước.")
+            return {"error": "DB rỗng."}
+
+        manifest = EnsembleTrainer(**kwargs).run(matrix)
+        if "error" not in manifest:
             self._load_model()
+        return manifest
 
 if __name__ == "__main__":
     tool = QuantToolkit()
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from tools.quant_tool import QuantConfig
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from tools.quant_tool import QuantConfig
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class WalkForwardConfig:
+    # Đơn vị: số PHIÊN giao dịch (không phải ngày lịch)
+    MODE = "rolling"            # "rolling" (cửa sổ trượt) | "expanding" (cửa sổ mở rộng)
+    TRAIN_DAYS = 750            # ~3 năm
+    VALID_DAYS = 120            # ~6 tháng
+    STEP_DAYS = 120
+    PURGE_DAYS = QuantConfig.TARGET_HORIZON  # Target T+3 -> bỏ 3 phiên cuối train để nhãn không chồng lên tập valid
+    EMBARGO_DAYS = 2            # Khoảng đệm thêm chống tự tương quan
+
+    # Early stopping theo NDCG của tập valid
+    EVAL_METRIC = "ndcg@5"
+    EARLY_STOPPING_ROUNDS = 100
+
+    # Model production: NDCG của các fold đo trên các giai đoạn thị trường khác nhau -> không so sánh được,
+    # chỉ để báo cáo. "refit" = huấn luyện lại trên toàn lịch sử với số cây = trung vị best_iteration các fold.
+    SELECT = "refit"            # "refit" | "last" (model của fold gần nhất)
+    MIN_REFIT_ROUNDS = 50       # Sàn số cây khi refit (fold dừng sớm ở vòng 0 không kéo model về 1 cây)
+
+    # Song song: số fold chạy cùng lúc x số thread XGBoost mỗi fold
+    MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+    THREADS_PER_FOLD = 2
+
+    METRICS_PATH = os.path.join(QuantConfig.MODEL_DIR, "walkforward_metrics.json")
+
+# =============================================================================
+# 2. SPLITS
+# =============================================================================
+
+def make_walk_forward_splits(dates, train_days=WalkForwardConfig.TRAIN_DAYS,
+                             valid_days=WalkForwardConfig.VALID_DAYS,
+                             step_days=WalkForwardConfig.STEP_DAYS,
+                             purge_days=WalkForwardConfig.PURGE_DAYS,
+                             embargo_days=WalkForwardConfig.EMBARGO_DAYS,
+                             mode=WalkForwardConfig.MODE):
+    """
+    Chia các phiên (đã sort, unique) thành các fold Walk-Forward.
+    Mỗi fold: [train] -- gap (purge + embargo) -- [valid]. Trả về list dict chỉ số phiên (half-open).
+    Fold cuối luôn kết thúc ở phiên mới nhất.
+    """
+    n = len(dates)
+    gap = purge_days + embargo_days
+    folds = []
+
+    valid_end = n
+    while True:
+        valid_start = valid_end - valid_days
+        train_end = valid_start - gap
+        train_start = 0 if mode == "expanding" else train_end - train_days
+        if train_start < 0 or train_end - train_start < min(train_days, valid_days):
+            break
+        folds.append({
+            "train": (train_start, train_end),
+            "valid": (valid_start, valid_end),
+        })
+        valid_end -= step_days
+
+    folds.reverse()
+    for i, f in enumerate(folds):
+        f["fold"] = i
+    return folds
+
+# =============================================================================
+# 3. WORKER (chạy trong process con)
+# =============================================================================
+
+_SHARED = {}
+
+def _init_worker(matrix):
+    # Số thread mỗi fold do n_jobs của XGBRanker giới hạn (biến môi trường OMP_* đặt ở đây không có tác dụng:
+    # process con fork sau khi xgboost/numpy đã khởi tạo thread pool)
+    # matrix đã cache -> chỉ đường dẫn được pickle, process con memmap trực tiếp file .npy
+    # qid chính là chỉ số phiên (dữ liệu đã sort theo date)
+    _SHARED.update(X=matrix.X, y=matrix.y, qid=matrix.qid, target=matrix.target, day_index=matrix.qid)
+
+def daily_rank_ic(day_index, pred, target):
+    """Mean Spearman IC theo ngày (vectorized qua groupby rank)."""
+    df = pd.DataFrame({"d": day_index, "p": pred, "t": target})
+    ranks = df.groupby("d")[["p", "t"]].rank()
+    ranks["d"] = df["d"]
+    g = ranks.groupby("d")
+    cov = (ranks["p"] * ranks["t"]).groupby(ranks["d"]).mean() - g["p"].mean() * g["t"].mean()
+    ic = cov / (g["p"].std(ddof=0) * g["t"].std(ddof=0) + 1e-12)
+    return float(ic.mean())
+
+def _train_fold(fold, params, features, eval_metric, early_stopping_rounds, threads):
+    import xgboost as xgb
+
+    X, y, qid = _SHARED["X"], _SHARED["y"], _SHARED["qid"]
+    day_index = _SHARED["day_index"]
+
+    t0, t1 = fold["train"]
+    v0, v1 = fold["valid"]
+    # Dữ liệu đã sort theo phiên -> mỗi cửa sổ là một lát cắt liên tục (view, không copy)
+    tr = slice(*np.searchsorted(day_index, [t0, t1]))
+    va = slice(*np.searchsorted(day_index, [v0, v1]))
+
+    fold_params = dict(params)
+    fold_params.update(n_jobs=threads, eval_metric=eval_metric,
+                       early_stopping_rounds=early_stopping_rounds)
+    model = xgb.XGBRanker(**fold_params)
+
+    start = time.time()
+    model.fit(
+        pd.DataFrame(X[tr], columns=features), y[tr], qid=qid[tr],
+        eval_set=[(pd.DataFrame(X[va], columns=features), y[va])], eval_qid=[qid[va]],
+        verbose=False
+    )
+    fit_seconds = time.time() - start
+
+    history = model.evals_result()["validation_0"][eval_metric]
+    best_iter = int(getattr(model, "best_iteration", len(history) - 1))
+    pred = model.predict(pd.DataFrame(X[va], columns=features),
+                         iteration_range=(0, best_iter + 1))
+
+    return {
+        "fold": fold["fold"],
+        "n_train": int(tr.stop - tr.start),
+        "n_valid": int(va.stop - va.start),
+        "best_iteration": best_iter,
+        "valid_ndcg": float(history[best_iter]),
+        "valid_ic": daily_rank_ic(day_index[va], pred, _SHARED["target"][va]),
+        "fit_seconds": round(fit_seconds, 2),
+        # Cắt đúng số cây tới best_iteration (early stopping vẫn giữ thêm các vòng sau)
+        "model_raw": bytes(model.get_booster()[:best_iter + 1].save_raw("json")),
+    }
+
+# =============================================================================
+# 4. TRAINER
+# =============================================================================
+
+class WalkForwardTrainer:
+    def __init__(self, params=None, mode=WalkForwardConfig.MODE,
+                 train_days=WalkForwardConfig.TRAIN_DAYS, valid_days=WalkForwardConfig.VALID_DAYS,
+                 step_days=WalkForwardConfig.STEP_DAYS, purge_days=WalkForwardConfig.PURGE_DAYS,
+                 embargo_days=WalkForwardConfig.EMBARGO_DAYS, max_workers=WalkForwardConfig.MAX_WORKERS,
+                 threads_per_fold=WalkForwardConfig.THREADS_PER_FOLD, time_budget=None,
+                 select=WalkForwardConfig.SELECT, save=True):
+        if select not in ("refit", "last"):
+            raise ValueError(f"select không hợp lệ: {select}. Hợp lệ: 'refit' | 'last'")
+        self.params = dict(params or QuantConfig.RANKER_PARAMS)
+        self.split_kwargs = dict(mode=mode, train_days=train_days, valid_days=valid_days,
+                                 step_days=step_days, purge_days=purge_days, embargo_days=embargo_days)
+        self.max_workers = max_workers
+        self.threads_per_fold = threads_per_fold
+        self.time_budget = time_budget      # giây; fold chưa bắt đầu khi hết giờ sẽ bị hủy
+        self.select = select                # "refit" (toàn lịch sử, trung vị best_iteration) | "last" (fold gần nhất)
+        self.save = save
+
+    def run(self, matrix):
+        """matrix: TrainingMatrix (tools/quant_dataset.py)."""
+        dates = matrix.unique_dates
+        features = matrix.features
+        folds = make_walk_forward_splits(dates, **self.split_kwargs)
+        if not folds:
+            print("❌ [WalkForward] Không đủ lịch sử để chia fold.")
+            return {"folds": [], "selected": None}
+
+        print(f"🚀 [WalkForward] {len(folds)} fold ({self.split_kwargs['mode']}), "
+              f"{self.max_workers} worker x {self.threads_per_fold} thread...")
+
+        results, cancelled = self._run_folds(folds, features, matrix)
+
+        for r in results:
+            f = folds[r["fold"]]
+            r.update(
+                train_start=str(pd.Timestamp(dates[f["train"][0]]).date()),
+                train_end=str(pd.Timestamp(dates[f["train"][1] - 1]).date()),
+                valid_start=str(pd.Timestamp(dates[f["valid"][0]]).date()),
+                valid_end=str(pd.Timestamp(dates[f["valid"][1] - 1]).date()),
+            )
+            print(f"   Fold {r['fold']}: NDCG={r['valid_ndcg']:.4f} IC={r['valid_ic']:.4f} "
+                  f"best_iter={r['best_iteration']} ({r['fit_seconds']}s)")
+
+        selection = self._select(results, matrix, features, dates) if self.save else None
+        if selection is not None:
+            import joblib
+            import xgboost as xgb
+
+            booster = xgb.Booster()
+            booster.load_model(bytearray(selection.pop("model_raw")))
+            booster.set_attr(**{QuantConfig.GROUPING_ATTR: matrix.grouping})
+            booster.save_model(QuantConfig.MODEL_PATH)
+            joblib.dump(list(features), QuantConfig.FEATURE_PATH)
+            print(f"✅ [WalkForward] {selection['rule']} -> {QuantConfig.MODEL_PATH}")
+
+        metrics = [{k: v for k, v in r.items() if k != "model_raw"} for r in results]
+        report = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "params": {k: v for k, v in self.params.items()},
+            "splits": self.split_kwargs,
+            "folds": metrics,
+            "cancelled_folds": cancelled,
+            "selected": None if selection is None else selection["model"],
+            "selection": selection,
+        }
+        if self.save:
+            with open(WalkForwardConfig.METRICS_PATH, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            if selection is not None:
+                from tools.model_registry import ModelRegistry
+
+                # Metric fold chỉ để báo cáo (trung bình CV), không phải điểm của model đã lưu
+                report["run_id"] = ModelRegistry().log_run(
+                    "walk_forward", report["params"],
+                    {"cv_mean_ndcg": float(np.mean([m["valid_ndcg"] for m in metrics])),
+                     "cv_mean_ic": float(np.mean([m["valid_ic"] for m in metrics])),
+                     "n_folds": len(metrics)},
+                    artifacts={"model": QuantConfig.MODEL_PATH, "metrics": WalkForwardConfig.METRICS_PATH},
+                    tags={"selection": selection["rule"], "selected_model": selection["model"],
+                          "n_estimators": selection["n_estimators"], "zscore_grouping": matrix.grouping,
+                          "train_start": selection["train_start"], "train_end": selection["train_end"]}
+                )
+        return report
+
+    def _run_folds(self, folds, features, matrix):
+        deadline = None if self.time_budget is None else time.time() + self.time_budget
+        results, cancelled = [], []
+        args = (self.params, list(features), WalkForwardConfig.EVAL_METRIC,
+                WalkForwardConfig.EARLY_STOPPING_ROUNDS, self.threads_per_fold)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                 initargs=(matrix,)) as pool:
+            # Fold gần nhất nộp trước: nếu hết giờ thì vẫn có model mới nhất
+            pending = {pool.submit(_train_fold, f, *args): f["fold"] for f in reversed(folds)}
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.time())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    fold_id = pending.pop(fut)
+                    try:
+                        results.append(fut.result())
+                    except Exception as e:
+                        print(f"⚠️ [WalkForward] Fold {fold_id} lỗi: {e}")
+                if deadline is not None and time.time() >= deadline:
+                    for fut, fold_id in list(pending.items()):
+                        if fut.cancel():
+                            cancelled.append(fold_id)
+                            pending.pop(fut)
+                    if pending:
+                        # Fold đang chạy dở: đợi xong để không bỏ phí công sức
+                        for fut in wait(pending).done:
+                            fold_id = pending.pop(fut)
+                            try:
+                                results.append(fut.result())
+                            except Exception as e:
+                                print(f"⚠️ [WalkForward] Fold {fold_id} lỗi: {e}")
+                    if cancelled:
+                        print(f"⏱️ [WalkForward] Hết ngân sách thời gian, hủy {len(cancelled)} fold.")
+
+        results.sort(key=lambda r: r["fold"])
+        return results, sorted(cancelled)
+
+    def _select(self, results, matrix, features, dates):
+        """Model production + quy tắc chọn (ghi vào metrics và registry)."""
+        if not results:
+            return None
+        if self.select == "last":
+            r = results[-1]
+            return {"rule": f"last_fold ({r['fold']})", "model": r["fold"], "model_raw": r["model_raw"],
+                    "n_estimators": r["best_iteration"] + 1,
+                    "train_start": r["train_start"], "train_end": r["train_end"]}
+
+        best_iters = [r["best_iteration"] for r in results]
+        n_estimators = max(int(np.median(best_iters)) + 1, WalkForwardConfig.MIN_REFIT_ROUNDS)
+        print(f"🔁 [WalkForward] Refit toàn lịch sử ({len(dates)} phiên), {n_estimators} cây "
+              f"(trung vị best_iteration {best_iters})...")
+        return {"rule": "refit_full_history_median_best_iteration", "model": "refit",
+                "model_raw": self._refit(matrix, features, n_estimators),
+                "n_estimators": n_estimators, "fold_best_iterations": best_iters,
+                "train_start": str(pd.Timestamp(dates[0]).date()), "train_end": str(pd.Timestamp(dates[-1]).date())}
+
+    def _refit(self, matrix, features, n_estimators):
+        import xgboost as xgb
+
+        params = dict(self.params)
+        params.update(n_estimators=n_estimators)
+        params.pop("early_stopping_rounds", None)
+        model = xgb.XGBRanker(**params)
+        model.fit(pd.DataFrame(matrix.X, columns=features), matrix.y, qid=matrix.qid, verbose=False)
+        return bytes(model.get_booster().save_raw("json"))
+
+
+if __name__ == "__main__":
+    from tools.quant_tool import QuantToolkit
+
+    report = QuantToolkit().train_walk_forward()
+    for m in report.get("folds", []):
+        print(m)
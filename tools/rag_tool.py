@@ -1,6 +1,7 @@
 import asyncio
 # Giả sử thư mục rag_engine nằm trong libs/
 from libs.rag_engine.retrieval import query_func
+from core.clients import close_clients
 
 class FinancialRAGTool:
     @staticmethod
@@ -26,4 +27,9 @@ class FinancialRAGTool:
     @staticmethod
     def analyze_report_sync(query: str, ticker: str = None) -> str:
         """Phiên bản Sync để dùng cho các Agent không hỗ trợ Async."""
-        return asyncio.run(FinancialRAGTool.analyze_report_async(query, ticker))
\ No newline at end of file
+        async def _run():
+            try:
+                return await FinancialRAGTool.analyze_report_async(query, ticker)
+            finally:
+                await close_clients()   # asyncio.run tạo loop riêng -> đóng pool LLM trước khi loop kết thúc
+        return asyncio.run(_run())
\ No newline at end of file
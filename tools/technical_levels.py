@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    from database.repo import DataRepository
+    from database.snapshots import JsonSnapshot, session_window_start
+    from tools.indicators import atr, sma
+    from tools.technical_scanner import align_bars
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from database.repo import DataRepository
+    from database.snapshots import JsonSnapshot, session_window_start
+    from tools.indicators import atr, sma
+    from tools.technical_scanner import align_bars
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class LevelConfig:
+    STORE_DIR = os.path.join("data", "levels")
+    STORE_PATH = os.path.join(STORE_DIR, "levels.json")
+
+    LOOKBACK = 250              # Số phiên mỗi mã dùng để tìm vùng giá (~1 năm)
+    FIELDS = ("open", "high", "low", "close", "volume")
+    MIN_BARS = 60
+
+    # --- Swing high/low: đỉnh/đáy cao/thấp nhất trong ±PIVOT_WINDOW phiên ---
+    PIVOT_WINDOW = 5
+    CLUSTER_TOL = 0.015         # Các swing cách nhau <= 1.5% giá -> cùng 1 vùng
+    MIN_TOUCHES = 2             # Vùng pivot cần >= 2 lần chạm
+
+    # --- Volume profile (phân bổ khối lượng theo giá) ---
+    VP_LOOKBACK = 120
+    VP_BINS = 40
+    VP_TOP_NODES = 3            # Số nút khối lượng lớn (HVN) giữ lại
+    VP_MIN_SHARE = 1.2          # HVN phải >= 1.2x khối lượng trung bình 1 bin
+
+    N_LEVELS = 3                # Số vùng hỗ trợ / kháng cự gần nhất trả về mỗi phía
+    STOP_ATR_MULT = 0.5         # Gợi ý cắt lỗ = hỗ trợ gần nhất - 0.5 ATR
+
+    # --- Mẫu hình ---
+    BREAKOUT_WINDOW = 20
+    VOL_CONFIRM = 1.5           # Breakout kèm volume > 1.5x TB20
+    DOUBLE_MIN_SEP = 10         # 2 đỉnh/đáy của mẫu hình đôi cách nhau >= 10 phiên
+
+# =============================================================================
+# 2. VECTORIZED DETECTION (DataFrame phiên x mã đã dồn bằng align_bars)
+# =============================================================================
+
+def swing_points(high, low, k=LevelConfig.PIVOT_WINDOW):
+    """Cờ swing high/low đã xác nhận (đủ k phiên mỗi bên)."""
+    w = 2 * k + 1
+    is_high = (high == high.rolling(w, center=True).max()) & high.notna()
+    is_low = (low == low.rolling(w, center=True).min()) & low.notna()
+    return is_high, is_low
+
+def _long(mask, values, kind):
+    """Cờ (phiên x mã) -> bảng dài (col, row, price, kind)."""
+    rows, cols = np.nonzero(mask.to_numpy())
+    return pd.DataFrame({"col": cols, "row": rows, "price": values.to_numpy()[rows, cols], "kind": kind})
+
+def pivot_clusters(swings: pd.DataFrame, tol=LevelConfig.CLUSTER_TOL, min_touches=LevelConfig.MIN_TOUCHES):
+    """
+    Gom các swing gần giá nhau thành vùng (mọi mã cùng lúc): sort theo (mã, giá),
+    bắt đầu vùng mới khi đổi mã hoặc giá cách swing trước > tol.
+    """
+    if swings.empty:
+        return pd.DataFrame(columns=["col", "price", "touches", "last_row"])
+    s = swings.sort_values(["col", "price"])
+    price, col = s["price"].to_numpy(), s["col"].to_numpy()
+    new = np.ones(len(s), dtype=bool)
+    new[1:] = (col[1:] != col[:-1]) | (price[1:] > price[:-1] * (1 + tol))
+    s = s.assign(cid=np.cumsum(new))
+    g = s.groupby("cid")
+    out = pd.DataFrame({"col": g["col"].first(), "price": g["price"].mean(),
+                        "touches": g["price"].size(), "last_row": g["row"].max()})
+    return out[out["touches"] >= min_touches].reset_index(drop=True)
+
+def volume_nodes(high, low, close, volume, bins=LevelConfig.VP_BINS, top=LevelConfig.VP_TOP_NODES,
+                 min_share=LevelConfig.VP_MIN_SHARE):
+    """
+    Volume profile cho mọi mã bằng 1 lần bincount trên chỉ số phẳng (mã x bin).
+    Trả về (bảng nút HVN: col, price, share; POC theo mã).
+    """
+    h, l, c, v = (x.to_numpy(dtype=float) for x in (high, low, close, volume))
+    n_tickers = h.shape[1]
+    lo, hi = np.nanmin(l, axis=0), np.nanmax(h, axis=0)
+    span = np.where(hi > lo, hi - lo, np.nan)
+    tp = (h + l + c) / 3
+    b = np.floor((tp - lo) / span * bins)
+    ok = np.isfinite(b) & np.isfinite(v)
+    cols = np.broadcast_to(np.arange(n_tickers), tp.shape)
+    flat = cols[ok] * bins + np.clip(b[ok], 0, bins - 1).astype(np.int64)
+    profile = np.bincount(flat, weights=v[ok], minlength=n_tickers * bins).reshape(n_tickers, bins)
+
+    centers = lo[:, None] + (np.arange(bins)[None, :] + 0.5) * (span[:, None] / bins)
+    poc = pd.Series(centers[np.arange(n_tickers), profile.argmax(axis=1)], index=high.columns)
+    poc[profile.sum(axis=1) == 0] = np.nan
+
+    # Nút = cực đại địa phương của profile và đủ lớn so với trung bình
+    padded = np.pad(profile, ((0, 0), (1, 1)), constant_values=-1)
+    local_max = (profile >= padded[:, :-2]) & (profile >= padded[:, 2:])
+    mean_bin = profile.mean(axis=1, keepdims=True)
+    strong = local_max & (profile >= min_share * mean_bin) & (profile > 0)
+    share = profile / np.where(profile.sum(axis=1, keepdims=True) > 0, profile.sum(axis=1, keepdims=True), 1)
+    rows, bins_idx = np.nonzero(strong)
+    nodes = pd.DataFrame({"col": rows, "price": centers[rows, bins_idx], "share": share[rows, bins_idx]})
+    nodes = nodes.sort_values(["col", "share"], ascending=[True, False]).groupby("col").head(top)
+    return nodes.reset_index(drop=True), poc
+
+def candle_patterns(o, h, l, c) -> dict:
+    """Mẫu nến tại phiên cuối của mọi mã: {tên: Series bool theo mã}."""
+    O, H, L, C = (x.iloc[-3:].to_numpy(dtype=float) for x in (o, h, l, c))
+    body, rng = np.abs(C - O), H - L
+    upper, lower = H - np.maximum(O, C), np.minimum(O, C) - L
+    bull, bear = C > O, C < O
+    with np.errstate(invalid="ignore"):
+        out = {
+            "doji": body[-1] <= 0.1 * rng[-1],
+            "hammer": (lower[-1] >= 2 * body[-1]) & (upper[-1] <= 0.5 * body[-1]) & (body[-1] > 0),
+            "shooting_star": (upper[-1] >= 2 * body[-1]) & (lower[-1] <= 0.5 * body[-1]) & (body[-1] > 0),
+            "bullish_engulfing": bear[-2] & bull[-1] & (O[-1] <= C[-2]) & (C[-1] >= O[-2]),
+            "bearish_engulfing": bull[-2] & bear[-1] & (O[-1] >= C[-2]) & (C[-1] <= O[-2]),
+            "morning_star": bear[-3] & (body[-2] < 0.5 * body[-3]) & bull[-1] & (C[-1] > (O[-3] + C[-3]) / 2),
+            "evening_star": bull[-3] & (body[-2] < 0.5 * body[-3]) & bear[-1] & (C[-1] < (O[-3] + C[-3]) / 2),
+            "inside_bar": (H[-1] < H[-2]) & (L[-1] > L[-2]),
+        }
+    return {k: pd.Series(v, index=c.columns) for k, v in out.items()}
+
+def chart_patterns(high, low, close, volume, swings_high, swings_low) -> dict:
+    """Breakout/breakdown N phiên, đỉnh/đáy đôi, cấu trúc đỉnh-đáy (HH/HL, LH/LL) tại phiên cuối."""
+    c = LevelConfig
+    prior_high = high.shift(1).rolling(c.BREAKOUT_WINDOW).max().iloc[-1]
+    prior_low = low.shift(1).rolling(c.BREAKOUT_WINDOW).min().iloc[-1]
+    last_close = close.iloc[-1]
+    vol_spike = volume.iloc[-1] > c.VOL_CONFIRM * sma(volume, 20).iloc[-1]
+    out = {
+        "breakout": last_close > prior_high,
+        "breakout_volume": (last_close > prior_high) & vol_spike,
+        "breakdown": last_close < prior_low,
+    }
+
+    def last_two(sw):
+        # 2 swing gần nhất mỗi mã: (giá mới, giá trước, khoảng cách phiên)
+        t = sw.sort_values(["col", "row"]).groupby("col").tail(2)
+        g = t.groupby("col")
+        both = g.size() == 2
+        p1, p0 = g["price"].last()[both], g["price"].first()[both]
+        sep = (g["row"].last() - g["row"].first())[both]
+        idx = close.columns[p1.index]
+        return (pd.Series(p1.to_numpy(), index=idx), pd.Series(p0.to_numpy(), index=idx),
+                pd.Series(sep.to_numpy(), index=idx))
+
+    h1, h0, hsep = last_two(swings_high)
+    l1, l0, lsep = last_two(swings_low)
+    near = lambda a, b: (a - b).abs() <= c.CLUSTER_TOL * b
+    cl = last_close
+    out["double_top"] = (near(h1, h0) & (hsep >= c.DOUBLE_MIN_SEP) & (cl.reindex(h1.index) < h1))
+    out["double_bottom"] = (near(l1, l0) & (lsep >= c.DOUBLE_MIN_SEP) & (cl.reindex(l1.index) > l1))
+    hh, hl = (h1 > h0).reindex(close.columns), (l1 > l0).reindex(close.columns)
+    lh, ll = (h1 < h0).reindex(close.columns), (l1 < l0).reindex(close.columns)
+    out["higher_highs_lows"] = hh.fillna(False).astype(bool) & hl.fillna(False).astype(bool)
+    out["lower_highs_lows"] = lh.fillna(False).astype(bool) & ll.fillna(False).astype(bool)
+    return {k: v.reindex(close.columns).fillna(False).astype(bool) for k, v in out.items()}
+
+# =============================================================================
+# 3. ENGINE (panel -> vùng giá + mẫu hình cho mọi mã) & STORE
+# =============================================================================
+
+def _nearest(cands, close, side, n, tol):
+    """Lọc phía (support < close < resistance), gộp vùng trùng trong tol (giữ vùng mạnh hơn), lấy n vùng gần nhất."""
+    picked = []
+    side_cands = [x for x in cands if (x["price"] < close if side == "support" else x["price"] > close)]
+    for x in sorted(side_cands, key=lambda x: abs(x["price"] - close)):
+        dup = next((p for p in picked if abs(p["price"] - x["price"]) <= tol * x["price"]), None)
+        if dup is None:
+            if len(picked) >= n:
+                break
+            picked.append(x)
+        elif x["strength"] > dup["strength"]:
+            picked[picked.index(dup)] = x
+    return picked
+
+def compute_levels(panel: dict, min_bars=LevelConfig.MIN_BARS) -> dict:
+    """Panel thô {field: DataFrame date x ticker} -> {ticker: entry} (vùng giá, POC, ATR, mẫu hình)."""
+    c = LevelConfig
+    if not panel or len(panel["close"]) < 3:
+        return {}
+    aligned, last_date, bars = align_bars(panel)
+    o, h, l, cl, v = (aligned[f] for f in c.FIELDS)
+    n_rows = len(cl)
+
+    is_high, is_low = swing_points(h, l)
+    sw_high, sw_low = _long(is_high, h, "high"), _long(is_low, l, "low")
+    clusters = pivot_clusters(pd.concat([sw_high, sw_low], ignore_index=True))
+    vp = slice(max(0, n_rows - c.VP_LOOKBACK), n_rows)
+    nodes, poc = volume_nodes(h.iloc[vp], l.iloc[vp], cl.iloc[vp], v.iloc[vp])
+    atr_last = atr(h, l, cl).iloc[-1]
+    candles = candle_patterns(o, h, l, cl)
+    charts = chart_patterns(h, l, cl, v, sw_high, sw_low)
+    last_swing_high = sw_high.sort_values("row").groupby("col").last()
+    last_swing_low = sw_low.sort_values("row").groupby("col").last()
+
+    # Ứng viên theo mã (bảng nhỏ) -> ghép vào từng entry
+    cand = {}
+    for r in clusters.itertuples(index=False):
+        recency = (r.last_row + 1) / n_rows
+        cand.setdefault(r.col, []).append({"price": r.price, "kind": "pivot", "touches": int(r.touches),
+                                           "strength": round(r.touches + recency, 3)})
+    for r in nodes.itertuples(index=False):
+        cand.setdefault(r.col, []).append({"price": r.price, "kind": "volume", "share": round(float(r.share), 4),
+                                           "strength": round(1 + 10 * float(r.share), 3)})
+    for frame, kind in ((last_swing_high, "swing_high"), (last_swing_low, "swing_low")):
+        for col, r in frame.iterrows():
+            cand.setdefault(col, []).append({"price": r["price"], "kind": kind, "strength": 1.0})
+
+    patterns = {**candles, **charts}
+    pattern_frame = pd.DataFrame(patterns)
+    levels = {}
+    for j, ticker in enumerate(cl.columns):
+        if bars[ticker] < min_bars:
+            continue
+        close = float(cl[ticker].iloc[-1])
+        items = [dict(x, price=round(float(x["price"]), 2)) for x in cand.get(j, [])]
+        supports = _nearest(items, close, "support", c.N_LEVELS, c.CLUSTER_TOL)
+        resistances = _nearest(items, close, "resistance", c.N_LEVELS, c.CLUSTER_TOL)
+        a = float(atr_last[ticker]) if np.isfinite(atr_last[ticker]) else None
+        stop = round(supports[0]["price"] - c.STOP_ATR_MULT * a, 2) if supports and a else None
+        levels[ticker] = {
+            "date": pd.Timestamp(last_date[ticker]).strftime("%Y-%m-%d"),
+            "close": round(close, 2),
+            "atr": round(a, 2) if a else None,
+            "poc": round(float(poc[ticker]), 2) if np.isfinite(poc[ticker]) else None,
+            "supports": supports,
+            "resistances": resistances,
+            "stop_hint": stop,
+            "patterns": [k for k, flag in pattern_frame.loc[ticker].items() if flag],
+        }
+    return levels
+
+class LevelEngine:
+    """Tính vùng giá + mẫu hình cho cả universe trong 1 lượt (chạy hằng đêm sau crawl) và lưu ra store."""
+    def __init__(self, repo=None, lookback=LevelConfig.LOOKBACK, store_path=LevelConfig.STORE_PATH):
+        self.repo = repo
+        self.lookback = lookback
+        self.store_path = store_path
+
+    def compute(self, tickers=None) -> dict:
+        repo = self.repo or DataRepository()
+        try:
+            tickers = [t.upper().strip() for t in tickers] if tickers else repo.get_tickers()
+            if not tickers:
+                return {}
+            panel = repo.get_price_panel(tickers, days=self.lookback, fields=LevelConfig.FIELDS,
+                                         start=session_window_start(self.lookback))
+            return compute_levels(panel)
+        finally:
+            if self.repo is None:
+                repo.close()
+
+    def build(self, tickers=None) -> dict:
+        t0 = time.time()
+        levels = self.compute(tickers)
+        if not levels:
+            return {"error": "Không có dữ liệu giá để tính vùng giá."}
+        os.makedirs(os.path.dirname(self.store_path) or ".", exist_ok=True)
+        tmp = f"{self.store_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"built_at": datetime.now().isoformat(timespec="seconds"), "tickers": levels},
+                      f, ensure_ascii=False)
+        os.replace(tmp, self.store_path)
+        print(f"📐 [Levels] {len(levels)} mã -> {self.store_path} ({time.time() - t0:.1f}s)")
+        return {"tickers": len(levels), "path": self.store_path}
+
+class LevelStore:
+    """Tra cứu O(1) vùng giá đã tính sẵn; đọc lại file chỉ khi file đổi."""
+    _file = JsonSnapshot()
+
+    @staticmethod
+    def get(ticker: str, path=LevelConfig.STORE_PATH):
+        return LevelStore._file.load(path).get("tickers", {}).get(ticker.upper().strip())
+
+# =============================================================================
+# 4. RENDERING
+# =============================================================================
+
+PATTERN_LABELS = {
+    "doji": "Doji", "hammer": "Hammer (búa)", "shooting_star": "Shooting Star",
+    "bullish_engulfing": "Nhấn chìm tăng", "bearish_engulfing": "Nhấn chìm giảm",
+    "morning_star": "Sao mai", "evening_star": "Sao hôm", "inside_bar": "Inside bar",
+    "breakout": "Vượt đỉnh 20 phiên", "breakout_volume": "Vượt đỉnh kèm volume",
+    "breakdown": "Thủng đáy 20 phiên", "double_top": "Hai đỉnh", "double_bottom": "Hai đáy",
+    "higher_highs_lows": "Đỉnh/đáy sau cao hơn", "lower_highs_lows": "Đỉnh/đáy sau thấp hơn",
+}
+
+LEVEL_LABELS = {"pivot": "pivot", "volume": "nút volume", "swing_high": "đỉnh swing", "swing_low": "đáy swing"}
+
+def _fmt_level(x):
+    extra = f", {x['touches']} lần chạm" if x.get("touches") else f", {x['share']:.0%} KL" if x.get("share") else ""
+    return f"{x['price']:,.0f} ({LEVEL_LABELS.get(x['kind'], x['kind'])}{extra})"
+
+def render_levels(entry: dict) -> str:
+    """Mục "vùng giá & mẫu hình" cho báo cáo kỹ thuật / prompt của TechnicalAgent."""
+    if not entry:
+        return ""
+    sup = "; ".join(_fmt_level(x) for x in entry["supports"]) or "Không có"
+    res = "; ".join(_fmt_level(x) for x in entry["resistances"]) or "Không có"
+    pats = ", ".join(PATTERN_LABELS.get(p, p) for p in entry["patterns"]) or "Không có"
+    poc = f"{entry['poc']:,.0f}" if entry.get("poc") else "N/A"
+    atr_txt = f"{entry['atr']:,.0f}" if entry.get("atr") else "N/A"
+    stop = f"{entry['stop_hint']:,.0f}" if entry.get("stop_hint") else "N/A"
+    return f"""
+            **4. VÙNG GIÁ & MẪU HÌNH (ngày {entry['date']}):**
+            - Hỗ trợ: {sup}
+            - Kháng cự: {res}
+            - POC (vùng khối lượng lớn nhất): {poc} | ATR(14): {atr_txt}
+            - Gợi ý cắt lỗ (hỗ trợ gần nhất - {LevelConfig.STOP_ATR_MULT} ATR): {stop}
+            - Mẫu hình phiên cuối: {pats}
+            """
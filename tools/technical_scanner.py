@@ -0,0 +1,241 @@
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    from database.repo import DataRepository
+    from database import versions
+    from database.snapshots import session_window_start
+    from tools.indicators import compute_indicators, IndicatorSnapshot, SNAPSHOTS
+except ImportError:
+    import sys
+    sys.path.append(os.getcwd())
+    from database.repo import DataRepository
+    from database import versions
+    from database.snapshots import session_window_start
+    from tools.indicators import compute_indicators, IndicatorSnapshot, SNAPSHOTS
+
+# =============================================================================
+# 1. CONFIGURATION
+# =============================================================================
+
+class ScannerConfig:
+    LOOKBACK = 365              # Số phiên mỗi mã (giống get_technical_report -> cùng giá trị EMA/MACD)
+    MIN_BARS = 30               # Mã ít phiên hơn -> bỏ qua
+    FIELDS = ("high", "low", "close", "volume")
+
+    RSI_OVERBOUGHT = 70
+    RSI_OVERSOLD = 30
+    STOCH_LOW = 0.2
+    STOCH_HIGH = 0.8
+    VOL_SPIKE = 1.5             # Volume > 1.5x TB20 = đột biến
+    VOL_LOW = 0.7
+    SR_WINDOW = 20              # Hỗ trợ/kháng cự = đáy/đỉnh N phiên
+    SR_NEAR = 0.02              # Cách hỗ trợ/kháng cự <= 2% = "gần"
+
+# =============================================================================
+# 2. PANEL -> BẢNG CHỈ BÁO (công thức ở tools/indicators.py, tính 1 lượt cho mọi cột)
+# =============================================================================
+
+def align_bars(panel: dict, key: str = "close"):
+    """
+    Dồn các phiên có dữ liệu của từng mã xuống cuối panel (bỏ lỗ NaN do chưa niêm yết / tạm ngừng).
+    Sau bước này rolling/ewm theo cột = tính trên chuỗi phiên của chính mã đó (như khi đọc từng mã).
+    Trả về (panel đã dồn, ngày cuối của từng mã, số phiên của từng mã).
+    """
+    base = panel[key]
+    valid = base.notna().to_numpy()
+    order = np.argsort(valid, axis=0, kind="stable")      # NaN lên đầu, giữ thứ tự thời gian
+    aligned = {
+        f: pd.DataFrame(np.take_along_axis(w.to_numpy(dtype=float), order, axis=0), columns=base.columns)
+        for f, w in panel.items()
+    }
+    dates = np.broadcast_to(base.index.to_numpy()[:, None], valid.shape)
+    last_date = pd.Series(np.take_along_axis(dates, order, axis=0)[-1], index=base.columns)
+    return aligned, last_date, pd.Series(valid.sum(axis=0), index=base.columns)
+
+def build_table(panel: dict, min_bars: int = ScannerConfig.MIN_BARS) -> pd.DataFrame:
+    """Panel thô {field: DataFrame (date x ticker)} -> bảng chỉ báo phiên cuối, 1 dòng / mã."""
+    if not panel or panel["close"].empty:
+        return pd.DataFrame()
+    aligned, last_date, bars = align_bars(panel)
+    ind = compute_indicators(aligned, sr_window=ScannerConfig.SR_WINDOW)
+    close = aligned["close"]
+
+    t = pd.DataFrame({"date": last_date, "bars": bars})
+    t["close"] = close.iloc[-1]
+    t["prev_close"] = close.iloc[-2] if len(close) > 1 else np.nan
+    t["change_pct"] = (t["close"] / t["prev_close"] - 1) * 100
+    t["volume"] = aligned["volume"].iloc[-1]
+    for name, frame in ind.items():
+        t[name] = frame.iloc[-1]
+    t["macd_hist"] = t["macd"] - t["macd_signal"]
+    t["vol_ratio"] = t["volume"] / t["vol_ma20"]
+
+    # --- Cờ / trạng thái (giống ngưỡng trong báo cáo text) ---
+    c = ScannerConfig
+    t["above_sma50"] = t["close"] > t["sma50"]
+    t["above_sma200"] = t["close"] > t["sma200"]
+    t["ichimoku_bull"] = t["tenkan"] > t["kijun"]
+    t["macd_bull"] = t["macd"] > t["macd_signal"]
+    t["rsi_zone"] = np.select([t["rsi"] > c.RSI_OVERBOUGHT, t["rsi"] < c.RSI_OVERSOLD],
+                              ["overbought", "oversold"], "neutral")
+    t["stoch_zone"] = np.select([t["stoch_rsi"] < c.STOCH_LOW, t["stoch_rsi"] > c.STOCH_HIGH],
+                                ["low", "high"], "mid")
+    t["bb_position"] = np.select([t["close"] > t["bb_upper"], t["close"] < t["bb_lower"]],
+                                 ["above", "below"], "inside")
+    t["vol_status"] = np.select([t["volume"] > c.VOL_SPIKE * t["vol_ma20"], t["volume"] < c.VOL_LOW * t["vol_ma20"]],
+                                ["spike", "low"], "normal")
+    t.index.name = "ticker"
+    return t[t["bars"] >= min_bars]
+
+# --- Bộ lọc có tên (an toàn hơn nhận biểu thức tự do từ LLM) ---
+SCREENS = {
+    "oversold": lambda t: t["rsi"] < ScannerConfig.RSI_OVERSOLD,
+    "overbought": lambda t: t["rsi"] > ScannerConfig.RSI_OVERBOUGHT,
+    "above_sma200": lambda t: t["above_sma200"],
+    "below_sma200": lambda t: t["close"] < t["sma200"],
+    "above_sma50": lambda t: t["above_sma50"],
+    "below_sma50": lambda t: t["close"] < t["sma50"],
+    "uptrend": lambda t: t["above_sma50"] & t["above_sma200"],
+    "golden_cross": lambda t: t["sma50"] > t["sma200"],
+    "death_cross": lambda t: t["sma50"] < t["sma200"],
+    "stoch_low": lambda t: t["stoch_zone"] == "low",
+    "stoch_high": lambda t: t["stoch_zone"] == "high",
+    "macd_bull": lambda t: t["macd_bull"],
+    "macd_bear": lambda t: t["macd"] < t["macd_signal"],
+    "ichimoku_bull": lambda t: t["ichimoku_bull"],
+    "ichimoku_bear": lambda t: t["tenkan"] < t["kijun"],
+    "bb_breakout": lambda t: t["bb_position"] == "above",
+    "bb_breakdown": lambda t: t["bb_position"] == "below",
+    "vol_spike": lambda t: t["vol_status"] == "spike",
+    "near_support": lambda t: t["close"] <= t["support"] * (1 + ScannerConfig.SR_NEAR),
+    "near_resistance": lambda t: t["close"] >= t["resistance"] * (1 - ScannerConfig.SR_NEAR),
+}
+
+def screen(table: pd.DataFrame, names) -> pd.DataFrame:
+    """Lọc bảng theo các bộ lọc có tên (AND). Tên không hợp lệ -> ValueError."""
+    unknown = [n for n in names if n not in SCREENS]
+    if unknown:
+        raise ValueError(f"Bộ lọc không hợp lệ: {unknown}. Hợp lệ: {sorted(SCREENS)}")
+    mask = pd.Series(True, index=table.index)
+    for n in names:
+        mask &= SCREENS[n](table).fillna(False).astype(bool)
+    return table[mask]
+
+# =============================================================================
+# 3. RENDERING
+# =============================================================================
+
+def render_report(snap: IndicatorSnapshot) -> str:
+    """Báo cáo kỹ thuật dạng text của 1 mã từ snapshot."""
+    c = ScannerConfig
+    trend_long = "UPTREND" if snap.above_sma200 else "DOWNTREND"
+    trend_short = "BULLISH" if snap.above_sma50 else "BEARISH"
+    ichimoku_sig = "Tích cực" if snap.ichimoku_bull else "Tiêu cực"
+    rsi_status = {"overbought": "QUÁ MUA (>70)", "oversold": "QUÁ BÁN (<30)"}.get(snap.rsi_zone, "Trung tính")
+    stoch_status = {"low": "Vùng đáy", "high": "Vùng đỉnh"}.get(snap.stoch_zone, "Trung gian")
+    macd_status = "MUA (Cắt lên)" if snap.macd_bull else "BÁN (Cắt xuống)"
+    vol_status = {"spike": "Đột biến", "low": "Thấp"}.get(snap.vol_status, "Trung bình")
+    bb_pos = {"above": "TRÊN", "below": "DƯỚI"}.get(snap.bb_position, "GIỮA")
+
+    return f"""
+            ### 📊 PHÂN TÍCH KỸ THUẬT NÂNG CAO: {snap.ticker}
+
+            **1. CẤU TRÚC GIÁ & XU HƯỚNG:**
+            - Giá hiện tại: {snap.close:,.0f} VND ({trend_short} ngắn hạn / {trend_long} dài hạn)
+            - Hỗ trợ gần nhất ({c.SR_WINDOW}d): {snap.support:,.0f}
+            - Kháng cự gần nhất ({c.SR_WINDOW}d): {snap.resistance:,.0f}
+            - Ichimoku (Tenkan/Kijun): {ichimoku_sig}
+
+            **2. ĐỘNG LƯỢNG (MOMENTUM):**
+            - RSI (14): {snap.rsi:.2f} [{rsi_status}]
+            - Stoch RSI: {snap.stoch_rsi:.2f} (0-1) - {stoch_status}
+            - MACD: {macd_status} (Histogram: {snap.macd_hist:.2f})
+
+            **3. BIẾN ĐỘNG & THANH KHOẢN:**
+            - Bollinger Bands: Giá đang ở {bb_pos} dải băng.
+            - Volume: {snap.volume:,.0f} ({vol_status} so với TB 20 phiên)
+            """
+
+def snapshot_from_frame(symbol: str, df: pd.DataFrame):
+    """
+    Snapshot chỉ báo phiên cuối từ lịch sử 1 mã (cột date/high/low/close/volume), có cache theo (mã, ngày).
+    df nên có ScannerConfig.LOOKBACK phiên để khớp với bảng của scanner. Không đủ dữ liệu -> None.
+    """
+    if df.empty:
+        return None
+    snap = SNAPSHOTS.get(symbol, df['date'].iloc[-1])
+    if snap is not None:
+        return snap
+    bars = df.set_index('date')
+    table = build_table({f: bars[[f]].rename(columns={f: symbol}) for f in ScannerConfig.FIELDS}, min_bars=2)
+    if table.empty:
+        return None
+    snap = IndicatorSnapshot.from_row(symbol, table.iloc[0])
+    SNAPSHOTS.put(snap)
+    return snap
+
+TABLE_COLUMNS = ["date", "close", "change_pct", "rsi", "stoch_rsi", "macd_hist", "sma50", "sma200",
+                 "above_sma200", "ichimoku_bull", "bb_position", "support", "resistance", "vol_ratio", "vol_status"]
+
+def to_records(table: pd.DataFrame, columns=TABLE_COLUMNS) -> list:
+    """Bảng -> list dict gọn (làm tròn, ngày dạng chuỗi) để trả qua MCP/JSON."""
+    out = table[columns].copy()
+    out["date"] = pd.to_datetime(out["date"]).dt.strftime("%Y-%m-%d")
+    out = out.round(2).astype(object).where(out.notna(), None)
+    return out.reset_index().to_dict(orient="records")
+
+# =============================================================================
+# 4. SCANNER
+# =============================================================================
+
+class TechnicalScanner:
+    """
+    Quét kỹ thuật cả universe: 1 query panel + 1 lượt tính vector hóa cho mọi mã.
+    Bảng được cache theo phiên bản dữ liệu (database/versions.py): có bar mới -> quét lại.
+    """
+    _cache = {}
+
+    def __init__(self, repo=None, lookback=ScannerConfig.LOOKBACK):
+        self.repo = repo
+        self.lookback = lookback
+
+    def _load_panel(self, repo, tickers):
+        # Lọc ngày ngay trong SQL (dư cho cuối tuần/lễ); mã ngừng giao dịch lâu có thể ít phiên hơn
+        return repo.get_price_panel(tickers, days=self.lookback, fields=ScannerConfig.FIELDS,
+                                    start=session_window_start(self.lookback))
+
+    def scan(self, tickers=None) -> pd.DataFrame:
+        """Bảng chỉ báo phiên cuối cho danh sách mã (None = mọi mã có dữ liệu trong DB)."""
+        repo = self.repo or DataRepository()
+        try:
+            tickers = [t.upper().strip() for t in tickers] if tickers else repo.get_tickers()
+            if not tickers:
+                return pd.DataFrame()
+            current = versions.current()
+            key = (tuple(tickers), self.lookback)
+            stamp = (pd.Timestamp.now().date(), tuple(current.get(t, 0) for t in tickers))
+            cached = TechnicalScanner._cache.get(key)
+            if cached and cached[0] == stamp:
+                return cached[1]
+
+            table = build_table(self._load_panel(repo, tickers))
+            TechnicalScanner._cache = {key: (stamp, table)}     # Chỉ giữ lần quét gần nhất
+            if self.lookback == ScannerConfig.LOOKBACK:
+                # Cùng cửa sổ với báo cáo từng mã -> nạp sẵn snapshot cho agent/chart
+                for ticker, row in table.iterrows():
+                    SNAPSHOTS.put(IndicatorSnapshot.from_row(ticker, row))
+            return table
+        finally:
+            if self.repo is None:
+                repo.close()
+
+    def snapshot(self, symbol: str):
+        symbol = symbol.upper().strip()
+        table = self.scan([symbol])
+        return IndicatorSnapshot.from_row(symbol, table.loc[symbol]) if symbol in table.index else None
+
+    def report(self, symbol: str) -> str:
+        snap = self.snapshot(symbol)
+        return render_report(snap) if snap else "⚠️ Không có dữ liệu giá."